@@ -1,184 +1,263 @@
-from flask import Flask, request, jsonify, render_template, send_file
+from flask import Flask, request, jsonify, render_template, send_file, Response, stream_with_context, abort, make_response, g
 from flask_cors import CORS
-import pandas as pd, requests
+import pandas as pd
 import numpy as np
-import io, base64, joblib
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, confusion_matrix, roc_auc_score, roc_curve
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-import seaborn as sns
-from xgboost import XGBClassifier
-from lightgbm import LGBMClassifier, log_evaluation, early_stopping
+import io, os, json, uuid, shutil, hashlib, tempfile, joblib
+from model_registry import ModelRegistry, UploadedModelStore, predict_scores
+from prediction_cache import PredictionCache
+from training import (MODEL_CHOICES, TRAINING_MODES, MIN_INCREMENTAL_ROWS, train_and_evaluate,
+                      continue_and_evaluate, model_kind, trained_model_values)
+from plots import PlotCache
+from training_jobs import TrainingJobManager, JobQueueFull, run_search_job, run_cv_job
+from cross_validation import cv_config
+from search import search_config
+from session_store import SessionStore, SESSION_ID_PATTERN
+import results
+from preprocessing import TARGET_KEYWORDS, ID_KEYWORDS, detect_header, process_dataset, feature_frame
+from ingest import stream_projected_csv, catalog_chunks, catalog_medians
+from upload_cache import UploadCache
+from samples import SampleStore
+from exports import EXPORT_FORMATS, frame_chunks, export_stream
+from dataset import output_frame
+from micro_batch import MicroBatcher
+import instrumentation
+from instrumentation import metrics, stage
+from thread_budget import budget as thread_budget, lease, set_threads
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
-
-# Temporary storage for last uploaded data
-global global_features
-global global_target
-global global_df_core
-global global_df_unscaled
-global global_predictions
-global global_trained_model
-
-global_features = None
-global_target = None
-global_df_core = None
-global_df_unscaled = None
-global_predictions = None
-global_trained_model = None
-
-def extract_features_and_target(df, feature_keywords, target_keywords):
-    # Filter features to only those present in df
-    feature_cols = [col for col in feature_keywords if col in df.columns]
-
-    # Detect target column
-    target_col = next((col for col in target_keywords if col in df.columns), None)
-    if target_col is None:
-        raise ValueError("No valid target column found in this dataset.")
-
-    # Subset dataframe
-    df_core = df[feature_cols + [target_col]].copy()
-
-    return df_core, feature_cols, target_col
-
-def detect_header(raw_data, target_keywords, max_skip=300):
-    df = None
-    header_line = None
-
-    for skip in range(max_skip):
-        try:
-            candidate = pd.read_csv(io.StringIO(raw_data), skiprows=skip, nrows=5)
-            if any(col.lower() in [t.lower() for t in target_keywords] for col in candidate.columns):
-                df = pd.read_csv(io.StringIO(raw_data), skiprows=skip)
-                header_line = skip
-                break
-        except Exception:
-            continue
-
-    if df is None:
-        return None, None, "Could not detect valid dataset header"
-
-    return df, header_line, None
+CORS(app, expose_headers=["X-Session-ID"])  # Enable CORS for all routes; clients read their minted session id
+instrumentation.init_app(app)  # Per-stage timings: Server-Timing headers and GET /metrics
+
+# Keep BLAS/OpenMP (here and in the training job workers started later) to this process' share of the cores
+thread_budget.limit_native_pools()
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Local scratch space shared by all workers on this host (sessions, training jobs)
+STATE_DIR = os.environ.get("ORBITAL_STATE_DIR", os.path.join(tempfile.gettempdir(), "orbital_horizon"))
+
+# Pretrained models shipped with the repo, keyed by mission
+PRETRAINED_MODELS = {
+    "kepler": os.path.join(BASE_DIR, "xgb_kepler_model.pkl"),
+    "tess": os.path.join(BASE_DIR, "xgb_tess_model.pkl"),
+    "k2": os.path.join(BASE_DIR, "xgb_k2_model.pkl"),
+}
+
+# Pretrained models stay resident in memory instead of being unpickled per request
+model_registry = ModelRegistry(max_models=int(os.environ.get("MODEL_CACHE_SIZE", 4)))
+model_registry.warm_up(PRETRAINED_MODELS.values())
+
+# Models users upload for prediction, stored once by content hash (and reusable by that hash)
+uploaded_models = UploadedModelStore(
+    root=os.path.join(STATE_DIR, "uploaded_models"),
+    max_bytes=int(os.environ.get("UPLOADED_MODEL_CACHE_MB", 256)) * 1024 * 1024,
+    max_models=int(os.environ.get("UPLOADED_MODEL_MEMORY", 4))
+)
+
+# Per-session storage for uploaded data, predictions and trained models
+sessions = SessionStore(
+    root=os.path.join(STATE_DIR, "sessions"),
+    memory_budget=int(os.environ.get("SESSION_MEMORY_MB", 512)) * 1024 * 1024,
+    session_ttl=int(os.environ.get("SESSION_TTL_HOURS", 24)) * 3600
+)
+
+def current_session_id():
+    """
+    The caller's session, from the X-Session-ID header, ?session_id= or a
+    session_id cookie. Callers without one get a fresh random id, sent back
+    as a cookie and X-Session-ID header (see return_minted_session_id).
+    """
+    session_id = (request.headers.get("X-Session-ID") or request.args.get("session_id")
+                  or request.cookies.get("session_id"))
+    if session_id is None:
+        if "minted_session_id" not in g:
+            g.minted_session_id = uuid.uuid4().hex
+        return g.minted_session_id
+    if not SESSION_ID_PATTERN.match(session_id):
+        abort(make_response(jsonify({"error": "Invalid session id."}), 400))
+    return session_id
+
+@app.after_request
+def return_minted_session_id(response):
+    # Without this every client that sends no id would get a new, empty session on each request
+    session_id = g.get("minted_session_id")
+    if session_id is not None:
+        response.set_cookie("session_id", session_id, max_age=sessions.session_ttl, httponly=True, samesite="Lax")
+        response.headers["X-Session-ID"] = session_id
+    return response
 
 @app.route("/")
 def home():
     return render_template("index.html")
 
+# Processed uploads keyed by content hash, so re-uploading a known file skips processing
+upload_cache = UploadCache(
+    root=os.path.join(STATE_DIR, "upload_cache"),
+    max_bytes=int(os.environ.get("UPLOAD_CACHE_MB", 256)) * 1024 * 1024
+)
+
+# Uploads bigger than this are parsed in chunks unless the client asks otherwise
+UPLOAD_STREAM_THRESHOLD = int(os.environ.get("UPLOAD_STREAM_THRESHOLD_MB", 16)) * 1024 * 1024
+
+def upload_option(name, default=None):
+    return request.form.get(name) or request.args.get(name) or default
+
+def upload_size(file):
+    stream = file.stream
+    position = stream.tell()
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(position)
+    return size
+
+def parse_upload(stream, ingest_mode, median_error=None, fill_values=None):
+    """
+    Parse and process a raw CSV stream. `fill_values` replaces the file's own
+    medians for filling missing values (appends reuse the dataset's).
+    Returns ((dataset, features, source_columns, summary), None) or (None, error).
+    """
+    if ingest_mode == "stream":
+        # Parse in chunks, keeping only the columns we use (bounded memory for big exports)
+        with stage("parse"):
+            df, header_line, source_columns, medians = stream_projected_csv(stream, median_error=median_error)
+        if header_line is None:
+            return None, "Could not detect valid dataset header"
+    else:
+        raw_data = stream.read().decode("utf-8", errors="ignore")
+
+        df, header_line, error = detect_header(raw_data, TARGET_KEYWORDS)
+        if error:
+            return None, error
+        source_columns = list(df.columns)
+        medians = None
+    if fill_values:
+        medians = fill_values
+
+    # DEBUG: print available columns
+    print("🔍 Available columns:", source_columns)
+
+    with stage("process"):
+        dataset, features, summary = process_dataset(df, header_line, medians)
+    return (dataset, features, source_columns, summary), None
+
+def use_processed(session_id, cache_key, processed, cache_status):
+    """Make a processed dataset the session's current one and answer with its summary."""
+    dataset, features, source_columns, summary = processed
+    forget_predictions(sessions.get(session_id, "dataset_key"), cache_key)
+
+    # Replace this session's dataset and drop anything derived from the old one.
+    # The cache key doubles as the dataset's identity (e.g. for reusing training matrices).
+    with stage("session_store"):
+        sessions.update(
+            session_id, prewritten=upload_cache.frame_paths(cache_key),
+            dataset=dataset, features=features, source_columns=source_columns,
+            dataset_key=cache_key, predictions=None, predictions_id=None, predictions_key=None, trained_model=None,
+            pending_rows=None, full_fit=None
+        )
+
+    response = jsonify(summary)
+    response.headers["X-Upload-Cache"] = cache_status
+    return response
+
+def append_processed(session_id, cache_key, processed, cache_status):
+    """
+    Merge a processed upload into the session's dataset by its id column
+    (/upload with mode=append). The trained model is kept, and the rows
+    added or changed since it was trained are remembered so /train can
+    continue boosting on just those ("mode": "incremental").
+    """
+    dataset, features, source_columns, summary = processed
+    state = sessions.get_many(session_id, "dataset", "features", "dataset_key", "trained_model", "pending_rows")
+    current = state["dataset"]
+
+    if features != state["features"]:
+        return jsonify({"error": "The appended file doesn't have the same features as the current dataset."}), 400
+    id_columns = [col for col in current.columns if col not in features and col != "target"]
+    if len(id_columns) != 1 or id_columns[0] not in dataset.columns:
+        return jsonify({"error": f"Appending needs the same id column ({', '.join(ID_KEYWORDS)}) in both files."}), 400
+
+    try:
+        with stage("merge"):
+            merged, updated, appended = current.merge(dataset, id_columns[0])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    pending = None
+    if state["trained_model"] is not None:
+        previous = state["pending_rows"] if state["pending_rows"] is not None else np.empty(0, dtype=np.int64)
+        pending = np.union1d(previous, np.union1d(updated, appended))
+
+    # A new identity for the merged data, derived from the two it was built from
+    merged_key = upload_cache.key(hashlib.sha256(f"{state['dataset_key']}+{cache_key}".encode()).hexdigest(), "append")
+    forget_predictions(state["dataset_key"], merged_key)
+    with stage("session_store"):
+        sessions.update(
+            session_id, dataset=merged, dataset_key=merged_key, predictions=None, predictions_id=None,
+            predictions_key=None, pending_rows=pending
+        )
+
+    summary = dict(summary, append={
+        "id_column": id_columns[0], "rows_before": len(current), "rows_updated": len(updated),
+        "rows_added": len(appended), "rows_after": len(merged),
+        "pending_rows": len(pending) if pending is not None else None
+    })
+    response = jsonify(summary)
+    response.headers["X-Upload-Cache"] = cache_status
+    return response
+
 @app.route("/upload", methods=["POST"])
 def upload_csv():
-    global global_features, global_target, global_df_core, global_df_unscaled, global_predictions, global_trained_model
+    """
+    Optional form fields / query parameters:
+      ingest        full, stream, or auto (default: stream above UPLOAD_STREAM_THRESHOLD_MB)
+      median        exact (default) or sketch, for streamed uploads
+      median_error  rank error of the median sketch (default 0.01)
+      mode          replace (default) or append: merge the rows into the current
+                    dataset by their id, replacing rows with the same id
+    """
+    session_id = current_session_id()
 
     file = request.files.get("file")
     if not file:
         return jsonify({"error": "No file uploaded"}), 400
 
-    try:
-        raw_data = file.read().decode("utf-8", errors="ignore")
-
-        # Possible target column names
-        target_keywords = ["koi_disposition", "tfopwg_disp", "disposition"]
+    mode = upload_option("mode", "replace")
+    if mode not in ("replace", "append"):
+        return jsonify({"error": "Invalid upload mode. Choose from: replace, append."}), 400
 
-        # Possible identifier column names
-        id_keywords = ["kepoi_name", "pl_name", "kepid", "tic_id"]
-
-        df, header_line, error = detect_header(raw_data, target_keywords)
+    try:
+        median_error = float(upload_option("median_error", 0.01)) if upload_option("median", "exact") == "sketch" else None
+        variant = f"sketch{median_error}" if median_error else ""
+
+        finish, fill_values = use_processed, None
+        if mode == "append":
+            current = sessions.get(session_id, "dataset")
+            if current is None:
+                return jsonify({"error": "No dataset to append to; upload one first."}), 400
+            # Missing values are filled with the current dataset's medians, so unchanged rows compare equal
+            finish, fill_values = append_processed, current.fill_values
+            if fill_values:
+                variant += "fill" + hashlib.sha256(json.dumps(fill_values, sort_keys=True).encode()).hexdigest()[:16]
+
+        # Same bytes + same options = same result, so serve it from the cache
+        with stage("hash"):
+            cache_key = upload_cache.key(upload_cache.digest(file.stream), variant)
+        with stage("cache_lookup"):
+            cached = upload_cache.get(cache_key)
+        if cached is not None:
+            return finish(session_id, cache_key, cached, "hit")
+
+        ingest_mode = upload_option("ingest", "auto")
+        if ingest_mode == "auto":
+            ingest_mode = "stream" if upload_size(file) > UPLOAD_STREAM_THRESHOLD else "full"
+
+        processed, error = parse_upload(file.stream, ingest_mode, median_error, fill_values)
         if error:
             return jsonify({"error": error}), 400
 
-        # DEBUG: print available columns
-        print("🔍 Available columns:", list(df.columns))
-
-        # Define search keywords for important features
-        feature_keywords = [
-            # kepler features
-            'koi_prad', 'koi_period', 'koi_depth', 'koi_duration',
-            'koi_teq', 'koi_insol',
-            'koi_steff', 'koi_srad','ra', 'dec',
-
-            # k2/tess features
-            'pl_rade', 'pl_orbper', 'pl_trandep', 'pl_trandur', 'pl_trandurh',
-            'pl_eqt', 'pl_insol',
-            'st_teff', 'st_rad'
-        ]
-
-        feature_keywords = list(dict.fromkeys(feature_keywords))
-
-        # Encode target labels uniformly
-        target_map = {
-            # NOT A PLANET
-            'FALSE POSITIVE': 0, 'REFUTED': 0, 'FP': 0, 'FA': 0,
-            # CANDIDATE
-            'CANDIDATE': 1, 'PC': 1, 'CP': 1, 'APC': 1,
-            # PLANET
-            'CONFIRMED': 2, 'KP': 2
-        }
-        
-        # Find the first available ID column
-        id_col = next((col for col in id_keywords if col in df.columns), None)
-
-        # Extract features and target
-        df_core, feature_cols, target_col = extract_features_and_target(df, feature_keywords, target_keywords)
-
-        # Rename features for uniformity
-        rename_map = {
-            'koi_prad':'pl_rade', 'koi_period':'pl_orbper', 'koi_depth':'pl_trandep', 'koi_duration':'pl_trandur',
-            'koi_teq':'pl_eqt', 'koi_insol':'pl_insol', 'koi_steff':'st_teff', 'koi_srad':'st_rad',
-            'koi_score':'score', 'koi_model_snr':'snr', 'pl_trandurh':'pl_trandur', 'st_tmag':'st_mag'
-        }
-        rename_map = {k: v for k, v in rename_map.items() if k in df_core.columns}
-        df_core.rename(columns=rename_map, inplace=True)
-
-        if id_col:
-            df_core[id_col] = df[id_col]
-
-        df_core['target'] = df_core[target_col].map(target_map)
-        df_core = df_core[df_core['target'].notna()]
-        df_core = df_core.drop(columns=[target_col])
-        df_core['target'] = df_core['target'].astype(int)
-
-        numeric_cols = df_core.select_dtypes(include=np.number).columns.drop('target', errors='ignore')
-        for col in numeric_cols:
-            df_core[col] = df_core[col].fillna(df_core[col].median())
-
-        # Store the unscaled data AFTER filling NaNs but BEFORE any scaling/log transforms
-        global_df_unscaled = df_core.copy()
-
-        feature_cols = list(df_core.columns.drop('target'))
-        df_core[feature_cols] = df_core[feature_cols]
-
-        canonical_order = [
-            'pl_rade', 'pl_orbper', 'pl_trandep', 'pl_trandur', 'pl_eqt', 'pl_insol',
-            'st_teff', 'st_rad','ra', 'dec'
-        ]
-        final_cols = [col for col in canonical_order if col in df_core.columns]
-        final_cols.append('target')
-        if id_col: final_cols.append(id_col)
-        df_core = df_core[final_cols]
-
-        extracted_raw = df_core[feature_cols].head(5).to_dict(orient="records") if len(feature_cols) > 0 else []
-        extracted_normalized = df_core[feature_cols].head(5).to_dict(orient="records") if len(feature_cols) > 0 else []
-        targets_raw = df_core['target'].head(5).tolist()
-        targets_numeric = df_core['target'].head(5).tolist()
-        missing_counts = df_core.isnull().sum().to_dict()
-        temp_cols = [c for c in feature_cols if 'teff' in c.lower()]
-        rad_cols = [c for c in feature_cols if 'rad' in c.lower()]
-
-        global_features = [col for col in df_core.columns if col not in ['target', id_col]]
-        global_target = 'target'
-        global_df_core = df_core.copy()
-
-        global_predictions = None
-        global_trained_model = None
-
-        return jsonify({
-            "header_line": header_line, "target_column": target_col, "missing_counts": missing_counts,
-            "temperature_columns": temp_cols, "radius_columns": rad_cols, "extracted_raw": extracted_raw,
-            "extracted_normalized": extracted_normalized, "targets_raw": targets_raw, "targets_numeric": targets_numeric
-        })
+        with stage("cache_store"):
+            upload_cache.put(cache_key, *processed)
+        return finish(session_id, cache_key, processed, "miss")
 
     except Exception as e:
         # Log the full error to the console for debugging
@@ -186,322 +265,590 @@ def upload_csv():
         # Return a user-friendly JSON error message
         return jsonify({"error": f"An error occurred during processing: {str(e)}"}), 500
 
+def export_response(df, name, extra_columns=None):
+    """
+    Stream `df` as a download in row chunks, never building the whole file.
+    ?format= picks csv (default), csv.gz, parquet or arrow (the last two need pyarrow).
+    """
+    file_format = request.args.get("format", "csv")
+    if file_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unknown format '{file_format}'. Choose from: {', '.join(EXPORT_FORMATS)}"}), 400
+
+    try:
+        body = export_stream(frame_chunks(df, extra_columns), file_format)
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 501
+
+    mimetype, extension = EXPORT_FORMATS[file_format]
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={name}.{extension}"
+    return response
+
 @app.route("/save", methods=["GET"])
 def save_processed_data():
-    global global_df_core
-    if global_df_core is None:
+    dataset = sessions.get(current_session_id(), "dataset")
+    if dataset is None:
         return jsonify({"error": "No dataset uploaded yet."}), 400
 
-    # Save DataFrame to a BytesIO buffer
-    buf = io.BytesIO()
-    global_df_core.to_csv(buf, index=False)
-    buf.seek(0)
-    
-    return send_file(
-        buf,
-        mimetype="text/csv",
-        as_attachment=True,
-        download_name="processed_data.csv"
-    )
+    return export_response(dataset.core(), "processed_data")
+
+def training_inputs(session_id, data):
+    """
+    Validate a /train or /train_jobs body. "mode" is full (default: boost a
+    new model on the whole dataset), incremental (keep boosting the
+    session's model on the rows appended or changed since it was trained)
+    or cv (stratified k-fold cross-validation of the chosen model, with
+    "folds", "repeats" and "seed"; see cross_validation.cross_validate).
+    cv always runs as a training job, even when asked for on /train.
+    Returns (inputs, None) or (None, error response).
+    """
+    state = sessions.get_many(session_id, "dataset", "features", "dataset_key", "trained_model",
+                              "pending_rows", "full_fit")
+    if state["dataset"] is None:
+        return None, (jsonify({"error": "No dataset uploaded yet."}), 400)
+
+    mode = data.get("mode", "full")
+    if mode not in TRAINING_MODES:
+        return None, (jsonify({"error": f"Invalid training mode. Choose from: {', '.join(TRAINING_MODES)}."}), 400)
+    model_choice = data.get("model")
+    hyperparams = data.get("hyperparams", {})
+
+    df_core = state["dataset"].core()
+    X = df_core[state["features"]] # Use the curated feature list
+    y = df_core['target']
+
+    if mode in ("full", "cv"):
+        if model_choice not in MODEL_CHOICES:
+            return None, (jsonify({"error": "Invalid model choice."}), 400)
+        inputs = {"mode": mode, "X": X, "y": y, "model_choice": model_choice, "hyperparams": hyperparams,
+                  "dataset_key": state["dataset_key"]}
+        if mode == "cv":
+            try:
+                inputs["cv"] = cv_config(data)
+            except ValueError as e:
+                return None, (jsonify({"error": str(e)}), 400)
+        return inputs, None
+
+    base_model, pending = state["trained_model"], state["pending_rows"]
+    if model_kind(base_model) is None:
+        return None, (jsonify({"error": "Incremental training needs an XGBoost or LightGBM model trained on this dataset first."}), 400)
+    if model_choice not in (None, model_kind(base_model)):
+        return None, (jsonify({"error": f"The session's model is {model_kind(base_model)}; incremental training can't switch models."}), 400)
+    if pending is None or len(pending) < MIN_INCREMENTAL_ROWS:
+        return None, (jsonify({"error": f"Incremental training needs at least {MIN_INCREMENTAL_ROWS} rows appended "
+                                        "or changed since the model was trained (/upload with mode=append)."}), 400)
+    return {"mode": mode, "X": X.iloc[pending], "y": y.iloc[pending], "model_choice": model_kind(base_model),
+            "hyperparams": hyperparams, "base_model": base_model, "reference": state["full_fit"],
+            "dataset_rows": len(df_core), "dataset_key": state["dataset_key"]}, None
+
+def store_trained_model(session_id, model, result=None):
+    """Keep a freshly trained model for download and later incremental training."""
+    sessions.update(session_id, **trained_model_values(model, result))
 
 @app.route("/train", methods=["POST"])
 def train_model():
-    global global_df_core, global_trained_model
-    if global_df_core is None:
-        return jsonify({"error": "No dataset uploaded yet."}), 400
+    session_id = current_session_id()
+    data = request.json or {}
+    inputs, error = training_inputs(session_id, data)
+    if error:
+        return error
+
+    if inputs["mode"] == "cv":
+        # Its pool of fold processes belongs in a job worker, not in this request thread
+        return submit_job(session_id, data, inputs)
+
+    if inputs["mode"] == "incremental":
+        model, result = continue_and_evaluate(
+            inputs["base_model"], inputs["X"], inputs["y"], inputs["hyperparams"], plots=wants_plots(data),
+            plot_cache=plot_cache, reference=inputs["reference"], dataset_rows=inputs["dataset_rows"]
+        )
+    else:
+        # Retrains on the same upload reuse its split and binned training matrices
+        model, result = train_and_evaluate(inputs["X"], inputs["y"], inputs["model_choice"], inputs["hyperparams"],
+                                           dataset_key=inputs["dataset_key"], plots=wants_plots(data), plot_cache=plot_cache)
 
-    data = request.json
-    model_choice = data.get("model")
-    hyperparams = data.get("hyperparams", {})
+    # --- Store model in the session for download ---
+    store_trained_model(session_id, model, result)
 
-    X = global_df_core[global_features] # Use the curated feature list
-    y = global_df_core['target']
+    return jsonify(result)
 
-    if model_choice not in ["xgb", "lgbm"]:
-        return jsonify({"error": "Invalid model choice."}), 400
+# Rendered /train plots, shared by the web workers and the training job workers
+plot_cache = PlotCache(
+    root=os.path.join(STATE_DIR, "plots"),
+    max_bytes=int(os.environ.get("PLOT_CACHE_MB", 64)) * 1024 * 1024
+)
 
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42
-    )
+def wants_plots(data):
+    """
+    /train and /train_jobs embed base64 PNGs unless asked not to with
+    "plots": false (or ?plots=0); then the result has the raw metric
+    arrays and plot_urls for GET /plots/<key>.png.
+    """
+    if request.args.get("plots") is not None:
+        return request.args.get("plots").lower() not in ("0", "false", "no")
+    return bool(data.get("plots", True))
+
+@app.route("/plots/<key>.png", methods=["GET"])
+def training_plot(key):
+    # Keys are content hashes, so a plot never changes once it exists
+    if not all(c in "0123456789abcdef" for c in key):
+        return jsonify({"error": "Unknown plot."}), 404
+    path = plot_cache.png_path(key)
+    if path is None:
+        return jsonify({"error": "Unknown plot."}), 404
+    response = send_file(path, mimetype="image/png", max_age=365 * 24 * 3600)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+# Long trainings run here instead of inside the request thread. The limits hold for
+# every web worker on the host together, and finished jobs store their model in the
+# owner's session themselves.
+training_jobs = TrainingJobManager(
+    job_dir=os.path.join(STATE_DIR, "jobs"),
+    max_workers=int(os.environ.get("TRAIN_MAX_WORKERS", 1)),
+    max_pending=int(os.environ.get("TRAIN_MAX_PENDING", 8)),
+    max_per_owner=int(os.environ.get("TRAIN_MAX_PER_CLIENT", 2)),
+    sessions=sessions
+)
+
+@app.route("/train_jobs", methods=["POST"])
+def submit_training_job():
+    session_id = current_session_id()
+    data = request.json or {}
+    inputs, error = training_inputs(session_id, data)
+    if error:
+        return error
+    return submit_job(session_id, data, inputs)
+
+def submit_job(session_id, data, inputs):
+    """Queue validated training_inputs as a training job; 202 with the job's status URL."""
+    options = {"plots": wants_plots(data), "plot_dir": plot_cache.root}
+    if inputs["mode"] == "cv":
+        options = dict(inputs["cv"], runner=run_cv_job)
+    elif inputs["mode"] == "incremental":
+        options.update(base_model=inputs["base_model"], reference=inputs["reference"], dataset_rows=inputs["dataset_rows"])
 
-    num_classes = len(np.unique(y_train))
+    try:
+        job_id = training_jobs.submit(inputs["X"], inputs["y"], inputs["model_choice"], inputs["hyperparams"],
+                                      owner=session_id, dataset_key=inputs.get("dataset_key"), **options)
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 429
 
-    evals_result = {}  # to store training history
+    return jsonify({"job_id": job_id, "status_url": f"/train_jobs/{job_id}"}), 202
 
-    # ------------------------- XGBoost -------------------------
-    if model_choice == "xgb":
-        n_estimators = hyperparams.get("n_estimators", 100)
-        max_depth = hyperparams.get("max_depth", 3)
-        learning_rate = hyperparams.get("learning_rate", 0.1)
+@app.route("/search_jobs", methods=["POST"])
+def submit_search_job():
+    """
+    Hyperparameter search over XGBoost and LightGBM as a background job.
+    JSON body (all optional): strategy (grid, random, halving), models,
+    space ({model: {param: [values]}}), metric (accuracy, logloss),
+    n_candidates, min_rounds, max_rounds, eta, seed.
+    Poll /train_jobs/<job_id>; the result holds a ranked leaderboard and the
+    best model becomes the session's trained model for /download_model.
+    """
+    session_id = current_session_id()
+    state = sessions.get_many(session_id, "dataset", "features", "dataset_key")
+    if state["dataset"] is None:
+        return jsonify({"error": "No dataset uploaded yet."}), 400
 
-        if num_classes > 2:
-            objective = "multi:softprob"
-        else:
-            objective = "binary:logistic"
-
-        model = XGBClassifier(
-            n_estimators=n_estimators,
-            max_depth=max_depth,
-            learning_rate=learning_rate,
-            objective=objective,
-            num_class=num_classes if num_classes > 2 else None,
-            random_state=42
-        )
+    try:
+        config = search_config(request.json or {})
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": str(e)}), 400
 
-        model.fit(
-            X_train, y_train,
-            eval_set=[(X_train, y_train), (X_test, y_test)],
-            verbose=False
-        )
-        evals_result = model.evals_result()
-
-    # ------------------------- LightGBM -------------------------
-    elif model_choice == "lgbm":
-        model = LGBMClassifier(
-            n_estimators=100,
-            learning_rate=0.1,
-            max_depth=-1,
-            random_state=42
-        )
+    df_core = state["dataset"].core()
+    X = df_core[state["features"]]
+    y = df_core['target']
 
-        # choose metric depending on problem type
-        if num_classes > 2:
-            metrics = ["multi_logloss", "multi_error"]
-        else:
-            metrics = ["binary_logloss", "binary_error"]
-
-        model.fit(
-            X_train, y_train,
-            eval_set=[(X_train, y_train), (X_test, y_test)],
-            eval_metric=metrics,
-            callbacks=[
-                log_evaluation(period=10),
-                early_stopping(stopping_rounds=20),
-            ]
-        )
+    try:
+        job_id = training_jobs.submit(X, y, "search", config, owner=session_id, runner=run_search_job,
+                                      dataset_key=state["dataset_key"])
+    except JobQueueFull as e:
+        return jsonify({"error": str(e)}), 429
 
-        # LightGBM stores in model.evals_result_
-        raw_result = model.evals_result_
-
-        # 🔄 Normalize to match XGBoost style
-        for dataset_name, metrics_dict in raw_result.items():
-            evals_result[dataset_name] = {}
-            for metric_name, values in metrics_dict.items():
-                evals_result[dataset_name][metric_name] = values
-
-    # --- Store model globally for download ---
-    global_trained_model = model
-
-    # ------------------------- Evaluation -------------------------
-    y_pred = model.predict(X_test)
-    y_proba = model.predict_proba(X_test)[:, 1] if num_classes == 2 else None
-
-    acc = accuracy_score(y_test, y_pred)
-    cm = confusion_matrix(y_test, y_pred)
-
-    # Confusion matrix plot
-    class_labels = ["False Positive", "Candidate", "Confirmed"]
-    # Ensure we only use labels that are present in the data
-    unique_labels_in_data = np.unique(np.concatenate((y_test, y_pred)))
-    tick_labels = [class_labels[i] for i in unique_labels_in_data]
-
-    plt.figure(figsize=(5, 4))
-    sns.heatmap(cm, annot=True, fmt="d", cmap="Blues", xticklabels=tick_labels, yticklabels=tick_labels)
-    plt.xlabel("Predicted")
-    plt.ylabel("Actual")
-    plt.tight_layout()
-    buf = io.BytesIO()
-    plt.savefig(buf, format="png")
-    plt.close("all")
-    cm_plot = base64.b64encode(buf.getbuffer()).decode("utf8")
-
-    # ROC curve (binary only)
-    roc_plot = None
-    auc_score = None
-    if y_proba is not None:
-        fpr, tpr, _ = roc_curve(y_test, y_proba)
-        auc_score = roc_auc_score(y_test, y_proba)
-        plt.figure(figsize=(5, 4))
-        plt.plot(fpr, tpr, label=f"AUC={auc_score:.3f}")
-        plt.plot([0, 1], [0, 1], "k--")
-        plt.xlabel("False Positive Rate")
-        plt.ylabel("True Positive Rate")
-        plt.title("ROC Curve")
-        plt.legend()
-        plt.tight_layout()
-        buf = io.BytesIO()
-        plt.savefig(buf, format="png")
-        plt.close()
-        roc_plot = base64.b64encode(buf.getbuffer()).decode("utf8")
-
-    # Accuracy/history plot (shared for both models)
-    acc_plot = None
-    if evals_result:
-        plt.figure(figsize=(6, 4))
-        for dataset_name, metrics_dict in evals_result.items():
-            for metric_name, values in metrics_dict.items():
-                plt.plot(values, label=f"{dataset_name}-{metric_name}")
-        plt.xlabel("Iteration")
-        plt.ylabel("Metric")
-        plt.title("Training History")
-        plt.legend()
-        plt.tight_layout()
-        buf = io.BytesIO()
-        plt.savefig(buf, format="png")
-        plt.close()
-        acc_plot = base64.b64encode(buf.getbuffer()).decode("utf8")
-
-    return jsonify({
-        "accuracy": acc,
-        "confusion_matrix_plot": cm_plot,
-        "roc_plot": roc_plot,
-        "auc_score": auc_score,
-        "accuracy_plot": acc_plot
-    })
+    return jsonify({"job_id": job_id, "status_url": f"/train_jobs/{job_id}"}), 202
+
+@app.route("/train_jobs/<job_id>", methods=["GET"])
+def training_job_status(job_id):
+    """
+    Poll a training job. `?since=N` only returns progress entries from N on;
+    `?stream=1` streams NDJSON progress lines until the job finishes.
+    Jobs submitted by another session are reported as unknown.
+    """
+    owner = current_session_id()
+    if request.args.get("stream"):
+        if training_jobs.status(job_id, owner=owner) is None:
+            return jsonify({"error": "Unknown training job."}), 404
+        lines = (json.dumps(entry) + "\n" for entry in training_jobs.stream(job_id, owner=owner))
+        return Response(stream_with_context(lines), mimetype="application/x-ndjson")
+
+    state = training_jobs.status(job_id, since=request.args.get("since", 0, type=int), owner=owner)
+    if state is None:
+        return jsonify({"error": "Unknown training job."}), 404
+    return jsonify(state)
+
+@app.route("/train_jobs/<job_id>/cancel", methods=["POST"])
+def cancel_training_job(job_id):
+    if not training_jobs.cancel(job_id, owner=current_session_id()):
+        return jsonify({"error": "Job not found or already finished."}), 404
+    return jsonify({"message": "Cancellation requested.", "job_id": job_id})
+
+def detect_mission(dataset_columns):
+    """Which pretrained model fits an export, from its raw (not yet renamed) column names."""
+    # --- More Robust Dynamic Model Selection ---
+    # Define characteristic features for each dataset type before renaming.
+    kepler_features = ['koi_prad']
+    tess_features = ['pl_trandurh']
+
+    # Check if ANY of the characteristic Kepler features are present.
+    if any(kf in dataset_columns for kf in kepler_features):
+        mission = "kepler"
+        print(f"✅ Detected Kepler dataset. Using {os.path.basename(PRETRAINED_MODELS[mission])}")
+    # Check if ANY of the characteristic TESS features are present.
+    elif any(tf in dataset_columns for tf in tess_features):
+        mission = "tess"
+        print(f"✅ Detected TESS dataset. Using {os.path.basename(PRETRAINED_MODELS[mission])}")
+    # If neither, default to the K2 model.
+    else:
+        mission = "k2"
+        print(f"✅ No specific Kepler/TESS features found. Using default model: {os.path.basename(PRETRAINED_MODELS[mission])}")
+    return mission
 
 @app.route("/predict", methods=["POST"])
 def predict_with_pretrained():
-    global global_df_core, global_df_unscaled, global_predictions
-    if global_df_core is None:
+    session_id = current_session_id()
+    state = sessions.get_many(session_id, "dataset", "source_columns", "dataset_key")
+    if state["dataset"] is None:
         return jsonify({"error": "No dataset uploaded yet."}), 400
     
     try:
-        # --- More Robust Dynamic Model Selection ---
-        # Define characteristic features for each dataset type before renaming.
-        kepler_features = ['koi_prad']
-        tess_features = ['pl_trandurh']
-        
-        # Inspect the columns of the uploaded, unscaled data to decide which model to use.
-        dataset_columns = global_df_unscaled.columns
-        model_path = ""
-        
-        # Check if ANY of the characteristic Kepler features are present.
-        if any(kf in dataset_columns for kf in kepler_features):
-            model_path = "xgb_kepler_model.pkl"
-            print(f"✅ Detected Kepler dataset. Loading {model_path}")
-        # Check if ANY of the characteristic TESS features are present.
-        elif any(tf in dataset_columns for tf in tess_features):
-            model_path = "xgb_tess_model.pkl"
-            print(f"✅ Detected TESS dataset. Loading {model_path}")
-        # If neither, default to the K2 model.
-        else:
-            model_path = "xgb_k2_model.pkl"
-            print(f"✅ No specific Kepler/TESS features found. Loading default model: {model_path}")
-
-        # Load the selected pretrained model
-        model = joblib.load(model_path)
-
-        # --- Robust Feature Matching ---
-        # Get the feature names the model was trained on
-        if hasattr(model, 'get_booster'): # XGBoost
-            model_features = model.get_booster().feature_names
-        elif hasattr(model, 'feature_name_'): # LightGBM
-            model_features = model.feature_name_
-        else:
-            raise TypeError(f"Could not determine feature names from model of type {type(model).__name__}")
+        # Inspect the columns of the uploaded file (before renaming) to decide which model to use.
+        mission = detect_mission(state["source_columns"] or state["dataset"].columns)
 
-        # Prepare the dataframe for prediction
-        X_predict = global_df_core.copy()
-        for col in model_features:
-            if col not in X_predict.columns:
-                X_predict[col] = 0 # Add missing columns and fill with 0
-        
-        # Ensure the column order is exactly what the model expects
-        X_predict = X_predict[model_features]
-        
-        # Use the unscaled dataframe to get the original values for visualization
-        raw_data_for_prediction = global_df_unscaled.to_dict(orient='records')
+        # Fetch the selected pretrained model (loaded once, then served from memory)
+        loaded = model_registry.get(PRETRAINED_MODELS[mission])
+        model = loaded.model
 
-        preds = model.predict(X_predict)
-        
-        # Store predictions globally for download
-        global_predictions = preds.tolist()
+        def score():
+            # --- Robust Feature Matching ---
+            # Feature names the model was trained on, cached alongside the model
+            model_features = loaded.feature_names
 
-        return jsonify({
-            "predictions": preds.tolist(),
-            "count": len(preds),
-            "raw_data_for_prediction": raw_data_for_prediction # Send the data to the frontend
-        })
+            # Prepare the dataframe for prediction: exactly the model's columns in its order,
+            # missing ones filled with 0 (no copy of the whole dataset first)
+            X_predict = state["dataset"].core().reindex(columns=model_features, fill_value=0)
+
+            with stage("predict"), lease("predict") as threads, loaded.lock:
+                set_threads(model, threads)
+                return predict_scores(model, X_predict)
+
+        # The file's (mtime, size) fingerprint changes when the model is replaced on disk
+        model_key = "{}:{}:{}".format(os.path.basename(loaded.path), *loaded.fingerprint)
+        return prediction_response(session_id, state["dataset_key"], model_key, score, state["dataset"].unscaled())
     
     except Exception as e:
         return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
 
+# Rows /predict_file reads, scores and writes back at a time
+PREDICT_FILE_CHUNK_ROWS = int(os.environ.get("PREDICT_FILE_CHUNK_ROWS", 5000))
+
+@app.route("/predict_file", methods=["POST"])
+def predict_file():
+    """
+    Score a whole archive export in one call, without /upload: the CSV (a
+    "file" form field or the raw request body) is read, scored with the
+    detected mission's pretrained model and sent back with `prediction` and
+    `prediction_label` columns one chunk at a time, so memory stays flat
+    however big the file is. Every row is scored, with or without a
+    disposition, and nothing is kept in the session.
+
+    Optional form fields / query parameters:
+      fill          median (default): fill missing values with column medians like /upload
+                    (a sketch, from a first pass over the file); none: single pass, missing
+                    values go to the model as NaN
+      median_error  rank error of the median sketch (default 0.01)
+      format        csv (default) or csv.gz
+    """
+    fill = upload_option("fill", "median")
+    if fill not in ("median", "none"):
+        return jsonify({"error": "Invalid fill. Choose from: median, none."}), 400
+    file_format = upload_option("format", "csv")
+    if file_format not in ("csv", "csv.gz"):
+        return jsonify({"error": "Invalid format. Choose from: csv, csv.gz."}), 400
+
+    file = request.files.get("file")
+    spooled = None
+    if file or fill == "median":
+        # Form files are closed as soon as this view returns (before the body is streamed),
+        # and the raw body can only be read once: keep our own copy on disk
+        source = spooled = tempfile.TemporaryFile(dir=STATE_DIR)
+        with stage("spool"):
+            shutil.copyfileobj(file.stream if file else request.stream, spooled, 1024 * 1024)
+        spooled.seek(0)
+    else:
+        source = request.stream
+
+    try:
+        medians = None
+        if fill == "median":
+            with stage("medians"):
+                medians = catalog_medians(source, float(upload_option("median_error", 0.01)))
+            source.seek(0)
+
+        with stage("header_detection"):
+            source_columns, chunks = catalog_chunks(source, PREDICT_FILE_CHUNK_ROWS)
+        if source_columns is None:
+            if spooled:
+                spooled.close()
+            return jsonify({"error": "Could not detect valid dataset header"}), 400
+
+        mission = detect_mission(source_columns)
+        loaded = model_registry.get(PRETRAINED_MODELS[mission])
+    except Exception as e:
+        if spooled:
+            spooled.close()
+        return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
+
+    def scored_chunks():
+        try:
+            for chunk in chunks:
+                X = feature_frame(chunk, medians).reindex(columns=loaded.feature_names, fill_value=0)
+                with stage("predict"), lease("predict") as threads, loaded.lock:
+                    set_threads(loaded.model, threads)
+                    preds = loaded.model.predict(X)
+                yield chunk.assign(prediction=preds, prediction_label=pd.Series(preds).map(PREDICTION_LABELS).to_numpy())
+        finally:
+            if spooled:
+                spooled.close()
+
+    mimetype, extension = EXPORT_FORMATS[file_format]
+    response = Response(stream_with_context(export_stream(scored_chunks(), file_format)), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename={mission}_predictions.{extension}"
+    response.headers["X-Mission"] = mission
+    return response
+
+# Scores and encoded rows of recent /predict calls, so an unchanged upload isn't scored twice
+prediction_cache = PredictionCache(max_bytes=int(os.environ.get("PREDICTION_CACHE_MB", 64)) * 1024 * 1024)
+
+def forget_predictions(old_key, new_key=None):
+    """Free the cached predictions of a dataset a session no longer uses (other sessions on it just score again)."""
+    if old_key is not None and old_key != new_key:
+        prediction_cache.invalidate(old_key)
+
+def request_flag(name, default):
+    options = request.get_json(silent=True) or {}
+    return str(options.get(name, request.form.get(name, default))).lower() not in ("false", "0")
+
+def prediction_response(session_id, dataset_key, model_key, score, df_unscaled, extra=None):
+    """
+    Store predictions in the session and build the /predict response.
+
+    `score()` returns predict_scores() of the dataset and only runs when
+    the prediction cache has nothing for (dataset_key, model_key).
+
+    Clients that send {"include_rows": false} get a `results_cursor` for
+    /results instead of every row of the dataset inlined in the JSON;
+    {"include_probabilities": true} adds the class probabilities.
+    `extra` is merged into the JSON as is.
+    """
+    scores = prediction_cache.get((dataset_key, model_key)) if dataset_key else None
+    cache_status = "hit" if scores is not None else "miss"
+    if scores is None:
+        scores = score()
+        preds, proba, _ = scores
+        if dataset_key:
+            prediction_cache.put((dataset_key, model_key), scores, preds.nbytes + (proba.nbytes if proba is not None else 0))
+    preds, proba, classes = scores
+
+    # Store predictions in the session for download and /results paging. When the session
+    # already holds these very predictions, keep them (and its /results cursors) as they are.
+    predictions_key = f"{dataset_key}|{model_key}" if dataset_key else None
+    held = sessions.get_many(session_id, "predictions_key", "predictions_id")
+    if predictions_key and held["predictions_key"] == predictions_key and held["predictions_id"]:
+        predictions_id = held["predictions_id"]
+    else:
+        predictions_id = uuid.uuid4().hex
+        with stage("session_store"):
+            sessions.update(session_id, predictions=np.asarray(preds), predictions_id=predictions_id,
+                            predictions_key=predictions_key)
+
+    payload = {
+        "predictions": preds.tolist(),
+        "count": len(preds),
+        "results_cursor": results.encode_cursor(predictions_id, 0),
+        **(extra or {})
+    }
+    if request_flag("include_probabilities", False) and proba is not None:
+        payload["classes"] = classes.tolist()
+        payload["probabilities"] = proba.tolist()
+
+    if request_flag("include_rows", True):
+        # Use the unscaled dataframe to get the original values for visualization.
+        # They only depend on the dataset, so they are encoded once and spliced into the JSON.
+        records = prediction_cache.get((dataset_key, "records")) if dataset_key else None
+        with stage("json_encode"):
+            if records is None:
+                records = app.json.dumps(output_frame(df_unscaled).to_dict(orient='records'), separators=(",", ":"))
+                if dataset_key:
+                    prediction_cache.put((dataset_key, "records"), records, len(records))
+            body = app.json.dumps(payload, separators=(",", ":"))[:-1] + ',"raw_data_for_prediction":' + records + "}"
+        response = app.response_class(body, mimetype="application/json")
+    else:
+        response = jsonify(payload)
+
+    response.headers["X-Prediction-Cache"] = cache_status
+    return response
+
+@app.route("/results", methods=["GET"])
+def prediction_results():
+    """
+    Page through the last predictions together with the uploaded rows.
+
+    Query parameters:
+      cursor / offset   where to start (cursors come from /predict or a previous page)
+      limit             page size (default 500, max 5000)
+      columns           comma-separated projection, e.g. columns=pl_rade,pl_eqt
+      prediction        only rows with these predicted classes, e.g. prediction=2
+      format            records (default), columnar (one array per column) or ndjson (streamed)
+    """
+    state = sessions.get_many(current_session_id(), "dataset", "predictions", "predictions_id")
+    if state["dataset"] is None or state["predictions"] is None:
+        return jsonify({"error": "No predictions have been generated yet."}), 400
+    df_unscaled = state["dataset"].unscaled()
+
+    output_format = request.args.get("format", "records")
+    if output_format not in results.RESULT_FORMATS:
+        return jsonify({"error": f"Unknown format. Use one of {results.RESULT_FORMATS}."}), 400
+
+    offset = request.args.get("offset", 0, type=int)
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            predictions_id, offset = results.decode_cursor(cursor)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if predictions_id != state["predictions_id"]:
+            return jsonify({"error": "Predictions have changed since this cursor was issued. Run /predict again."}), 409
+
+    try:
+        classes = [int(c) for c in request.args.get("prediction", "").split(",") if c.strip()]
+    except ValueError:
+        return jsonify({"error": "prediction must be a comma-separated list of class numbers."}), 400
+
+    requested_columns = [c.strip() for c in request.args.get("columns", "").split(",") if c.strip()]
+    columns = results.project_columns(df_unscaled, requested_columns)
+
+    positions = results.matching_positions(state["predictions"], classes)
+    total = len(positions)
+    offset = max(0, offset)
+
+    if output_format == "ndjson":
+        limit = request.args.get("limit", type=int)
+        selected = positions[offset:] if limit is None else positions[offset:offset + limit]
+        lines = results.ndjson_lines(df_unscaled, state["predictions"], selected, columns)
+        return Response(stream_with_context(lines), mimetype="application/x-ndjson",
+                        headers={"X-Total-Count": str(total)})
+
+    limit = min(max(1, request.args.get("limit", results.DEFAULT_PAGE_SIZE, type=int)), results.MAX_PAGE_SIZE)
+    page = results.page_frame(df_unscaled, state["predictions"], positions[offset:offset + limit], columns)
+
+    next_offset = offset + limit
+    payload = {
+        "total": total,
+        "offset": offset,
+        "limit": limit,
+        "columns": list(page.columns),
+        "next_cursor": results.encode_cursor(state["predictions_id"], next_offset) if next_offset < total else None
+    }
+    if output_format == "columnar":
+        payload["data"] = results.columnar(page)
+    else:
+        payload["rows"] = page.to_dict(orient="records")
+
+    return jsonify(payload)
+
 @app.route("/download_predictions", methods=["GET"])
 def download_predictions():
-    global global_df_unscaled, global_predictions
-    if global_df_unscaled is None or global_predictions is None:
+    state = sessions.get_many(current_session_id(), "dataset", "predictions")
+    if state["dataset"] is None or state["predictions"] is None:
         return jsonify({"error": "No predictions have been generated to download."}), 400
 
     try:
-        df_to_download = global_df_unscaled.copy()
-        df_to_download['prediction'] = global_predictions
-        
-        # Map numeric predictions back to human-readable labels
-        prediction_map = {0: 'FALSE POSITIVE', 1: 'CANDIDATE', 2: 'CONFIRMED'}
-        df_to_download['prediction_label'] = df_to_download['prediction'].map(prediction_map)
+        predictions = np.asarray(state["predictions"])
 
-        buf = io.BytesIO()
-        df_to_download.to_csv(buf, index=False)
-        buf.seek(0)
-        
-        return send_file(
-            buf,
-            mimetype="text/csv",
-            as_attachment=True,
-            download_name="orbital_horizon_predictions.csv"
-        )
+        # Prediction columns are added per chunk instead of to a copy of the whole frame
+        extra_columns = {
+            "prediction": lambda start, stop: predictions[start:stop],
+            # Map numeric predictions back to human-readable labels
+            "prediction_label": lambda start, stop: pd.Series(predictions[start:stop]).map(PREDICTION_LABELS).to_numpy(),
+        }
+        return export_response(state["dataset"].unscaled(), "orbital_horizon_predictions", extra_columns)
     except Exception as e:
         return jsonify({"error": f"Failed to create CSV: {str(e)}"}), 500
 
 @app.route("/predict_with_uploaded_model", methods=["POST"])
 def predict_with_uploaded_model():
-    global global_df_core, global_df_unscaled, global_predictions, global_features
-    if global_df_core is None:
+    """
+    Score the session's dataset with a user's model: a `model_file` upload,
+    or the `model_hash` an earlier response returned for one. Uploaded
+    files are stored once by their hash and stay unpickled in memory, so
+    resubmitting the same file (or just its hash) skips the load.
+    """
+    session_id = current_session_id()
+    state = sessions.get_many(session_id, "dataset", "features", "dataset_key")
+    if state["dataset"] is None:
         return jsonify({"error": "Please upload and process a dataset first."}), 400
 
     model_file = request.files.get("model_file")
-    if not model_file:
+    model_hash = upload_option("model_hash")
+    if not model_file and not model_hash:
         return jsonify({"error": "No model file was uploaded."}), 400
 
     try:
-        # Load the model from the uploaded file stream
-        model = joblib.load(model_file)
-
-        X = global_df_core[global_features]
-
-        # Use the unscaled dataframe to get the original values for visualization
-        raw_data_for_prediction = global_df_unscaled.to_dict(orient='records')
-
-        preds = model.predict(X)
-        
-        # Store predictions globally for download
-        global_predictions = preds.tolist()
-
-        return jsonify({
-            "predictions": preds.tolist(),
-            "count": len(preds),
-            "raw_data_for_prediction": raw_data_for_prediction
-        })
+        if model_file:
+            with stage("model_store"):
+                model_hash = uploaded_models.put(model_file.stream)
+
+        with stage("model_load"):
+            loaded = uploaded_models.get(model_hash)
+        if loaded is None:
+            return jsonify({"error": "Unknown model_hash; upload the model file again."}), 404
+
+        # Line the dataset's columns up with the model's features (worked out once per model and column set)
+        core = state["dataset"].core()
+        if loaded.feature_names is None:
+            columns = [core.columns.get_loc(name) for name in state["features"]]
+        else:
+            columns, missing = loaded.alignment(core.columns)
+            if missing:
+                return jsonify({"error": f"The model needs features this dataset doesn't have: {', '.join(missing)}"}), 400
+
+        def score():
+            X = core.iloc[:, columns]
+            with stage("predict"), lease("predict") as threads, loaded.lock:
+                set_threads(loaded.model, threads)
+                return predict_scores(loaded.model, X)
+
+        # The model's bytes identify it, so the same model again is served from the prediction cache
+        return prediction_response(session_id, state["dataset_key"], "sha256:" + model_hash, score,
+                                   state["dataset"].unscaled(), extra={"model_hash": model_hash})
     
     except Exception as e:
         return jsonify({"error": f"Failed to make predictions with the uploaded model: {str(e)}"}), 500
 
 @app.route("/download_model", methods=["GET"])
 def download_model():
-    global global_trained_model
-    if global_trained_model is None:
+    trained_model = sessions.get(current_session_id(), "trained_model")
+    if trained_model is None:
         return jsonify({"error": "No model has been trained yet."}), 400
 
     try:
-        # Determine model type for filename
-        model_type = "model"
-        if isinstance(global_trained_model, XGBClassifier):
-            model_type = "xgb"
-        elif isinstance(global_trained_model, LGBMClassifier):
-            model_type = "lgbm"
+        # Determine model type for filename (by class name, so LightGBM isn't imported just for this)
+        model_type = {"XGBClassifier": "xgb", "LGBMClassifier": "lgbm"}.get(type(trained_model).__name__, "model")
 
         buf = io.BytesIO()
-        joblib.dump(global_trained_model, buf)
+        joblib.dump(trained_model, buf)
         buf.seek(0)
 
         return send_file(
@@ -515,48 +862,133 @@ def download_model():
 
 @app.route("/reset", methods=["POST"])
 def reset_state():
-    global global_features, global_target, global_df_core, global_df_unscaled, global_predictions, global_trained_model
-    
-    global_features = None
-    global_target = None
-    global_df_core = None
-    global_df_unscaled = None
-    global_predictions = None
-    global_trained_model = None
+    session_id = current_session_id()
+
+    # Only the caller's session is cleared; other analysts keep their data
+    forget_predictions(sessions.get(session_id, "dataset_key"))
+    sessions.clear(session_id)
     
-    print("🔄 Server state has been reset.")
+    print(f"🔄 Session {session_id} has been reset.")
     return jsonify({"message": "Server state cleared successfully."}), 200
 
+# Sample datasets are served from assets/ (gzipped copies live next to the other state)
+samples = SampleStore(asset_dir=os.path.join(BASE_DIR, "assets"), cache_dir=os.path.join(STATE_DIR, "samples"))
+
+SAMPLE_MAX_AGE = int(os.environ.get("SAMPLE_MAX_AGE", 3600))
+
 @app.route("/download_sample/<dataset_name>", methods=["GET"])
 def download_sample(dataset_name):
-    # Map the short name from the URL to the full GitHub raw URL
-    dataset_urls = {
-        "kepler": "https://raw.githubusercontent.com/qgacabrera-bit/OrbitalHorizon/refs/heads/main/assets/cumulative_2025.09.25_12.58.46.csv",
-        "k2": "https://raw.githubusercontent.com/qgacabrera-bit/OrbitalHorizon/refs/heads/main/assets/k2pandc_2025.09.25_12.59.27.csv",
-        "tess": "https://raw.githubusercontent.com/qgacabrera-bit/OrbitalHorizon/refs/heads/main/assets/TOI_2025.09.25_11.42.37.csv"
-    }
+    path = samples.path(dataset_name)
+    if not path:
+        return jsonify({"error": "Invalid dataset name"}), 404
+
+    # Byte ranges always refer to the plain CSV, so only compress whole-file requests
+    use_gzip = request.accept_encodings["gzip"] > 0 and request.range is None
+    if use_gzip:
+        path = samples.gzip_path(dataset_name)
 
-    url = dataset_urls.get(dataset_name)
-    if not url:
+    # send_file streams from disk and handles ETag/Last-Modified, If-None-Match/If-Modified-Since and Range
+    response = send_file(
+        path,
+        as_attachment=True,
+        download_name=f"{dataset_name}_data.csv",
+        mimetype="text/csv",
+        conditional=True,
+        max_age=SAMPLE_MAX_AGE
+    )
+    if use_gzip:
+        response.headers["Content-Encoding"] = "gzip"
+    response.vary.add("Accept-Encoding")
+    return response
+
+def processed_sample(dataset_name):
+    """The sample's processed dataset, from the upload cache or processed once and cached."""
+    cache_key = upload_cache.key(samples.digest(dataset_name))
+    cached = upload_cache.get(cache_key)
+    if cached is not None:
+        return cache_key, cached, "hit"
+
+    with open(samples.path(dataset_name), "rb") as f:
+        processed, error = parse_upload(f, "full")
+    if error:
+        raise ValueError(error)
+    upload_cache.put(cache_key, *processed)
+    return cache_key, processed, "miss"
+
+def precompute_samples():
+    """Fill the upload cache with every sample so /load_sample never has to process one."""
+    for name in samples.names():
+        processed_sample(name)
+        samples.gzip_path(name)
+
+@app.route("/load_sample/<dataset_name>", methods=["POST"])
+def load_sample(dataset_name):
+    """Load a sample straight into the session; same response as uploading the file to /upload."""
+    session_id = current_session_id()
+    if not samples.path(dataset_name):
         return jsonify({"error": "Invalid dataset name"}), 404
 
     try:
-        # Fetch the file content from the external URL
-        response = requests.get(url)
-        response.raise_for_status()  # Raise an exception for bad status codes (4xx or 5xx)
+        cache_key, processed, cache_status = processed_sample(dataset_name)
+        return use_processed(session_id, cache_key, processed, cache_status)
+    except Exception as e:
+        print(f"❌ An error occurred while loading sample {dataset_name}: {e}")
+        return jsonify({"error": f"An error occurred during processing: {str(e)}"}), 500
 
-        # Create a file-like object in memory
-        file_buffer = io.BytesIO(response.content)
-
-        # Send the file to the user, forcing a download
-        return send_file(
-            file_buffer,
-            as_attachment=True,
-            download_name=f"{dataset_name}_data.csv",
-            mimetype="text/csv"
-        )
-    except requests.exceptions.RequestException as e:
-        return jsonify({"error": f"Failed to fetch the dataset: {str(e)}"}), 502
+if os.environ.get("PRECOMPUTE_SAMPLES") == "1":
+    precompute_samples()
+
+# Define the expected features in the correct order for the model
+# This should match the features the pre-trained model was trained on.
+# We'll use the Kepler model's features as a default.
+SINGLE_PREDICTION_FEATURES = [
+    'pl_rade', 'pl_orbper', 'pl_trandep', 'pl_trandurh', 
+    'pl_eqt', 'pl_insol', 'st_teff', 'st_rad', 'ra', 'dec'
+]
+
+# Map numeric predictions back to human-readable labels
+PREDICTION_LABELS = {0: 'FALSE POSITIVE', 1: 'CANDIDATE', 2: 'CONFIRMED'}
+
+def feature_row(obj):
+    # Fill any missing features with 0
+    return [np.nan if obj.get(feat, 0) is None else float(obj.get(feat, 0)) for feat in SINGLE_PREDICTION_FEATURES]
+
+# Up to this many rows the compiled NumPy scorer beats the native predict_proba (DataFrame + DMatrix setup)
+COMPILED_SCORER_MAX_ROWS = int(os.environ.get("COMPILED_SCORER_MAX_ROWS", 64))
+
+def score_feature_rows(mission, rows):
+    """Score many feature rows with one vectorized call. Returns (predictions, probabilities)."""
+    entry = model_registry.get(PRETRAINED_MODELS[mission])
+    X = np.asarray(rows, dtype=float).reshape(-1, len(SINGLE_PREDICTION_FEATURES))
+
+    if entry.scorer is not None and len(X) <= COMPILED_SCORER_MAX_ROWS:
+        columns = [SINGLE_PREDICTION_FEATURES.index(feat) for feat in entry.scorer.feature_names]
+        proba = entry.scorer.predict_proba(X[:, columns])
+    else:
+        with lease("predict") as threads, entry.lock:
+            set_threads(entry.model, threads)
+            proba = entry.model.predict_proba(pd.DataFrame(X, columns=SINGLE_PREDICTION_FEATURES))
+    preds = np.asarray(entry.model.classes_)[proba.argmax(axis=1)]
+    return preds, proba
+
+def _score_micro_batch(mission, rows):
+    preds, proba = score_feature_rows(mission, rows)
+    return list(zip(preds.tolist(), proba.tolist()))
+
+# Concurrent /predict_single calls are scored together in short micro-batches
+single_batcher = MicroBatcher(
+    _score_micro_batch,
+    max_batch_size=int(os.environ.get("MICRO_BATCH_SIZE", 256)),
+    max_wait=float(os.environ.get("MICRO_BATCH_WAIT_MS", 2)) / 1000
+)
+
+def requested_mission(data=None):
+    mission = (request.args.get("mission") or (data or {}).get("mission") or "kepler").lower()
+    if mission not in PRETRAINED_MODELS:
+        raise ValueError(f"Unknown mission '{mission}'. Use one of {list(PRETRAINED_MODELS)}.")
+    if not os.path.exists(PRETRAINED_MODELS[mission]):
+        raise ValueError(f"No pretrained model is available for mission '{mission}'.")
+    return mission
 
 @app.route("/predict_single", methods=["POST"])
 def predict_single_object():
@@ -567,36 +999,116 @@ def predict_single_object():
         return jsonify({"error": "Request must be JSON"}), 400
 
     data = request.get_json()
-    
-    # Define the expected features in the correct order for the model
-    # This should match the features the pre-trained model was trained on.
-    # We'll use the Kepler model's features as a default.
-    model_features = [
-        'pl_rade', 'pl_orbper', 'pl_trandep', 'pl_trandurh', 
-        'pl_eqt', 'pl_insol', 'st_teff', 'st_rad', 'ra', 'dec'
-    ]
 
     try:
-        # Create a DataFrame for the single prediction
-        # Fill any missing features with 0
-        input_data = {feat: [data.get(feat, 0)] for feat in model_features}
-        df_predict = pd.DataFrame(input_data)
-
-        # Load the pre-trained model (e.g., the Kepler model as a robust default)
-        model_path = "xgb_kepler_model.pkl"
-        model = joblib.load(model_path)
+        # Uses the resident pre-trained model (the Kepler model as a robust default)
+        mission = requested_mission(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-        # Ensure column order matches the model's expectation
-        df_predict = df_predict[model_features]
-
-        # Make the prediction
-        prediction = model.predict(df_predict)
+    try:
+        with stage("predict"):
+            prediction, probabilities = single_batcher.submit(mission, feature_row(data))
         
         # Return the single prediction result (0, 1, or 2)
-        return jsonify({"prediction": int(prediction[0])})
+        return jsonify({"prediction": int(prediction), "probabilities": probabilities})
 
     except Exception as e:
         return jsonify({"error": f"Single prediction failed: {str(e)}"}), 500
 
+@app.route("/predict_batch", methods=["POST"])
+def predict_batch():
+    """
+    Scores many objects in one call. Accepts a JSON array of feature dicts,
+    {"objects": [...], "mission": "tess"}, or NDJSON (one dict per line).
+    Features are the same as /predict_single; missing ones are filled with 0.
+    """
+    try:
+        if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+            objects = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+            data = {}
+        else:
+            data = request.get_json(silent=True)
+            if data is None:
+                return jsonify({"error": "Request must be a JSON array, an object with 'objects', or NDJSON"}), 400
+            objects = data if isinstance(data, list) else data.get("objects", [])
+            data = data if isinstance(data, dict) else {}
+
+        if not isinstance(objects, list) or not all(isinstance(obj, dict) for obj in objects):
+            return jsonify({"error": "Each object must be a JSON object of feature values."}), 400
+
+        mission = requested_mission(data)
+        rows = [feature_row(obj) for obj in objects]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        with stage("predict"):
+            preds, proba = score_feature_rows(mission, rows) if rows else (np.array([], dtype=int), np.empty((0, 0)))
+        model = model_registry.get_model(PRETRAINED_MODELS[mission])
+
+        return jsonify({
+            "mission": mission,
+            "count": len(preds),
+            "classes": np.asarray(model.classes_).tolist(),
+            "predictions": preds.tolist(),
+            "labels": [PREDICTION_LABELS.get(p) for p in preds.tolist()],
+            "probabilities": proba.tolist()
+        })
+
+    except Exception as e:
+        return jsonify({"error": f"Batch prediction failed: {str(e)}"}), 500
+
+def _cache_metrics():
+    """Counters the caches and the micro-batcher already keep, exported on every /metrics scrape."""
+    models = model_registry.stats()
+    yield "orbital_models_loaded", "gauge", len(models["loaded"])
+    for name in ("hits", "misses", "reloads", "evictions"):
+        yield f"orbital_model_cache_{name}_total", "counter", models[name]
+
+    uploads = upload_cache.stats()
+    yield "orbital_upload_cache_hits_total", "counter", uploads["hits"]
+    yield "orbital_upload_cache_misses_total", "counter", uploads["misses"]
+
+    uploaded = uploaded_models.stats()
+    yield "orbital_uploaded_models_loaded", "gauge", len(uploaded["loaded"])
+    yield "orbital_uploaded_models_stored_total", "counter", uploaded["stored"]
+    yield "orbital_uploaded_models_reused_total", "counter", uploaded["reused"]
+    yield "orbital_uploaded_model_loads_total", "counter", uploaded["misses"] + uploaded["reloads"]
+
+    predictions = prediction_cache.stats()
+    yield "orbital_prediction_cache_hits_total", "counter", predictions["hits"]
+    yield "orbital_prediction_cache_misses_total", "counter", predictions["misses"]
+    yield "orbital_prediction_cache_evictions_total", "counter", predictions["evictions"]
+    yield "orbital_prediction_cache_bytes", "gauge", predictions["bytes"]
+
+    rendered = plot_cache.stats()
+    yield "orbital_plot_cache_hits_total", "counter", rendered["hits"]
+    yield "orbital_plot_renders_total", "counter", rendered["renders"]
+
+    store = sessions.stats()
+    yield "orbital_sessions_in_memory", "gauge", store["sessions_in_memory"]
+    yield "orbital_session_memory_bytes", "gauge", store["bytes_in_memory"]
+    yield "orbital_session_cache_hits_total", "counter", store["hits"]
+    yield "orbital_session_disk_loads_total", "counter", store["disk_loads"]
+    yield "orbital_session_evictions_total", "counter", store["evictions"]
+
+    batches = single_batcher.stats()
+    yield "orbital_micro_batches_total", "counter", batches["batches"]
+    yield "orbital_micro_batch_rows_total", "counter", batches["rows"]
+
+    yield "orbital_training_jobs_running", "gauge", training_jobs.running_count()
+
+    threads = thread_budget.stats()
+    yield "orbital_thread_budget_cores", "gauge", threads["cores"]
+    yield "orbital_thread_budget_share", "gauge", threads["share"]
+    yield "orbital_thread_budget_threads_in_use", "gauge", threads["threads_in_use"]
+    for kind, count in threads["leases"].items():
+        yield "orbital_thread_leases_total", "counter", count, {"kind": kind}
+        yield "orbital_threads_granted_total", "counter", threads["granted"][kind], {"kind": kind}
+        yield "orbital_thread_last_grant", "gauge", threads["last"][kind]["threads"], {"kind": kind}
+
+metrics.add_collector(_cache_metrics)
+
 if __name__ == "__main__":
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,271 @@
+"""
+Drive the Flask app through its test client and measure the hot paths:
+/upload (cold and cached), /train (xgb, lgbm, with and without plots), /predict, /predict_single,
+/predict_batch, /predict_file and the exports, on the sample catalogs in assets/ and on
+copies of them scaled up by row count.
+
+    python benchmarks/bench_app.py [--scales 1,10,100,1000] [--datasets kepler,tess,k2]
+                                   [--repeat N] [--output results.json] [--compare old.json]
+
+Every (dataset, scale) runs in a fresh subprocess with its own state
+directory, so caches start cold and peak RSS is not shared between runs.
+Results are written as JSON (one record per endpoint/dataset/scale) with
+latency percentiles, throughput and the peak RSS of that step.
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DATASETS = {
+    "kepler": "cumulative_2025.09.25_12.58.46.csv",
+    "tess": "TOI_2025.09.25_11.42.37.csv",
+    "k2": "k2pandc_2025.09.25_12.59.27.csv",
+}
+
+SINGLE_OBJECT = {
+    "pl_rade": 2.1, "pl_orbper": 10.5, "pl_trandep": 500, "pl_trandurh": 3.2, "pl_eqt": 800,
+    "pl_insol": 50, "st_teff": 5600, "st_rad": 1.0, "ra": 290, "dec": 45
+}
+
+
+def scaled_copy(source, scale, directory):
+    """Write `source` with its data rows repeated `scale` times (comment lines and header kept once)."""
+    if scale == 1:
+        return source
+    target = os.path.join(directory, f"{scale}x-{os.path.basename(source)}")
+    with open(source, "rb") as f:
+        lines = f.readlines()
+    header_end = next(i for i, line in enumerate(lines) if not line.startswith(b"#")) + 1
+    preamble, rows = lines[:header_end], lines[header_end:]
+    with open(target, "wb") as f:
+        f.writelines(preamble)
+        for _ in range(scale):
+            f.writelines(rows)
+    return target
+
+
+def count_rows(path):
+    with open(path, "rb") as f:
+        return sum(1 for line in f if not line.startswith(b"#")) - 1
+
+
+# ---------------------------------------------------------------------------
+# Peak RSS per step. Linux lets us reset the high-water mark between steps;
+# elsewhere ru_maxrss is the peak of the whole process so far.
+
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        "min": timings[0] * 1000,
+        "median": statistics.median(timings) * 1000,
+        "p95": timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))] * 1000,
+        "max": timings[-1] * 1000,
+    }
+
+
+def measure(records, base, endpoint, call, repeat, units=None, variant=None):
+    """
+    Run `call()` (which returns a response) `repeat` times.
+    `units` is how many rows/objects one call handles, for throughput.
+    """
+    reset_peak_rss()
+    timings, error = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = call()
+        timings.append(time.perf_counter() - start)
+        if response.status_code >= 400 and error is None:
+            error = f"HTTP {response.status_code}: {response.get_data(as_text=True)[:200]}"
+
+    latency = summarize(timings)
+    record = dict(base, endpoint=endpoint, variant=variant, repeat=repeat, latency_ms=latency,
+                  peak_rss_mb=round(peak_rss_mb(), 1))
+    if units:
+        record["throughput_per_s"] = units / (latency["median"] / 1000)
+    if error:
+        record["error"] = error
+    records.append(record)
+    print(f"  {endpoint:<22} {variant or '':<8} median {latency['median']:9.1f} ms  "
+          f"peak RSS {record['peak_rss_mb']:7.1f} MB{'  ' + error if error else ''}", file=sys.stderr)
+
+
+def run_worker(dataset, scale, repeat, single_requests, result_file):
+    """Benchmark one dataset at one scale inside this (fresh) process."""
+    work_dir = tempfile.mkdtemp(prefix="orbital-bench-")
+    # Must be set before the app is imported so every cache starts empty
+    os.environ["ORBITAL_STATE_DIR"] = os.path.join(work_dir, "state")
+
+    path = scaled_copy(os.path.join(ROOT, "assets", DATASETS[dataset]), scale, work_dir)
+    with open(path, "rb") as f:
+        payload = f.read()
+    rows = count_rows(path)
+    base = {"dataset": dataset, "scale": scale, "rows": rows, "bytes": len(payload)}
+
+    import app as orbital_app
+    client = orbital_app.app.test_client()
+    headers = {"X-Session-ID": "bench"}
+    records = []
+    nonce = [0]
+
+    def upload(fresh):
+        # A unique comment line makes each cold upload miss the content-hash cache
+        if fresh:
+            nonce[0] += 1
+        body = b"# bench %d\n" % nonce[0] + payload
+        return client.post("/upload", data={"file": (io.BytesIO(body), "bench.csv")},
+                           headers=headers, content_type="multipart/form-data")
+
+    def drain(response):
+        # Exports stream; make sure every chunk is produced
+        if response.status_code < 400:
+            for _ in response.response:
+                pass
+        return response
+
+    measure(records, base, "/upload", lambda: upload(True), repeat, units=rows, variant="cold")
+    measure(records, base, "/upload", lambda: upload(False), repeat, units=rows, variant="cached")
+
+    for model in ("xgb", "lgbm"):
+        measure(records, base, "/train", lambda: client.post("/train", json={"model": model}, headers=headers),
+                repeat, units=rows, variant=model)
+        # Raw metric arrays only; the plots would be fetched from /plots/<key>.png
+        measure(records, base, "/train", lambda: client.post("/train", json={"model": model, "plots": False}, headers=headers),
+                repeat, units=rows, variant=f"{model}-raw")
+
+    measure(records, base, "/predict", lambda: client.post("/predict", json={"include_rows": False}, headers=headers),
+            repeat, units=rows)
+
+    # Latency of individual requests, so p95 means something here
+    measure(records, base, "/predict_single", lambda: client.post("/predict_single", json=SINGLE_OBJECT),
+            repeat * single_requests, units=1)
+
+    batch = [SINGLE_OBJECT] * 1000
+    measure(records, base, "/predict_batch", lambda: client.post("/predict_batch", json=batch), repeat, units=len(batch))
+
+    for file_format in ("csv", "csv.gz", "parquet"):
+        measure(records, base, "/save", lambda: drain(client.get(f"/save?format={file_format}", headers=headers, buffered=False)),
+                repeat, units=rows, variant=file_format)
+    measure(records, base, "/download_predictions",
+            lambda: drain(client.get("/download_predictions", headers=headers, buffered=False)), repeat, units=rows, variant="csv")
+
+    def predict_file(fill):
+        # The body is read from disk as the app consumes it, so peak RSS is the server's alone
+        with open(path, "rb") as f:
+            return drain(client.post(f"/predict_file?fill={fill}", input_stream=f, content_type="text/csv",
+                                     headers={"Content-Length": str(len(payload))}, buffered=False))
+
+    for fill in ("median", "none"):
+        measure(records, base, "/predict_file", lambda: predict_file(fill), repeat, units=rows, variant=fill)
+
+    with open(result_file, "w") as f:
+        json.dump(records, f)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+
+def compare(old_path, new_results):
+    with open(old_path) as f:
+        old = {(r["dataset"], r["scale"], r["endpoint"], r["variant"]): r
+               for r in json.load(f)["results"] if "latency_ms" in r}
+    print(f"{'dataset':<7} {'scale':>5} {'endpoint':<22} {'variant':<8} {'old ms':>9} {'new ms':>9} {'change':>8}")
+    for r in new_results:
+        before = old.get((r["dataset"], r["scale"], r["endpoint"], r["variant"]))
+        if before is None:
+            continue
+        old_ms, new_ms = before["latency_ms"]["median"], r["latency_ms"]["median"]
+        print(f"{r['dataset']:<7} {r['scale']:>5} {r['endpoint']:<22} {r['variant'] or '':<8} "
+              f"{old_ms:>9.1f} {new_ms:>9.1f} {(new_ms / old_ms - 1) * 100:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="1,10,100", help="comma separated row multipliers (e.g. 1,10,100,1000)")
+    parser.add_argument("--datasets", default=",".join(DATASETS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--single-requests", type=int, default=100, help="/predict_single calls per repetition")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="earlier --output file to compare medians against")
+    parser.add_argument("--worker", nargs=2, metavar=("DATASET", "SCALE"), help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.worker[0], int(args.worker[1]), args.repeat, args.single_requests, args.result_file)
+        return
+
+    results = []
+    for dataset in args.datasets.split(","):
+        for scale in (int(s) for s in args.scales.split(",")):
+            print(f"{dataset} x{scale}", file=sys.stderr)
+            with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+                result_file = f.name
+            command = [sys.executable, os.path.abspath(__file__), "--worker", dataset, str(scale),
+                       "--repeat", str(args.repeat), "--single-requests", str(args.single_requests),
+                       "--result-file", result_file]
+            # The app's own logging goes to /dev/null; the worker reports progress on stderr
+            completed = subprocess.run(command, stdout=subprocess.DEVNULL)
+            if completed.returncode != 0:
+                results.append({"dataset": dataset, "scale": scale, "error": f"worker exited with {completed.returncode}"})
+                continue
+            with open(result_file) as f:
+                results.extend(json.load(f))
+            os.remove(result_file)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"Wrote {len(results)} results to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        compare(args.compare, [r for r in results if "latency_ms" in r])
+
+
+if __name__ == "__main__":
+    main()
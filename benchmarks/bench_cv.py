@@ -0,0 +1,73 @@
+"""
+Wall-clock time of the cross-validation training mode
+(cross_validation.cross_validate, run by /train_jobs {"mode": "cv"})
+with 1, 2, 4... fold worker processes.
+
+    python benchmarks/bench_cv.py [--dataset k2] [--model xgb] [--folds 5] [--repeats 2] [--scale S] [--workers 1,2,4]
+
+Uploads the sample (rows repeated `scale` times) to an in-process app,
+then cross-validates the session's features once per worker count, with
+as many threads to split between the folds as workers, i.e. what a CV job
+does under a lease of that many threads. The scores must not depend on
+the worker count; the speedup is only meaningful with that many free cores.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_app import DATASETS, scaled_copy  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", choices=sorted(DATASETS), default="k2")
+    parser.add_argument("--model", choices=["xgb", "lgbm"], default="xgb")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=2)
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--workers", default="1,2,4", help="comma separated worker counts")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="orbital-cv-")
+    os.environ["ORBITAL_STATE_DIR"] = os.path.join(work_dir, "state")
+    path = scaled_copy(os.path.join(ROOT, "assets", DATASETS[args.dataset]), args.scale, work_dir)
+
+    import app as orbital_app
+    client = orbital_app.app.test_client()
+    headers = {"X-Session-ID": "cv"}
+    with open(path, "rb") as f:
+        client.post("/upload", data={"file": (io.BytesIO(f.read()), "bench.csv")}, headers=headers,
+                    content_type="multipart/form-data")
+
+    from cross_validation import cross_validate
+
+    state = orbital_app.sessions.get_many("cv", "dataset", "features")
+    df_core = state["dataset"].core()
+    X, y = df_core[state["features"]], df_core["target"]
+    results = []
+    for workers in [int(w) for w in args.workers.split(",")]:
+        start = time.perf_counter()
+        result = cross_validate(X, y, args.model, {}, folds=args.folds, repeats=args.repeats,
+                                max_workers=workers, threads=workers)
+        elapsed = time.perf_counter() - start
+        results.append({"workers": workers, "seconds": elapsed, "fit_seconds": result["training"]["fit_seconds"],
+                        "threads_per_fold": result["training"]["threads_per_fold"],
+                        "accuracy": result["aggregate"]["accuracy"]["mean"],
+                        "oof_accuracy": result["aggregate"]["oof_accuracy"]})
+
+    base = results[0]["seconds"]
+    for r in results:
+        print(f"{r['workers']} workers: {r['seconds']:.2f} s ({base / r['seconds']:.2f}x), "
+              f"fits {r['fit_seconds']:.2f} s, accuracy {r['accuracy']:.4f}", file=sys.stderr)
+    print(json.dumps(results, indent=1))
+
+
+if __name__ == "__main__":
+    main()
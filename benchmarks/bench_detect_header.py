@@ -0,0 +1,75 @@
+"""
+Compare the old skiprows-probing header detection against the single-pass
+locator on the sample catalogs in assets/.
+
+    python benchmarks/bench_detect_header.py [--repeat N]
+"""
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from preprocessing import detect_header  # noqa: E402
+
+TARGET_KEYWORDS = ["koi_disposition", "tfopwg_disp", "disposition"]
+
+
+def legacy_detect_header(raw_data, target_keywords, max_skip=300):
+    # The original implementation: re-parse the whole file for every skiprows value
+    df = None
+    header_line = None
+
+    for skip in range(max_skip):
+        try:
+            candidate = pd.read_csv(io.StringIO(raw_data), skiprows=skip, nrows=5)
+            if any(col.lower() in [t.lower() for t in target_keywords] for col in candidate.columns):
+                df = pd.read_csv(io.StringIO(raw_data), skiprows=skip)
+                header_line = skip
+                break
+        except Exception:
+            continue
+
+    if df is None:
+        return None, None, "Could not detect valid dataset header"
+
+    return df, header_line, None
+
+
+def best_of(fn, raw_data, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(raw_data, TARGET_KEYWORDS)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'file':<40} {'header':>6} {'legacy s':>9} {'single s':>9} {'speedup':>8}")
+    for path in sorted(glob.glob(os.path.join(ROOT, "assets", "*.csv"))):
+        with open(path, "rb") as f:
+            raw_data = f.read().decode("utf-8", errors="ignore")
+
+        legacy_time, (legacy_df, legacy_line, _) = best_of(legacy_detect_header, raw_data, args.repeat)
+        new_time, (new_df, new_line, _) = best_of(detect_header, raw_data, args.repeat)
+
+        assert legacy_line == new_line, f"header mismatch for {path}: {legacy_line} != {new_line}"
+        pd.testing.assert_frame_equal(legacy_df, new_df)
+
+        print(f"{os.path.basename(path):<40} {new_line:>6} {legacy_time:>9.3f} {new_time:>9.3f} {legacy_time / new_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+Startup cost of the app: how long a fresh interpreter takes to import
+app.py and how much memory it holds, and the per-worker memory of a real
+gunicorn server with and without preloading in the master.
+
+    python benchmarks/bench_startup.py [--repeat N] [--workers W] [--skip-gunicorn]
+
+RSS counts every page a worker maps; PSS splits pages shared with the
+master and the other workers between them, so summing PSS over the
+workers gives what they really cost together.
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["pandas", "xgboost", "sklearn", "scipy", "lightgbm", "matplotlib", "seaborn"]
+
+SINGLE_OBJECT = {
+    "pl_rade": 2.1, "pl_orbper": 10.5, "pl_trandep": 500, "pl_trandurh": 3.2, "pl_eqt": 800,
+    "pl_insol": 50, "st_teff": 5600, "st_rad": 1.0, "ra": 290, "dec": 45
+}
+
+IMPORT_PROBE = f"""
+import json, sys, time
+sys.path.insert(0, {ROOT!r})
+start = time.perf_counter()
+import app
+seconds = time.perf_counter() - start
+rss = next(int(l.split()[1]) for l in open("/proc/self/status") if l.startswith("VmRSS:"))
+print(json.dumps({{"seconds": seconds, "rss_mb": rss / 1024,
+                  "loaded": [m for m in {HEAVY_MODULES!r} if m in sys.modules]}}))
+"""
+
+
+def memory_mb(pid):
+    """(RSS, PSS) of a process in MB, from smaps_rollup."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                values[parts[0][:-1]] = int(parts[1]) / 1024
+    return values["Rss"], values["Pss"]
+
+
+def children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(p) for p in f.read().split()]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def cold_import(repeat):
+    runs = []
+    for _ in range(repeat):
+        env = dict(os.environ, ORBITAL_STATE_DIR=tempfile.mkdtemp(prefix="orbital-startup-"))
+        output = subprocess.run([sys.executable, "-c", IMPORT_PROBE], env=env, capture_output=True, text=True, check=True)
+        runs.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    return {
+        "import_seconds": statistics.median(r["seconds"] for r in runs),
+        "rss_mb": statistics.median(r["rss_mb"] for r in runs),
+        "loaded": runs[-1]["loaded"],
+    }
+
+
+def post_json(url, payload):
+    request = urllib.request.Request(url, data=json.dumps(payload).encode(), headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.status
+
+
+def gunicorn_run(preload, workers):
+    port = free_port()
+    env = dict(os.environ, ORBITAL_PRELOAD="1" if preload else "0", WEB_CONCURRENCY=str(workers),
+               BIND=f"127.0.0.1:{port}", ORBITAL_STATE_DIR=tempfile.mkdtemp(prefix="orbital-startup-"))
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "app:app"], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        url = f"http://127.0.0.1:{port}/predict_single"
+        while True:
+            if server.poll() is not None:
+                raise RuntimeError(f"gunicorn exited with {server.returncode}")
+            try:
+                post_json(url, SINGLE_OBJECT)
+                break
+            except OSError:
+                time.sleep(0.05)
+        ready = time.perf_counter() - start
+
+        # Wait for every worker to boot, then let each of them serve some requests
+        while len(children(server.pid)) < workers:
+            time.sleep(0.05)
+        for _ in range(20 * workers):
+            post_json(url, SINGLE_OBJECT)
+
+        worker_memory = [memory_mb(pid) for pid in children(server.pid)]
+        master_rss, master_pss = memory_mb(server.pid)
+        return {
+            "preload": preload,
+            "workers": workers,
+            "first_response_seconds": ready,
+            "master_rss_mb": master_rss,
+            "worker_rss_mb": [round(rss, 1) for rss, _ in worker_memory],
+            "worker_pss_mb": [round(pss, 1) for _, pss in worker_memory],
+            "total_pss_mb": master_pss + sum(pss for _, pss in worker_memory),
+        }
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait(timeout=30)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--skip-gunicorn", action="store_true")
+    args = parser.parse_args()
+
+    report = {"cold_import": cold_import(args.repeat)}
+    cold = report["cold_import"]
+    print(f"import app: {cold['import_seconds']:.2f} s, RSS {cold['rss_mb']:.0f} MB, loaded {', '.join(cold['loaded'])}")
+
+    if not args.skip_gunicorn:
+        report["gunicorn"] = []
+        for preload in (False, True):
+            run = gunicorn_run(preload, args.workers)
+            report["gunicorn"].append(run)
+            print(f"gunicorn preload={str(preload):<5} first response {run['first_response_seconds']:.2f} s, "
+                  f"worker RSS {run['worker_rss_mb']} MB, worker PSS {run['worker_pss_mb']} MB, "
+                  f"total PSS {run['total_pss_mb']:.0f} MB")
+
+    print(json.dumps(report, indent=1))
+
+
+if __name__ == "__main__":
+    main()
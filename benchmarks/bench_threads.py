@@ -0,0 +1,132 @@
+"""
+Aggregate throughput of several app processes training and predicting at
+the same time, with the thread budget (thread_budget.py) on and off.
+
+    python benchmarks/bench_threads.py [--processes P] [--rounds N] [--scale S] [--cores C]
+
+Each process stands in for a gunicorn worker: it imports the app, uploads
+the Kepler sample (rows repeated `scale` times), then, once every process
+is ready, runs `rounds` of /train (xgb, no plots), /predict and a
+1000-row /predict_batch. Without the budget every XGBoost/LightGBM call
+starts a thread per core, so P processes run P times as many threads as
+there are cores; with it they split the cores between them.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_app import DATASETS, SINGLE_OBJECT, scaled_copy  # noqa: E402
+
+
+def run_worker(rounds, scale):
+    import io
+    work_dir = tempfile.mkdtemp(prefix="orbital-threads-")
+    os.environ["ORBITAL_STATE_DIR"] = os.path.join(work_dir, "state")
+    path = scaled_copy(os.path.join(ROOT, "assets", DATASETS["kepler"]), scale, work_dir)
+    with open(path, "rb") as f:
+        payload = f.read()
+
+    import app as orbital_app
+    client = orbital_app.app.test_client()
+    headers = {"X-Session-ID": "threads"}
+    client.post("/upload", data={"file": (io.BytesIO(payload), "bench.csv")}, headers=headers,
+                content_type="multipart/form-data")
+    # Warm the training matrices and lazy imports so only steady-state work is timed
+    client.post("/train", json={"model": "xgb", "plots": False}, headers=headers)
+
+    print("ready", flush=True)
+    sys.stdin.readline()  # "go" from the parent, sent once every worker is ready
+
+    timings = {"train": [], "predict": [], "predict_batch": []}
+    batch = [SINGLE_OBJECT] * 1000
+    calls = {
+        "train": lambda: client.post("/train", json={"model": "xgb", "plots": False}, headers=headers),
+        "predict": lambda: client.post("/predict", json={"include_rows": False}, headers=headers),
+        "predict_batch": lambda: client.post("/predict_batch", json=batch),
+    }
+    for _ in range(rounds):
+        for name, call in calls.items():
+            start = time.perf_counter()
+            response = call()
+            timings[name].append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{name}: HTTP {response.status_code}")
+    print(json.dumps({"timings": timings, "budget": orbital_app.thread_budget.stats()}), flush=True)
+
+
+def run(processes, rounds, scale, budget, cores):
+    env = dict(os.environ, THREAD_BUDGET="1" if budget else "0", ORBITAL_THREAD_PROCESSES=str(processes))
+    if cores:
+        env["ORBITAL_CORES"] = str(cores)
+    workers = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker", "--rounds", str(rounds),
+                                 "--scale", str(scale)], env=env, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+               for _ in range(processes)]
+
+    def last_line(worker):
+        # The app prints its own progress on stdout; our messages come last
+        while True:
+            line = worker.stdout.readline()
+            if not line:
+                raise RuntimeError(f"worker exited with {worker.wait()}")
+            if line.startswith("ready") or line.startswith("{"):
+                return line
+
+    for worker in workers:
+        last_line(worker)
+    start = time.perf_counter()
+    for worker in workers:
+        worker.stdin.write("go\n")
+        worker.stdin.flush()
+    reports = [json.loads(last_line(worker)) for worker in workers]
+    elapsed = time.perf_counter() - start
+    for worker in workers:
+        worker.wait()
+
+    medians = {name: statistics.median(t for r in reports for t in r["timings"][name]) * 1000
+               for name in reports[0]["timings"]}
+    return {
+        "budget": budget,
+        "processes": processes,
+        "seconds": elapsed,
+        "rounds_per_s": processes * rounds / elapsed,
+        "median_ms": medians,
+        "threads": reports[0]["budget"] if budget else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--cores", type=int, help="ORBITAL_CORES for the workers (default: detected)")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.rounds, args.scale)
+        return
+
+    results = []
+    for budget in (False, True):
+        result = run(args.processes, args.rounds, args.scale, budget, args.cores)
+        results.append(result)
+        print(f"budget={'on ' if budget else 'off'} {args.processes} processes: {result['rounds_per_s']:.2f} rounds/s "
+              f"({result['seconds']:.1f} s), median ms " +
+              ", ".join(f"{name} {ms:.0f}" for name, ms in result["median_ms"].items()), file=sys.stderr)
+    off, on = results
+    print(f"throughput with budget: {on['rounds_per_s'] / off['rounds_per_s']:.2f}x", file=sys.stderr)
+    print(json.dumps(results, indent=1))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import os, time, multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from training import fit_model, TrainingCancelled
+from thread_budget import available_cores
+
+# Accepted range for the number of folds and for how often the k-fold split is repeated
+MAX_FOLDS = 20
+MAX_REPEATS = 10
+# Share of each fold's training rows LightGBM early-stops on, so it never sees the held-out fold
+STOPPING_FRACTION = 0.15
+
+CLASS_LABELS = ["False Positive", "Candidate", "Confirmed"]
+
+
+def cv_config(data):
+    """Validate the cross-validation options of a /train body, or raise ValueError."""
+    try:
+        config = {"folds": int(data.get("folds", 5)), "repeats": int(data.get("repeats", 1)),
+                  "seed": int(data.get("seed", 42))}
+    except (TypeError, ValueError):
+        raise ValueError("folds, repeats and seed must be integers.")
+    if not 2 <= config["folds"] <= MAX_FOLDS:
+        raise ValueError(f"folds must be between 2 and {MAX_FOLDS}.")
+    if not 1 <= config["repeats"] <= MAX_REPEATS:
+        raise ValueError(f"repeats must be between 1 and {MAX_REPEATS}.")
+    return config
+
+
+# ---------------------------------------------------------------------------
+# Pool workers: the dataset is sent once per worker, each fold only sends row indices
+
+_DATA = {}
+
+
+def _init_worker(X, y, model_choice, hyperparams, n_jobs, seed):
+    _DATA.update(X=X, y=y, model_choice=model_choice, hyperparams=hyperparams, n_jobs=n_jobs, seed=seed,
+                 classes=np.unique(y))
+
+
+def fit_fold(repeat, fold, train_rows, test_rows):
+    """Fit and score one fold on the worker's data. Returns (scores, test_rows, probabilities)."""
+    from sklearn.metrics import accuracy_score, confusion_matrix, log_loss, roc_auc_score
+    from sklearn.model_selection import train_test_split
+
+    data = _DATA
+    X, y, classes = data["X"], np.asarray(data["y"]), data["classes"]
+    # The eval set only records history for XGBoost, but LightGBM picks its
+    # iteration count on it, so that one gets a slice of the training rows
+    fit_rows, eval_rows = train_rows, test_rows
+    if data["model_choice"] == "lgbm":
+        fit_rows, eval_rows = train_test_split(train_rows, test_size=STOPPING_FRACTION,
+                                               random_state=data["seed"] + fold)
+    start = time.perf_counter()
+    model, _ = fit_model(X.iloc[fit_rows], y[fit_rows], X.iloc[eval_rows], y[eval_rows],
+                         data["model_choice"], data["hyperparams"], n_jobs=data["n_jobs"], verbose=False)
+    fit_seconds = time.perf_counter() - start
+
+    # Columns in the order of `classes`, even if a class is missing from this fold's training rows
+    proba = np.zeros((len(test_rows), len(classes)))
+    proba[:, np.searchsorted(classes, model.classes_)] = model.predict_proba(X.iloc[test_rows])
+    proba /= proba.sum(axis=1, keepdims=True)  # float32 outputs don't sum to exactly one
+    y_test, y_pred = y[test_rows], classes[proba.argmax(axis=1)]
+
+    try:
+        auc = float(roc_auc_score(y_test, proba[:, 1]) if len(classes) == 2 else
+                    roc_auc_score(y_test, proba, multi_class="ovr", labels=classes))
+    except ValueError:
+        auc = None  # a class is missing from this test fold
+    scores = {
+        "repeat": repeat, "fold": fold, "train_rows": len(train_rows), "test_rows": len(test_rows),
+        "accuracy": float(accuracy_score(y_test, y_pred)),
+        "logloss": float(log_loss(y_test, proba, labels=classes)),
+        "auc_score": auc,
+        "confusion_matrix": confusion_matrix(y_test, y_pred, labels=classes).tolist(),
+        "fit_seconds": round(fit_seconds, 3),
+    }
+    return scores, test_rows, proba
+
+
+# ---------------------------------------------------------------------------
+
+def _summary(values):
+    values = [v for v in values if v is not None]
+    if not values:
+        return None
+    return {"mean": float(np.mean(values)), "std": float(np.std(values)),
+            "min": float(np.min(values)), "max": float(np.max(values))}
+
+
+def cross_validate(X, y, model_choice, hyperparams, folds=5, repeats=1, seed=42, max_workers=None,
+                   threads=None, progress=None):
+    """
+    Stratified k-fold cross-validation of the model /train would fit,
+    `repeats` times with differently shuffled folds. Each fold is fitted
+    with fit_model on the other folds and scored on its own rows, which
+    never take part in fitting or early stopping.
+
+    Folds run in a process pool of `max_workers` (default: CV_MAX_WORKERS,
+    else one per thread of `threads`, else per core) that splits `threads`
+    between them, so every fit is capped at threads // max_workers and the
+    wall-clock time drops close to linearly with the cores available.
+
+    `progress(folds_done, metrics, fold=scores)` is called as folds finish;
+    returning True cancels (TrainingCancelled). Returns the /train payload:
+    per-fold scores, their mean/std, the summed confusion matrix and the
+    out-of-fold class probabilities of every row (averaged over repeats).
+    """
+    from sklearn.model_selection import RepeatedStratifiedKFold, StratifiedKFold
+    from sklearn.metrics import accuracy_score
+
+    y_values = np.asarray(y)
+    classes = np.unique(y_values)
+    if len(classes) < 2:
+        raise ValueError("Cross-validation needs at least two classes in the dataset.")
+    splitter = (StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed) if repeats == 1 else
+                RepeatedStratifiedKFold(n_splits=folds, n_repeats=repeats, random_state=seed))
+    tasks = [(i // folds, i % folds, train_rows, test_rows)
+             for i, (train_rows, test_rows) in enumerate(splitter.split(np.zeros(len(y_values)), y_values))]
+
+    cores = threads or available_cores()
+    max_workers = max(1, min(max_workers or int(os.environ.get("CV_MAX_WORKERS", cores)), len(tasks)))
+    # Split the cores between the folds instead of letting each fit grab all of them
+    n_jobs = max(1, cores // max_workers)
+
+    oof = np.zeros((len(y_values), len(classes)))
+    per_fold = []
+
+    def record(scores, test_rows, proba):
+        oof[test_rows] += proba / repeats
+        per_fold.append(scores)
+        if progress:
+            validation = {k: scores[k] for k in ("accuracy", "logloss", "auc_score")}
+            return progress(len(per_fold), {"validation": validation}, fold=scores)
+        return False
+
+    start = time.perf_counter()
+    if max_workers == 1:
+        _init_worker(X, y_values, model_choice, hyperparams, n_jobs, seed)
+        try:
+            for task in tasks:
+                if record(*fit_fold(*task)):
+                    raise TrainingCancelled()
+        finally:
+            _DATA.clear()
+    else:
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker, initargs=(X, y_values, model_choice, hyperparams, n_jobs, seed)
+        )
+        try:
+            futures = [executor.submit(fit_fold, *task) for task in tasks]
+            for future in as_completed(futures):
+                if record(*future.result()):
+                    for pending in futures:
+                        pending.cancel()
+                    raise TrainingCancelled()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+    wall_seconds = time.perf_counter() - start
+
+    per_fold.sort(key=lambda scores: (scores["repeat"], scores["fold"]))
+    oof_pred = classes[oof.argmax(axis=1)]
+    return {
+        "mode": "cv",
+        "model": model_choice,
+        "folds": folds,
+        "repeats": repeats,
+        "per_fold": per_fold,
+        "aggregate": {
+            "accuracy": _summary([s["accuracy"] for s in per_fold]),
+            "logloss": _summary([s["logloss"] for s in per_fold]),
+            "auc_score": _summary([s["auc_score"] for s in per_fold]),
+            "oof_accuracy": float(accuracy_score(y_values, oof_pred)),
+            "confusion_matrix": np.sum([s["confusion_matrix"] for s in per_fold], axis=0).tolist(),
+        },
+        "class_labels": [CLASS_LABELS[c] if 0 <= c < len(CLASS_LABELS) else str(c) for c in classes.tolist()],
+        "classes": classes.tolist(),
+        "oof_probabilities": oof.tolist(),
+        "oof_predictions": oof_pred.tolist(),
+        "training": {
+            "mode": "cv", "rows": len(y_values), "workers": max_workers, "threads_per_fold": n_jobs,
+            "fit_seconds": sum(s["fit_seconds"] for s in per_fold), "wall_seconds": wall_seconds,
+        },
+    }
@@ -31,6 +31,17 @@ const clearSinglePredictBtn = document.getElementById("clearSinglePredictBtn");
 const singlePredictionHeader = document.getElementById("single-prediction-header");
 const singlePredictionValidationError = document.getElementById("single-prediction-validation-error");
 const singlePredictionBody = document.getElementById("single-prediction-body");
+// --- Backend session ---
+// Each tab gets its own session id so the backend keeps our dataset separate from other users'.
+let SESSION_ID = sessionStorage.getItem("orbitalSessionId");
+if (!SESSION_ID) {
+  SESSION_ID = crypto.randomUUID();
+  sessionStorage.setItem("orbitalSessionId", SESSION_ID);
+}
+
+function withSession(options = {}) {
+  return { ...options, headers: { ...(options.headers || {}), "X-Session-ID": SESSION_ID } };
+}
 // --- Collapsible Preprocessing Section ---
 if (preprocessingHeader) {
     preprocessingHeader.addEventListener("click", () => {
@@ -128,9 +139,9 @@ async function resetWorkbench() {
 
   // 2. Notify backend to clear its state
   try {
-    await fetch("https://project-oracle.onrender.com/reset", {
+    await fetch("https://project-oracle.onrender.com/reset", withSession({
       method: "POST"
-    });
+    }));
     console.log("✅ Backend state cleared.");
   } catch (err) {
     console.error("⚠️ Could not reset backend state:", err);
@@ -174,16 +185,8 @@ async function runSample(datasetName) {
   processingOverlayText.textContent = `Running ${datasetName} sample...`;
   
   try {
-    // 3. Fetch the sample dataset file from the backend
-    const response = await fetch(`https://project-oracle.onrender.com/download_sample/${datasetName}`);
-    if (!response.ok) {
-      throw new Error(`Failed to fetch sample data. Status: ${response.status}`);
-    }
-    const blob = await response.blob();
-    const file = new File([blob], `${datasetName}_data.csv`, { type: 'text/csv' });
-
-    // 4. Use the existing uploadAndProcess function to handle the file.
-    await uploadAndProcess(file, true); // Pass true to indicate a sample run
+    // 3. Load the already processed sample straight into the session (no download + re-upload)
+    await uploadAndProcess(null, true, datasetName); // Pass true to indicate a sample run
 
     // 5. Once preprocessing is done, automatically run prediction
     // A small delay can make the transition feel smoother to the user
@@ -214,8 +217,8 @@ if (downloadSampleLink && sampleDatasetSelect) {
   });
 }
 
-async function uploadAndProcess(file, isSampleRun = false) {
-  if (!file) return;
+async function uploadAndProcess(file, isSampleRun = false, sampleName = null) {
+  if (!file && !sampleName) return;
 
   preprocessingResultsDiv.innerHTML = ""; // Clear old preprocessing results
   trainingResultsDiv.innerHTML = ""; // Clear old training results
@@ -223,13 +226,15 @@ async function uploadAndProcess(file, isSampleRun = false) {
   downloadModelBtn.style.display = "none"; // Hide model download button on new upload
 
   let formData = new FormData();
-  formData.append("file", file);
+  if (file) formData.append("file", file);
 
   try {
-    const response = await fetch("https://project-oracle.onrender.com/upload", {
-      method: "POST",
-      body: formData
-    });
+    const response = sampleName
+      ? await fetch(`https://project-oracle.onrender.com/load_sample/${sampleName}`, withSession({ method: "POST" }))
+      : await fetch("https://project-oracle.onrender.com/upload", withSession({
+          method: "POST",
+          body: formData
+        }));
 
     const result = await response.json();
     console.log("✅ Backend response:", result);
@@ -335,6 +340,35 @@ document.getElementById("uploadBtn").addEventListener("click", async () => {
 });
 
 
+// Submit a training job and poll it until it finishes, showing per-iteration progress
+async function runTrainingJob(model, hyperparams) {
+  const submitResponse = await fetch("https://project-oracle.onrender.com/train_jobs", withSession({
+    method:"POST",
+    headers: {"Content-Type":"application/json"},
+    // Metrics only: the plots are fetched as images from their plot_urls
+    body: JSON.stringify({model, hyperparams, plots: false})
+  }));
+  const submitted = await submitResponse.json();
+  if (submitted.error) return submitted;
+
+  let since = 0;
+  while (true) {
+    await new Promise(resolve => setTimeout(resolve, 1000));
+    const statusResponse = await fetch(`https://project-oracle.onrender.com/train_jobs/${submitted.job_id}?since=${since}`, withSession());
+    const status = await statusResponse.json();
+    if (status.error) return status;
+
+    since += status.progress.length;
+    if (since > 0) {
+      processingOverlayText.textContent = `Training model... (iteration ${since})`;
+    }
+
+    if (status.state === "completed") return status.result;
+    if (status.state === "failed") return { error: status.error };
+    if (status.state === "cancelled") return { error: "Training was cancelled." };
+  }
+}
+
 // Train model
 trainBtn.addEventListener("click", async () => {
   const model = document.getElementById("modelSelect").value;
@@ -350,16 +384,11 @@ trainBtn.addEventListener("click", async () => {
   const max_depth = parseInt(document.getElementById("maxDepth").value) || 3;
   const learning_rate = parseFloat(document.getElementById("learningRate").value) || 0.1;
 
-  const hyperparams = { n_estimators, max_depth, learning_rate };
+  // These inputs are only shown for XGBoost; LightGBM keeps its own defaults
+  const hyperparams = model === "xgb" ? { n_estimators, max_depth, learning_rate } : {};
 
   try {
-    const response = await fetch("https://project-oracle.onrender.com/train", {
-      method:"POST",
-      headers: {"Content-Type":"application/json"},
-      body: JSON.stringify({model, hyperparams})
-    });
-
-    const result = await response.json();
+    const result = await runTrainingJob(model, hyperparams);
     if(result.error){
       preprocessingResultsDiv.innerHTML = `<div class="step">❌ Error: ${result.error}</div>`;
       trainingResultsDiv.innerHTML = `<div class="step">❌ Training Error: ${result.error}</div>`;
@@ -383,7 +412,8 @@ trainBtn.addEventListener("click", async () => {
     // 🔹 Plots
     trainingHTML += `<div class="plots-grid">`;
 
-    const cm_src = `data:image/png;base64,${result.confusion_matrix_plot}`;
+    const plotUrls = result.plot_urls || {};
+    const cm_src = `https://project-oracle.onrender.com${plotUrls.confusion_matrix}`;
     trainingHTML += `<div class="plot-card">
                         <div class="plot-header">
                             <h4>Confusion Matrix <span class="info-icon" data-tooltip="A table showing the model's performance. The diagonal shows correct predictions, while off-diagonal values show where the model made mistakes."><i class="fas fa-info-circle"></i></span></h4>
@@ -392,8 +422,8 @@ trainBtn.addEventListener("click", async () => {
                         <img src="${cm_src}" alt="Confusion Matrix">
                      </div>`;
 
-    if(result.roc_plot){
-      const roc_src = `data:image/png;base64,${result.roc_plot}`;
+    if(plotUrls.roc){
+      const roc_src = `https://project-oracle.onrender.com${plotUrls.roc}`;
       trainingHTML += `<div class="plot-card">
                             <div class="plot-header">
                                 <h4>ROC Curve</h4>
@@ -403,8 +433,8 @@ trainBtn.addEventListener("click", async () => {
                          </div>`;
     }
 
-    if(result.accuracy_plot && result.accuracy_plot !== "null"){
-      const acc_src = `data:image/png;base64,${result.accuracy_plot}`;
+    if(plotUrls.history){
+      const acc_src = `https://project-oracle.onrender.com${plotUrls.history}`;
       trainingHTML += `<div class="plot-card">
                             <div class="plot-header">
                                 <h4>Training History</h4>
@@ -429,6 +459,28 @@ trainBtn.addEventListener("click", async () => {
   }
 });
 
+// Columns the simulator link needs for each discovered planet
+const PLANET_LINK_COLUMNS = ["pl_rade", "pl_eqt", "pl_insol", "st_teff", "st_rad", "pl_orbper", "kepoi_name", "pl_name"];
+
+// Page through /results for the confirmed planets only, fetching just the columns we render
+async function fetchConfirmedPlanets(cursor) {
+  const planets = [];
+  let next = cursor;
+  while (next) {
+    const response = await fetch(`https://project-oracle.onrender.com/results?cursor=${encodeURIComponent(next)}&prediction=2&columns=${PLANET_LINK_COLUMNS.join(",")}&format=columnar&limit=5000`, withSession());
+    const page = await response.json();
+    if (page.error) throw new Error(page.error);
+
+    page.data.row.forEach((row, i) => {
+      const data = {};
+      page.columns.forEach(col => { data[col] = page.data[col][i]; });
+      planets.push({ index: row + 1, data });
+    });
+    next = page.next_cursor;
+  }
+  return planets;
+}
+
 // Predict with pre-trained model
 predictBtn.addEventListener("click", async () => {
   trainingResultsDiv.innerHTML = ""; // Clear previous results
@@ -440,10 +492,11 @@ predictBtn.addEventListener("click", async () => {
   resultsContainer.style.display = "block";
 
   try {
-    const response = await fetch("https://project-oracle.onrender.com/predict", {
+    const response = await fetch("https://project-oracle.onrender.com/predict", withSession({
       method: "POST",
       headers: { "Content-Type": "application/json" },
-    });
+      body: JSON.stringify({ include_rows: false })
+    }));
 
     if (!response.ok) {
       const errorResult = await response.json();
@@ -465,15 +518,11 @@ predictBtn.addEventListener("click", async () => {
     let predictionHTML = `<div class="step">✅ Prediction complete! Found ${result.count} potential objects.</div>`;
 
     const counts = { 0: 0, 1: 0, 2: 0 };
-    const confirmedPlanets = []; // This will now hold data objects
-    result.predictions.forEach((pred, index) => {
+    result.predictions.forEach(pred => {
         counts[pred] = (counts[pred] || 0) + 1;
-        if (pred === 2) {
-            // Get the raw data for this planet from the initial upload result
-            const planetData = result.raw_data_for_prediction[index];
-            confirmedPlanets.push({ index: index + 1, data: planetData });
-        }
     });
+    // Only the confirmed planets' rows are fetched from the server
+    const confirmedPlanets = counts[2] > 0 ? await fetchConfirmedPlanets(result.results_cursor) : [];
 
     predictionHTML += `<div class="metrics-grid">
                         <div class="metric-card">
@@ -565,6 +614,37 @@ predictBtn.addEventListener("click", async () => {
   }
 });
 
+// Hashes of model files the server has already stored, so the same file isn't sent twice
+const uploadedModelHashes = new Map();
+
+async function postUploadedModel(modelFile) {
+  const fileKey = `${modelFile.name}:${modelFile.size}:${modelFile.lastModified}`;
+  const knownHash = uploadedModelHashes.get(fileKey);
+
+  const formData = new FormData();
+  if (knownHash) {
+    formData.append("model_hash", knownHash);
+  } else {
+    formData.append("model_file", modelFile);
+  }
+  formData.append("include_rows", "false");
+
+  const response = await fetch("https://project-oracle.onrender.com/predict_with_uploaded_model", withSession({
+    method: "POST",
+    body: formData,
+  }));
+  if (knownHash && response.status === 404) {
+    // The server dropped it from its cache; send the file again
+    uploadedModelHashes.delete(fileKey);
+    return postUploadedModel(modelFile);
+  }
+  if (response.ok) {
+    const result = await response.clone().json();
+    if (result.model_hash) uploadedModelHashes.set(fileKey, result.model_hash);
+  }
+  return response;
+}
+
 // Predict with UPLOADED model
 predictWithCustomBtn.addEventListener("click", async () => {
   const modelFile = modelFileInput.files[0];
@@ -580,14 +660,8 @@ predictWithCustomBtn.addEventListener("click", async () => {
   processingOverlayText.textContent = "Running prediction with custom model...";
   resultsContainer.style.display = "block";
 
-  const formData = new FormData();
-  formData.append("model_file", modelFile);
-
   try {
-    const response = await fetch("https://project-oracle.onrender.com/predict_with_uploaded_model", {
-      method: "POST",
-      body: formData,
-    });
+    const response = await postUploadedModel(modelFile);
 
     if (!response.ok) {
       let errorMessage = `HTTP error! status: ${response.status} ${response.statusText}`;
@@ -614,14 +688,10 @@ predictWithCustomBtn.addEventListener("click", async () => {
 
     let predictionHTML = `<div class="step">✅ Prediction with custom model complete! Found ${result.count} potential objects.</div>`;
     const counts = { 0: 0, 1: 0, 2: 0 };
-    const confirmedPlanets = [];
-    result.predictions.forEach((pred, index) => {
+    result.predictions.forEach(pred => {
         counts[pred] = (counts[pred] || 0) + 1;
-        if (pred === 2) {
-            const planetData = result.raw_data_for_prediction[index];
-            confirmedPlanets.push({ index: index + 1, data: planetData });
-        }
     });
+    const confirmedPlanets = counts[2] > 0 ? await fetchConfirmedPlanets(result.results_cursor) : [];
 
     predictionHTML += `<div class="metrics-grid">
                         <div class="metric-card"><h4>Confirmed Planets Found</h4><p>${counts[2]}</p></div>
@@ -699,9 +769,9 @@ predictWithCustomBtn.addEventListener("click", async () => {
 // Download predictions
 downloadPredictionsBtn.addEventListener("click", async () => {
   try {
-    const response = await fetch("https://project-oracle.onrender.com/download_predictions", {
+    const response = await fetch("https://project-oracle.onrender.com/download_predictions", withSession({
       method: "GET"
-    });
+    }));
 
     if (!response.ok) {
       let errorMessage = `Failed to download CSV. Status: ${response.status}`;
@@ -735,9 +805,9 @@ downloadPredictionsBtn.addEventListener("click", async () => {
 // Download trained model
 downloadModelBtn.addEventListener("click", async () => {
   try {
-    const response = await fetch("https://project-oracle.onrender.com/download_model", {
+    const response = await fetch("https://project-oracle.onrender.com/download_model", withSession({
       method: "GET"
-    });
+    }));
 
     if (!response.ok) {
       let errorMessage = `Failed to download model. Status: ${response.status}`;
@@ -0,0 +1,257 @@
+import os, json
+import numpy as np
+import pandas as pd
+
+# dtype of the feature block. float64 (default) keeps every digit of the source
+# catalog, so exports read back exactly as uploaded; float32 halves the memory
+# but rounds the values (and what the models are fitted on) to ~7 digits.
+FEATURE_DTYPE = np.dtype(os.environ.get("DATASET_FLOAT_DTYPE", "float64"))
+if FEATURE_DTYPE not in (np.float32, np.float64):
+    raise ValueError("DATASET_FLOAT_DTYPE must be float32 or float64")
+
+
+def decimal_float64(values):
+    """
+    float32 values as float64 holding the shortest decimal that reads back
+    as the same float32, i.e. what str(np.float32(x)) prints, so JSON and
+    exports show 9.488036 rather than 9.488035678863525.
+    """
+    values = np.asarray(values, dtype=np.float32)
+    result = values.astype(np.float64)
+    todo = np.flatnonzero(np.isfinite(values) & (values != 0))
+    if not len(todo):
+        return result
+
+    exponent = np.floor(np.log10(np.abs(result[todo])))
+    # float32 round-trips with at most 9 significant digits; try the fewest first
+    for digits in range(1, 10):
+        v = result[todo]
+        shift = digits - 1 - exponent
+        up = shift >= 0
+        scale = 10.0 ** np.abs(shift)  # exact powers of ten, so the division below rounds once
+        rounded = np.where(up, np.round(v * scale) / scale, np.round(v / scale) * scale)
+        ok = rounded.astype(np.float32) == values[todo]
+        result[todo[ok]] = rounded[ok]
+        todo, exponent = todo[~ok], exponent[~ok]
+        if not len(todo):
+            break
+    return result
+
+
+def output_frame(df):
+    """
+    `df` (a slice of a CompactDataset view) with the dtypes the uploaded frame
+    had, for JSON and exports: float32 columns as decimal_float64 values,
+    downcast integers as int64 and categoricals as plain values.
+    """
+    changes = {}
+    for i, dtype in enumerate(df.dtypes):
+        if dtype == np.float32:
+            changes[i] = decimal_float64(df.iloc[:, i].to_numpy())
+        elif dtype.kind in "iu" and dtype.itemsize < 8:
+            changes[i] = df.iloc[:, i].to_numpy().astype(np.int64)
+        elif isinstance(dtype, pd.CategoricalDtype):
+            changes[i] = df.iloc[:, i].astype(dtype.categories.dtype)
+    if not changes:
+        return df
+    df = df.copy(deep=False)
+    for i, values in changes.items():
+        df.isetitem(i, values)
+    return df
+
+
+def _occurrence_keys(ids):
+    """
+    (id, n) for every row that has an id, n counting the earlier rows with
+    the same id, plus those rows' positions. Rows without an id get no key.
+    """
+    ids = pd.Series(np.asarray(ids, dtype=object))
+    rows = np.flatnonzero(ids.notna().to_numpy())
+    ids = ids.iloc[rows]
+    return pd.MultiIndex.from_arrays([ids.to_numpy(), ids.groupby(ids).cumcount().to_numpy()]), rows
+
+
+def _compact_column(series):
+    """Smallest lossless representation of a non-feature column (target, id...)."""
+    if series.dtype.kind in "iu":
+        values = pd.to_numeric(series, downcast="integer").to_numpy()
+    elif series.dtype.kind in "fbmM":
+        values = series.to_numpy()
+    else:
+        # Identifiers: each distinct string stored once plus small integer codes
+        return pd.Categorical(series)
+    values.flags.writeable = False
+    return values
+
+
+class CompactDataset:
+    """
+    One processed upload, stored once. The float feature columns live in a
+    single column-major block of FEATURE_DTYPE; the target is downcast
+    (int8) and string identifiers are categorical. core() and unscaled()
+    are DataFrames over the same read-only arrays in the two column orders
+    the app uses, so neither view copies any data. `fill_values` are the
+    medians missing values were filled with, so rows appended later can be
+    filled the same way.
+    """
+
+    def __init__(self, columns, block, slots, others, core_order, index=None, fill_values=None):
+        self.columns = list(columns)      # names in unscaled order
+        self.block = block
+        self.slots = list(slots)          # per column: its column in `block`, or None
+        self.core_order = list(core_order)
+        self.index = index                # None for a default RangeIndex
+        self.fill_values = fill_values    # {column: median} or None
+        # One array per column; feature columns are views into the block
+        self.arrays = [block[:, slot] if slot is not None else others[i] for i, slot in enumerate(self.slots)]
+
+    @classmethod
+    def from_frame(cls, df, feature_columns, core_columns, dtype=FEATURE_DTYPE, fill_values=None):
+        """
+        Build from the unscaled frame. `feature_columns` (those with a float
+        dtype) go into the block, `core_columns` is the column order of core().
+        """
+        in_block = [i for i, (name, col_dtype) in enumerate(df.dtypes.items())
+                    if name in feature_columns and col_dtype.kind == "f"]
+        block = np.empty((len(df), len(in_block)), dtype=dtype, order="F")
+        for slot, i in enumerate(in_block):
+            block[:, slot] = df.iloc[:, i].to_numpy()
+        block.flags.writeable = False
+
+        slots = [None] * df.shape[1]
+        for slot, i in enumerate(in_block):
+            slots[i] = slot
+        others = {i: _compact_column(df.iloc[:, i]) for i, slot in enumerate(slots) if slot is None}
+
+        columns = list(df.columns)
+        core_order = [i for name in core_columns for i, col in enumerate(columns) if col == name]
+
+        index = None
+        if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+            index = pd.to_numeric(pd.Series(df.index), downcast="integer").to_numpy()
+        return cls(columns, block, slots, others, core_order, index, fill_values)
+
+    def __len__(self):
+        return self.block.shape[0]
+
+    def _view(self, positions):
+        # Integer keys so repeated column names survive; relabelled right after
+        frame = pd.DataFrame({k: self.arrays[i] for k, i in enumerate(positions)}, copy=False)
+        frame.columns = [self.columns[i] for i in positions]
+        if self.index is not None:
+            frame.index = self.index
+        return frame
+
+    def core(self):
+        """Canonical feature order, then target and id: what training, /predict and /save use."""
+        return self._view(self.core_order)
+
+    def unscaled(self):
+        """The upload's own column order: what /results and the prediction downloads show."""
+        return self._view(range(len(self.columns)))
+
+    def merge(self, other, id_column):
+        """
+        `other` (a newer export of the same catalog) merged into this dataset
+        by `id_column`. The k-th row of an id in `other` replaces the k-th row
+        with that id here, since ids can repeat (one K2 row per reference);
+        rows with new ids, extra repeats or no id are appended. Existing rows
+        keep their positions and rows missing from `other` are kept.
+
+        Returns (merged, updated, appended): the new dataset and the positions
+        of the replaced and of the appended rows in it.
+        """
+        if sorted(other.columns) != sorted(self.columns):
+            raise ValueError("The new rows don't have the same columns as the current dataset.")
+        old = output_frame(self.unscaled())
+        new = output_frame(other.unscaled())[self.columns]
+
+        old_keys, old_rows = _occurrence_keys(old[id_column])
+        new_keys, new_rows = _occurrence_keys(new[id_column])
+        found = old_keys.get_indexer(new_keys)
+        updated_new = new_rows[found >= 0]
+        updated = old_rows[found[found >= 0]]
+        appended_new = np.setdiff1d(np.arange(len(new)), updated_new)
+
+        # Only rows whose values actually differ count as updated
+        changed = np.zeros(len(updated), dtype=bool)
+        for i in range(len(self.columns)):
+            before, after = old.iloc[updated, i].to_numpy(), new.iloc[updated_new, i].to_numpy()
+            changed |= ~((before == after) | (pd.isna(before) & pd.isna(after)))
+
+        arrays = {}
+        for i in range(len(self.columns)):
+            values = np.concatenate([old.iloc[:, i].to_numpy(), new.iloc[appended_new, i].to_numpy()])
+            values[updated] = new.iloc[updated_new, i].to_numpy()
+            arrays[i] = values
+        frame = pd.DataFrame(arrays)
+        frame.columns = self.columns
+
+        features = [name for name, slot in zip(self.columns, self.slots) if slot is not None]
+        merged = CompactDataset.from_frame(frame, features, [self.columns[i] for i in self.core_order],
+                                           self.block.dtype, self.fill_values)
+        appended = np.arange(len(old), len(frame))
+        return merged, updated[changed], appended
+
+    @property
+    def nbytes(self):
+        total = self.block.nbytes + (self.index.nbytes if self.index is not None else 0)
+        for array, slot in zip(self.arrays, self.slots):
+            if isinstance(array, pd.Categorical):
+                total += array.codes.nbytes + array.categories.memory_usage(deep=True)
+            elif slot is None:
+                total += array.nbytes
+        return total
+
+    # -----------------------------------------------------------------------
+    # On disk: the block as one .npy file, every other column as its own .npy
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "block.npy"), self.block)
+        entries = []
+        for i, (name, array, slot) in enumerate(zip(self.columns, self.arrays, self.slots)):
+            if slot is not None:
+                entries.append({"name": name, "kind": "block", "slot": slot})
+            elif isinstance(array, pd.Categorical):
+                categories = array.categories
+                values = categories.to_numpy()
+                if categories.dtype.kind not in "biufcmM":
+                    values = values.astype("U")
+                np.save(os.path.join(path, f"c{i}.codes.npy"), array.codes)
+                np.save(os.path.join(path, f"c{i}.categories.npy"), values)
+                entries.append({"name": name, "kind": "categorical", "file": f"c{i}",
+                                "categories_dtype": str(categories.dtype)})
+            else:
+                np.save(os.path.join(path, f"c{i}.npy"), array)
+                entries.append({"name": name, "kind": "array", "file": f"c{i}.npy"})
+
+        if self.index is not None:
+            np.save(os.path.join(path, "index.npy"), self.index)
+        with open(os.path.join(path, "dataset.json"), "w") as f:
+            json.dump({"columns": entries, "core_order": self.core_order,
+                       "index": "index.npy" if self.index is not None else None,
+                       "fill_values": self.fill_values}, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "dataset.json")) as f:
+            meta = json.load(f)
+
+        block = np.load(os.path.join(path, "block.npy"))
+        block.flags.writeable = False
+        slots, others = [], {}
+        for i, entry in enumerate(meta["columns"]):
+            slots.append(entry.get("slot"))
+            if entry["kind"] == "categorical":
+                codes = np.load(os.path.join(path, entry["file"] + ".codes.npy"))
+                categories = pd.Index(np.load(os.path.join(path, entry["file"] + ".categories.npy")),
+                                      dtype=entry["categories_dtype"])
+                others[i] = pd.Categorical.from_codes(codes, categories=categories)
+            elif entry["kind"] == "array":
+                others[i] = np.load(os.path.join(path, entry["file"]))
+                others[i].flags.writeable = False
+
+        index = np.load(os.path.join(path, meta["index"])) if meta["index"] else None
+        return cls([entry["name"] for entry in meta["columns"]], block, slots, others, meta["core_order"], index,
+                   meta.get("fill_values"))
@@ -0,0 +1,113 @@
+import zlib
+
+from dataset import output_frame
+
+EXPORT_CHUNK_ROWS = 5000
+
+# format -> (mimetype, file extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "csv.gz": ("application/gzip", "csv.gz"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrow"),
+}
+
+
+def _import_pyarrow():
+    # Optional dependency: only the binary formats need it
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet/Arrow exports need pyarrow (pip install pyarrow).")
+    return pyarrow
+
+
+def frame_chunks(df, extra_columns=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Yield row slices of `df` with `extra_columns` (name -> function of the
+    row slice start/stop returning values) appended, so added columns only
+    ever exist for one chunk instead of a full copy of the frame. Columns
+    are written with the dtypes of the original upload (see output_frame).
+    """
+    extra_columns = extra_columns or {}
+    for start in range(0, max(len(df), 1), chunk_rows):
+        stop = min(start + chunk_rows, len(df))
+        chunk = output_frame(df.iloc[start:stop])
+        if extra_columns:
+            chunk = chunk.assign(**{name: make(start, stop) for name, make in extra_columns.items()})
+        yield chunk
+
+
+def csv_stream(chunks):
+    first = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=first).encode("utf-8")
+        first = False
+
+
+def gzip_stream(blocks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits=31 writes a gzip header
+    for block in blocks:
+        data = compressor.compress(block)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _Sink:
+    """Write-only file object that hands back whatever was written since the last drain()."""
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def arrow_stream(chunks, file_format="arrow"):
+    """Arrow IPC stream (one record batch per chunk) or Parquet (one row group per chunk)."""
+    pa = _import_pyarrow()
+    sink = _Sink()
+    writer = schema = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)
+            if writer is None:
+                schema = table.schema
+                writer = (pa.parquet.ParquetWriter(sink, schema) if file_format == "parquet"
+                          else pa.ipc.new_stream(sink, schema))
+            writer.write_table(table)
+            yield sink.drain()
+    finally:
+        if writer is not None:
+            writer.close()
+    yield sink.drain()
+
+
+def export_stream(chunks, file_format):
+    """Bytes of the chunks encoded as `file_format` (one of EXPORT_FORMATS)."""
+    if file_format == "csv":
+        return csv_stream(chunks)
+    if file_format == "csv.gz":
+        return gzip_stream(csv_stream(chunks))
+    _import_pyarrow()  # fail before the response starts rather than mid-stream
+    return arrow_stream(chunks, file_format)
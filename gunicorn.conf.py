@@ -0,0 +1,41 @@
+"""
+gunicorn settings (picked up automatically: `gunicorn app:app`).
+
+With ORBITAL_PRELOAD=1 (default) app.py is imported once in the master:
+the pretrained models, pandas/XGBoost and, unless
+ORBITAL_PRELOAD_TRAINING=0, the LightGBM/scikit-learn/matplotlib stack
+are loaded before forking, and every worker shares those pages
+copy-on-write instead of loading its own copy. With ORBITAL_PRELOAD=0
+each worker imports the app itself and the training stack is only loaded
+by the first /train (or search) request that needs it.
+"""
+import os, gc
+
+bind = os.environ.get("BIND", f"0.0.0.0:{os.environ.get('PORT', 8000)}")
+# Exported so the app (thread_budget.ThreadBudget.from_env) sees the same worker count
+os.environ.setdefault("WEB_CONCURRENCY", "2")
+workers = int(os.environ["WEB_CONCURRENCY"])
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+# Threaded workers: a sync worker serves one request at a time, so concurrent
+# /predict_single calls could never meet in the same process and be scored
+# as one micro-batch (micro_batch.py). Native calls split each process'
+# thread budget between its concurrent requests.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+
+preload_app = os.environ.get("ORBITAL_PRELOAD", "1") == "1"
+
+
+def when_ready(server):
+    # Runs in the master after the app was preloaded and before any worker is forked
+    if not preload_app:
+        return
+    if os.environ.get("ORBITAL_PRELOAD_TRAINING", "1") == "1":
+        import training
+        training.preload()
+
+    # Objects that exist now are never collected in the workers, so the GC
+    # doesn't write to (and un-share) every page it would otherwise scan
+    gc.collect()
+    gc.freeze()
+    server.log.info("Preloaded app; %d objects frozen for copy-on-write sharing", gc.get_freeze_count())
@@ -0,0 +1,165 @@
+import io, math
+import numpy as np
+import pandas as pd
+
+from preprocessing import TARGET_KEYWORDS, FEATURE_KEYWORDS, TARGET_MAP, RENAME_MAP, find_header, projected_columns
+
+DEFAULT_CHUNK_ROWS = 20000
+
+
+class QuantileSketch:
+    """
+    Small mergeable quantile sketch (KLL-style compactors) for streaming medians.
+
+    Values are added in batches; once a level holds more than `k` items it
+    is sorted and every other item is promoted to the next level with twice
+    the weight. Memory stays around k * log2(n / k) floats and the rank
+    error of a quantile is roughly `error` * n. NaNs are ignored, like
+    Series.median().
+    """
+
+    def __init__(self, error=0.01, seed=0):
+        self.k = max(16, int(math.ceil(2.0 / error)))
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self.k:
+                items = np.sort(items)
+                # Keep one item behind when the count is odd so weights stay exact
+                leftover, items = (items[:1], items[1:]) if len(items) % 2 else (items[:0], items)
+                promoted = items[self._rng.integers(2)::2]
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                self.levels[level] = leftover
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def quantile(self, q):
+        if not self.count:
+            return np.nan
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2 ** level) for level, items in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        cumulative = np.cumsum(weights[order])
+        return float(values[order][np.searchsorted(cumulative, q * cumulative[-1])])
+
+    def median(self):
+        return self.quantile(0.5)
+
+
+def _dedupe(fields):
+    # Same names pandas gives duplicated headers: x, x.1, x.2, ...
+    seen = {}
+    names = []
+    for name in fields:
+        if name in seen:
+            seen[name] += 1
+            names.append(f"{name}.{seen[name]}")
+        else:
+            seen[name] = 0
+            names.append(name)
+    return names
+
+
+def stream_projected_csv(binary_stream, chunk_rows=DEFAULT_CHUNK_ROWS, median_error=None, max_skip=300):
+    """
+    Parse an upload chunk by chunk, keeping only the columns /upload uses.
+
+    Returns (df, header_line, source_columns, medians), with header_line
+    None when no target column header was found. Rows without a
+    usable target are dropped per chunk. With `median_error` set, fill
+    medians come from a QuantileSketch per feature column (keyed by the
+    renamed column names); otherwise `medians` is None and the exact median
+    is computed later.
+    """
+    text = io.TextIOWrapper(binary_stream, encoding="utf-8", errors="ignore", newline="")
+    try:
+        header_line, fields = find_header(text, TARGET_KEYWORDS, max_skip)
+        if header_line is None:
+            return None, None, None, None
+
+        source_columns = _dedupe(fields)
+        keep, target_col, id_col = projected_columns(source_columns)
+        feature_cols = [col for col in keep if col not in (target_col, id_col)]
+        sketches = {col: QuantileSketch(median_error) for col in feature_cols} if median_error else None
+
+        chunks = []
+        reader = pd.read_csv(text, header=None, names=source_columns, usecols=keep, chunksize=chunk_rows)
+        for chunk in reader:
+            chunk = chunk[keep]
+            chunk = chunk[chunk[target_col].map(TARGET_MAP).notna()]
+            if sketches:
+                for col, sketch in sketches.items():
+                    if pd.api.types.is_numeric_dtype(chunk[col]):
+                        sketch.update(chunk[col].to_numpy())
+            chunks.append(chunk)
+    finally:
+        # Don't let the wrapper close the request's stream
+        text.detach()
+
+    df = pd.concat(chunks) if chunks else pd.DataFrame(columns=keep)
+
+    medians = None
+    if sketches:
+        medians = {RENAME_MAP.get(col, col): sketch.median() for col, sketch in sketches.items() if sketch.count}
+
+    return df, header_line, source_columns, medians
+
+
+def catalog_chunks(binary_stream, chunk_rows=DEFAULT_CHUNK_ROWS, usecols=None, max_skip=300):
+    """
+    Read a raw archive export lazily, e.g. to score it without uploading it.
+
+    Returns (source_columns, chunks), where `chunks` yields DataFrames of
+    `chunk_rows` rows as it is iterated, every column (or `usecols`) as
+    parsed and no rows dropped. The header is the first line naming a target
+    or a known feature, so catalogs without dispositions work too.
+    Returns (None, None) when there is no such line.
+    """
+    text = io.TextIOWrapper(binary_stream, encoding="utf-8", errors="ignore", newline="")
+    header_line, fields = find_header(text, TARGET_KEYWORDS + FEATURE_KEYWORDS, max_skip)
+    if header_line is None:
+        text.detach()
+        return None, None
+    source_columns = _dedupe(fields)
+
+    def chunks():
+        try:
+            yield from pd.read_csv(text, header=None, names=source_columns, usecols=usecols, chunksize=chunk_rows)
+        finally:
+            # Don't let the wrapper close the caller's stream
+            text.detach()
+
+    return source_columns, chunks()
+
+
+def catalog_medians(binary_stream, median_error=0.01, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    One pass over a raw export for its fill values: a QuantileSketch median
+    per feature column over every row, keyed by the renamed column names
+    like stream_projected_csv's. None when the header can't be found.
+    """
+    source_columns, chunks = catalog_chunks(binary_stream, chunk_rows, usecols=lambda col: col in FEATURE_KEYWORDS)
+    if source_columns is None:
+        return None
+
+    sketches = {}
+    for chunk in chunks:
+        for col in chunk.columns:
+            sketch = sketches.setdefault(col, QuantileSketch(median_error))
+            sketch.update(pd.to_numeric(chunk[col], errors="coerce").to_numpy())
+    return {RENAME_MAP.get(col, col): sketch.median() for col, sketch in sketches.items() if sketch.count}
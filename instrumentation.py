@@ -0,0 +1,192 @@
+import time, bisect, threading
+from contextlib import contextmanager
+from flask import g, request, has_request_context
+from flask.json.provider import DefaultJSONProvider
+
+# Histogram bucket upper bounds in seconds (Prometheus defaults plus a few for long fits)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.total = 0.0
+        self.count = 0
+
+
+class Metrics:
+    """
+    Per-process counters and latency histograms, rendered in the Prometheus
+    text format. Recording is a bisect and a few additions under a lock, so
+    it stays on in production.
+
+    Each worker process keeps its own numbers; with several gunicorn
+    workers, scrape them individually or aggregate in Prometheus.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._histograms = {}  # name -> {label tuple: _Histogram}
+        self._counters = {}    # name -> {label tuple: value}
+        self._help = {}
+        self._collectors = []
+
+    def describe(self, name, text):
+        self._help[name] = text
+
+    def observe(self, name, seconds, **labels):
+        key = tuple(sorted(labels.items()))
+        slot = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram(len(self.buckets) + 1)
+            histogram.counts[slot] += 1
+            histogram.total += seconds
+            histogram.count += 1
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def add_collector(self, collect):
+        """
+        `collect()` is called on every scrape and returns (name, type, value)
+        or (name, type, value, labels) tuples, for numbers other objects
+        already keep (cache hit counters, queue sizes...).
+        """
+        self._collectors.append(collect)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a named stage of the current request. The duration goes into the
+        orbital_stage_seconds histogram and the response's Server-Timing header.
+        Outside a request (job workers, scripts) only the histogram is updated.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            if has_request_context():
+                route = request.url_rule.rule if request.url_rule else "unmatched"
+                timings = g.setdefault("stage_timings", {})
+                timings[name] = timings.get(name, 0.0) + elapsed
+            else:
+                route = "background"
+            self.observe("orbital_stage_seconds", elapsed, route=route, stage=name)
+
+    def render(self):
+        """Everything recorded so far in the Prometheus text exposition format."""
+        lines = []
+
+        def header(name, kind):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            histograms = {name: {key: (list(h.counts), h.total, h.count) for key, h in series.items()}
+                          for name, series in self._histograms.items()}
+            counters = {name: dict(series) for name, series in self._counters.items()}
+
+        for name, series in sorted(histograms.items()):
+            header(name, "histogram")
+            for key, (counts, total, count) in sorted(series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_labels(key, [('le', _number(bound))])} {cumulative}")
+                lines.append(f"{name}_sum{_labels(key)} {_number(total)}")
+                lines.append(f"{name}_count{_labels(key)} {count}")
+
+        for name, series in sorted(counters.items()):
+            header(name, "counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{_labels(key)} {_number(value)}")
+
+        collected = {}
+        for collect in self._collectors:
+            for sample in collect():
+                name, kind, value = sample[:3]
+                labels = tuple(sorted((sample[3] if len(sample) > 3 else {}).items()))
+                collected.setdefault((name, kind), []).append((labels, value))
+        for (name, kind), samples in collected.items():
+            header(name, kind)
+            for key, value in samples:
+                lines.append(f"{name}{_labels(key)} {_number(value)}")
+
+        return "\n".join(lines) + "\n"
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider with every jsonify() timed as the json_encode stage."""
+
+    def response(self, *args, **kwargs):
+        with metrics.stage("json_encode"):
+            return super().response(*args, **kwargs)
+
+
+def init_app(app):
+    """Time every request, add Server-Timing headers and serve GET /metrics."""
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def _start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        start = g.get("request_start")
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe("orbital_request_seconds", elapsed, route=route, method=request.method)
+        metrics.inc("orbital_requests_total", route=route, method=request.method, status=response.status_code)
+
+        # Streamed responses only count the time until their first byte
+        timings = g.get("stage_timings", {})
+        entries = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in timings.items()]
+        entries.append(f"total;dur={elapsed * 1000:.2f}")
+        response.headers["Server-Timing"] = ", ".join(entries)
+        return response
+
+    @app.route("/metrics", methods=["GET"])
+    def prometheus_metrics():
+        return app.response_class(metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
+# One registry per process, shared by the app and the modules it calls into
+metrics = Metrics()
+stage = metrics.stage
+
+metrics.describe("orbital_request_seconds", "Request latency by route, until the response headers are ready.")
+metrics.describe("orbital_requests_total", "Requests by route, method and status code.")
+metrics.describe("orbital_stage_seconds", "Time spent in named stages (parsing, fitting, plotting...) by route.")
@@ -0,0 +1,77 @@
+import time, threading
+
+
+class _Batch:
+    def __init__(self):
+        self.rows = []
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-row predictions into one vectorized call.
+
+    The first request to arrive for a key becomes the batch leader: if other
+    requests are in flight it waits up to `max_wait` seconds for them to
+    join, then scores every collected row with `score_batch(key, rows)` and
+    hands each caller its own result. A lone request is scored straight
+    away, so there is no added latency when the server is idle. No
+    background thread is used, which keeps this safe to create before a
+    gunicorn fork.
+    """
+
+    def __init__(self, score_batch, max_batch_size=256, max_wait=0.002):
+        self.score_batch = score_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._open = {}  # key -> batch still accepting rows
+        self._inflight = 0
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+
+    def submit(self, key, row):
+        with self._lock:
+            self._inflight += 1
+            batch = self._open.get(key)
+            leader = batch is None or len(batch.rows) >= self.max_batch_size
+            if leader:
+                batch = _Batch()
+                self._open[key] = batch
+            index = len(batch.rows)
+            batch.rows.append(row)
+            others_waiting = self._inflight > 1
+
+        try:
+            if leader:
+                if others_waiting:
+                    time.sleep(self.max_wait)  # let concurrent requests join this batch
+                with self._lock:
+                    if self._open.get(key) is batch:
+                        del self._open[key]
+                    self.batches += 1
+                    self.rows += len(batch.rows)
+                try:
+                    batch.results = self.score_batch(key, batch.rows)
+                except Exception as e:
+                    batch.error = e
+                batch.done.set()
+            else:
+                batch.done.wait()
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[index]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "rows": self.rows,
+                "mean_batch_size": self.rows / self.batches if self.batches else 0.0,
+            }
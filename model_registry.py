@@ -0,0 +1,288 @@
+import os
+import re
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+
+from tree_scorer import compile_model
+
+
+def model_feature_names(model):
+    # Get the feature names the model was trained on
+    if hasattr(model, 'get_booster'): # XGBoost
+        return model.get_booster().feature_names
+    elif hasattr(model, 'feature_name_'): # LightGBM
+        return model.feature_name_
+    elif hasattr(model, 'feature_names_in_'): # scikit-learn estimators fitted on a DataFrame
+        return model.feature_names_in_
+    raise TypeError(f"Could not determine feature names from model of type {type(model).__name__}")
+
+
+def predict_scores(model, X):
+    """
+    (predicted classes, class probabilities, classes) of `X` in one scoring
+    pass. Probabilities and classes are None for models without predict_proba.
+    """
+    if hasattr(model, 'get_booster') or hasattr(model, 'booster_'):
+        # For XGBoost/LightGBM predict() is the argmax of predict_proba(), so score once
+        proba = model.predict_proba(X)
+        classes = np.asarray(model.classes_)
+        return classes[proba.argmax(axis=1)], proba, classes
+    preds = np.asarray(model.predict(X))
+    if not hasattr(model, 'predict_proba'):
+        return preds, None, None
+    return preds, model.predict_proba(X), np.asarray(model.classes_)
+
+
+class LoadedModel:
+    """
+    A model that has been unpickled once, plus what we learned about it.
+    `feature_names` is None for models that don't record them.
+    `scorer` is the model compiled by tree_scorer (None if it can't be).
+    Hold `lock` while changing the model's thread count and predicting with
+    it, so concurrent requests don't reconfigure it mid-prediction.
+    """
+
+    def __init__(self, path, fingerprint, model):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.model = model
+        self.lock = threading.Lock()
+        try:
+            self.feature_names = list(model_feature_names(model))
+        except TypeError:
+            self.feature_names = None
+        self._alignments = {}  # dataset columns -> (positions, missing)
+        try:
+            self.scorer = compile_model(model)
+        except (TypeError, NotImplementedError) as e:
+            print(f"⚠️ Using native predict for {os.path.basename(path)}: {e}")
+            self.scorer = None
+
+    def alignment(self, columns):
+        """
+        Where this model's features are among a dataset's `columns`:
+        (positions in the model's feature order, features the dataset lacks).
+        Worked out once per column list, then reused by every request.
+        """
+        key = tuple(columns)
+        found = self._alignments.get(key)
+        if found is None:
+            index = {}
+            for i, name in enumerate(key):
+                index.setdefault(name, i)
+            found = ([index[name] for name in self.feature_names if name in index],
+                     [name for name in self.feature_names if name not in index])
+            self._alignments[key] = found
+        return found
+
+
+class ModelRegistry:
+    """
+    Keeps pretrained models resident in memory so requests don't have to
+    joblib.load them from disk every time.
+
+    Models are keyed by their absolute path and validated against the file's
+    (mtime, size) on every lookup, so replacing a .pkl on disk triggers a
+    reload. At most `max_models` models are kept; the least recently used
+    one is evicted first.
+
+    Unpickling and compiling happen outside the registry lock, under a lock
+    of their own per path, so a slow cold load only holds up requests for
+    that same model.
+    """
+
+    def __init__(self, max_models=4):
+        self.max_models = max_models
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}  # path -> lock held while that path is being loaded
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _fingerprint(path):
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+
+    def get(self, path):
+        """Return the LoadedModel for `path`, loading or reloading it if needed."""
+        path = os.path.abspath(path)
+        # Raises FileNotFoundError for missing models, same as joblib.load did
+        fingerprint = self._fingerprint(path)
+
+        entry = self._cached(path, fingerprint)
+        if entry is not None:
+            return entry
+
+        with self._lock:
+            loading = self._loading.setdefault(path, threading.Lock())
+        with loading:
+            # Another request may have loaded it while we waited
+            entry = self._cached(path, fingerprint)
+            if entry is not None:
+                return entry
+            try:
+                entry = LoadedModel(path, fingerprint, joblib.load(path))
+            finally:
+                with self._lock:
+                    self._loading.pop(path, None)
+                    if entry is not None:
+                        self._insert(path, entry)
+            return entry
+
+    def _cached(self, path, fingerprint):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry.fingerprint == fingerprint:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry
+            return None
+
+    def _insert(self, path, entry):
+        # Called with self._lock held
+        if path in self._entries:
+            self.reloads += 1
+            print(f"🔄 Model file changed on disk, reloaded {path}")
+        else:
+            self.misses += 1
+        self._entries[path] = entry
+        self._entries.move_to_end(path)
+
+        while len(self._entries) > self.max_models:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_model(self, path):
+        return self.get(path).model
+
+    def get_features(self, path):
+        return self.get(path).feature_names
+
+    def warm_up(self, paths):
+        """Load every model in `paths` ahead of the first request. Missing files are skipped."""
+        for path in paths:
+            try:
+                self.get(path)
+                print(f"✅ Preloaded model {os.path.basename(path)}")
+            except FileNotFoundError:
+                print(f"⚠️ Pretrained model not found, skipping warm-up: {path}")
+
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(path), None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loaded": [os.path.basename(p) for p in self._entries],
+                "max_models": self.max_models,
+                "hits": self.hits,
+                "misses": self.misses,
+                "reloads": self.reloads,
+                "evictions": self.evictions,
+            }
+
+
+class UploadedModelStore:
+    """
+    Models uploaded to /predict_with_uploaded_model, stored once under the
+    SHA-256 of their bytes as `root/<hash>.pkl`. The files are shared by
+    all workers on the host, so a later request can name a model by its
+    hash instead of uploading it again; past `max_bytes` the least recently
+    used ones are deleted. Unpickled models (with their feature names and
+    column alignments) stay in a ModelRegistry of `max_models` entries.
+    """
+
+    HASH_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+
+    def __init__(self, root, max_bytes=256 * 1024 * 1024, max_models=4):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.registry = ModelRegistry(max_models=max_models)
+        self._lock = threading.Lock()
+        self.stored = 0
+        self.reused = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, digest):
+        return os.path.join(self.root, f"{digest}.pkl")
+
+    def put(self, stream, block_size=1024 * 1024):
+        """Store an uploaded model file (if it's new) and return its hash."""
+        sha = hashlib.sha256()
+        stream.seek(0)
+        for block in iter(lambda: stream.read(block_size), b""):
+            sha.update(block)
+        digest = sha.hexdigest()
+
+        path = self._path(digest)
+        if os.path.exists(path):
+            self.reused += 1
+            return digest
+
+        stream.seek(0)
+        tmp = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}")
+        with open(tmp, "wb") as f:
+            for block in iter(lambda: stream.read(block_size), b""):
+                f.write(block)
+        os.replace(tmp, path)
+        self.stored += 1
+        self._evict(keep=path)
+        return digest
+
+    def get(self, digest):
+        """The LoadedModel stored under `digest`, or None if there is no such model (any more)."""
+        if not digest or not self.HASH_PATTERN.match(digest):
+            return None
+        path = self._path(digest)
+        try:
+            st = os.stat(path)
+            # Mark as recently used through the access time; the mtime is the registry's fingerprint
+            os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+            return self.registry.get(path)
+        except FileNotFoundError:
+            return None
+
+    def _evict(self, keep=None):
+        with self._lock:
+            entries, total = [], 0
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if name.startswith(".tmp-"):
+                    # Leftovers from a crashed write
+                    if time.time() - st.st_mtime > 3600:
+                        os.remove(path)
+                    continue
+                entries.append((st.st_atime, st.st_size, path))
+                total += st.st_size
+
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self.registry.invalidate(path)
+                total -= size
+
+    def stats(self):
+        return dict(self.registry.stats(), stored=self.stored, reused=self.reused)
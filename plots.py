@@ -0,0 +1,224 @@
+import os, io, json, time, uuid, base64, hashlib, threading
+
+import numpy as np
+
+from instrumentation import stage
+
+# The plots /train can return: what each one needs from the evaluation
+PLOT_KINDS = ("confusion_matrix", "roc", "history")
+
+
+def pyplot():
+    """The plotting stack: matplotlib's Figure and Agg canvas, plus seaborn."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    import seaborn as sns
+    return Figure, FigureCanvasAgg, sns
+
+
+def _confusion_matrix(ax, sns, data):
+    sns.heatmap(np.array(data["matrix"]), annot=True, fmt="d", cmap="Blues",
+                xticklabels=data["labels"], yticklabels=data["labels"], ax=ax)
+    ax.set_xlabel("Predicted")
+    ax.set_ylabel("Actual")
+
+
+def _roc(ax, sns, data):
+    ax.plot(data["fpr"], data["tpr"], label=f"AUC={data['auc']:.3f}")
+    ax.plot([0, 1], [0, 1], "k--")
+    ax.set_xlabel("False Positive Rate")
+    ax.set_ylabel("True Positive Rate")
+    ax.set_title("ROC Curve")
+    ax.legend()
+
+
+def _history(ax, sns, data):
+    for dataset_name, metrics_dict in data["evals_result"].items():
+        for metric_name, values in metrics_dict.items():
+            ax.plot(values, label=f"{dataset_name}-{metric_name}")
+    ax.set_xlabel("Iteration")
+    ax.set_ylabel("Metric")
+    ax.set_title("Training History")
+    ax.legend()
+
+
+# kind -> (drawing function, figure size)
+_RENDERERS = {"confusion_matrix": (_confusion_matrix, (5, 4)), "roc": (_roc, (5, 4)), "history": (_history, (6, 4))}
+
+
+def render_png(kind, data):
+    """
+    PNG bytes of one plot from the plain data plot_data() extracted. Each
+    image gets a Figure of its own rather than pyplot's global current
+    figure, so threads of one worker can render at the same time.
+    """
+    Figure, FigureCanvasAgg, sns = pyplot()
+    draw, figsize = _RENDERERS[kind]
+    with stage(f"plot_{kind}"):
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        draw(fig.add_subplot(), sns, data)
+        fig.tight_layout()
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+
+def plot_data(evaluation):
+    """{kind: data} for every plot this evaluation has (no ROC for multiclass, no history without evals)."""
+    data = {"confusion_matrix": {"matrix": evaluation["confusion_matrix"], "labels": evaluation["class_labels"]}}
+    if evaluation["roc_curve"] is not None:
+        data["roc"] = dict(evaluation["roc_curve"], auc=evaluation["auc_score"])
+    if evaluation["evals_result"]:
+        data["history"] = {"evals_result": evaluation["evals_result"]}
+    return data
+
+
+class PlotCache:
+    """
+    Rendered /train plots on disk, keyed by a hash of the model choice and
+    the metric arrays the plot is drawn from, so retraining to the same
+    result or viewing a plot again never renders it twice.
+
+    register() only stores the (small) data as `root/<key>.json`; the PNG
+    is rendered on first request and kept next to it as `root/<key>.png`,
+    shared by all workers on the host. Past `max_bytes` the least recently
+    used entries are deleted.
+    """
+
+    def __init__(self, root, max_bytes=64 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.renders = 0
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def key(kind, model_choice, data):
+        payload = json.dumps({"kind": kind, "model": model_choice, "data": data}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+    def _path(self, key, suffix):
+        return os.path.join(self.root, key + suffix)
+
+    def _write(self, path, content):
+        tmp = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}")
+        with open(tmp, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)
+
+    def register(self, kind, model_choice, data):
+        """Store what a plot needs and return its key; nothing is rendered yet."""
+        key = self.key(kind, model_choice, data)
+        path = self._path(key, ".json")
+        if not os.path.exists(path):
+            self._write(path, json.dumps({"kind": kind, "data": data}).encode())
+            self._evict()
+        return key
+
+    def png_path(self, key):
+        """Path of the rendered PNG for `key`, rendering it now if needed; None for unknown keys."""
+        path = self._path(key, ".png")
+        try:
+            os.utime(path)  # mark as recently used
+            self.hits += 1
+            return path
+        except FileNotFoundError:
+            pass
+
+        try:
+            with open(self._path(key, ".json")) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # Two workers asking at once may both render; the rename keeps that harmless
+        self._write(path, render_png(entry["kind"], entry["data"]))
+        self.renders += 1
+        self._evict()
+        return path
+
+    def png_base64(self, kind, model_choice, data):
+        """Register and render in one go, for responses that embed the image."""
+        path = self._path(self.register(kind, model_choice, data), ".png")
+        try:
+            with open(path, "rb") as f:
+                png = f.read()
+        except FileNotFoundError:
+            png = None
+
+        if png is None:
+            # Rendered from `data` itself: another worker's eviction may remove the entry at any time
+            png = render_png(kind, data)
+            self._write(path, png)
+            self.renders += 1
+            self._evict()
+        else:
+            self.hits += 1
+            try:
+                os.utime(path)  # mark as recently used
+            except FileNotFoundError:
+                pass
+        return base64.b64encode(png).decode("utf8")
+
+    def _evict(self):
+        with self._lock:
+            entries, total = [], 0
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                try:
+                    mtime, size = os.path.getmtime(path), os.path.getsize(path)
+                except FileNotFoundError:
+                    continue
+                if name.startswith(".tmp-"):
+                    # Leftovers from a crashed write
+                    if time.time() - mtime > 3600:
+                        os.remove(path)
+                    continue
+                entries.append((mtime, size, path))
+                total += size
+
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self):
+        return {"hits": self.hits, "renders": self.renders, "max_bytes": self.max_bytes}
+
+
+def training_response(evaluation, model_choice, plots=True, plot_cache=None):
+    """
+    The /train payload for an evaluation (see training.evaluate_model).
+
+    With `plots` the three figures are embedded as base64 PNGs, as the page
+    has always shown them. Without, the response carries the raw arrays
+    (confusion matrix, ROC points, per-iteration evals) for client side
+    charting, plus `plot_urls` to fetch server rendered PNGs only if wanted.
+    """
+    data = plot_data(evaluation)
+
+    if not plots:
+        payload = {k: evaluation[k] for k in ("accuracy", "auc_score", "confusion_matrix", "class_labels",
+                                              "roc_curve", "evals_result")}
+        if plot_cache is not None:
+            payload["plot_urls"] = {kind: f"/plots/{plot_cache.register(kind, model_choice, values)}.png"
+                                    for kind, values in data.items()}
+        return payload
+
+    if plot_cache is not None:
+        images = {kind: plot_cache.png_base64(kind, model_choice, values) for kind, values in data.items()}
+    else:
+        images = {kind: base64.b64encode(render_png(kind, values)).decode("utf8") for kind, values in data.items()}
+    return {
+        "accuracy": evaluation["accuracy"],
+        "confusion_matrix_plot": images["confusion_matrix"],
+        "roc_plot": images.get("roc"),
+        "auc_score": evaluation["auc_score"],
+        "accuracy_plot": images.get("history")
+    }
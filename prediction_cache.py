@@ -0,0 +1,70 @@
+import threading
+from collections import OrderedDict
+
+
+class PredictionCache:
+    """
+    /predict results kept in memory so asking again for an unchanged upload
+    doesn't score and serialize it again.
+
+    Keys are tuples starting with the dataset's fingerprint (its upload
+    cache key): (dataset_key, model_key) holds the predictions and class
+    probabilities of that dataset under one model, where model_key is the
+    pretrained file's (mtime, size) or the uploaded model's SHA-256, and
+    (dataset_key, "records") the dataset's rows already encoded as JSON.
+    A new upload, a replaced model file or different model bytes make a new
+    key, so a stale result is never served; invalidate() also frees a
+    dataset's entries as soon as a session replaces or resets it.
+
+    At most `max_bytes` are kept; the least recently used entry goes first.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (value, nbytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, nbytes):
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, nbytes)
+            self._bytes += nbytes
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def invalidate(self, dataset_key=None):
+        """Drop every entry of one dataset, or everything."""
+        with self._lock:
+            for key in [key for key in self._entries if dataset_key is None or key[0] == dataset_key]:
+                self._bytes -= self._entries.pop(key)[1]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,204 @@
+import io, csv
+import numpy as np
+import pandas as pd
+from instrumentation import stage
+from dataset import CompactDataset
+
+# Bump when process_dataset changes its output, so cached uploads are reprocessed
+PIPELINE_VERSION = 3
+
+# Possible target column names
+TARGET_KEYWORDS = ["koi_disposition", "tfopwg_disp", "disposition"]
+
+# Possible identifier column names (TOI exports identify rows by "toi")
+ID_KEYWORDS = ["kepoi_name", "pl_name", "kepid", "tic_id", "toi"]
+
+# Define search keywords for important features
+FEATURE_KEYWORDS = list(dict.fromkeys([
+    # kepler features
+    'koi_prad', 'koi_period', 'koi_depth', 'koi_duration',
+    'koi_teq', 'koi_insol',
+    'koi_steff', 'koi_srad','ra', 'dec',
+
+    # k2/tess features
+    'pl_rade', 'pl_orbper', 'pl_trandep', 'pl_trandur', 'pl_trandurh',
+    'pl_eqt', 'pl_insol',
+    'st_teff', 'st_rad'
+]))
+
+# Encode target labels uniformly
+TARGET_MAP = {
+    # NOT A PLANET
+    'FALSE POSITIVE': 0, 'REFUTED': 0, 'FP': 0, 'FA': 0,
+    # CANDIDATE
+    'CANDIDATE': 1, 'PC': 1, 'CP': 1, 'APC': 1,
+    # PLANET
+    'CONFIRMED': 2, 'KP': 2
+}
+
+# Rename features for uniformity
+RENAME_MAP = {
+    'koi_prad':'pl_rade', 'koi_period':'pl_orbper', 'koi_depth':'pl_trandep', 'koi_duration':'pl_trandur',
+    'koi_teq':'pl_eqt', 'koi_insol':'pl_insol', 'koi_steff':'st_teff', 'koi_srad':'st_rad',
+    'koi_score':'score', 'koi_model_snr':'snr', 'pl_trandurh':'pl_trandur', 'st_tmag':'st_mag'
+}
+
+CANONICAL_ORDER = [
+    'pl_rade', 'pl_orbper', 'pl_trandep', 'pl_trandur', 'pl_eqt', 'pl_insol',
+    'st_teff', 'st_rad','ra', 'dec'
+]
+
+
+def extract_features_and_target(df, feature_keywords, target_keywords):
+    # Filter features to only those present in df
+    feature_cols = [col for col in feature_keywords if col in df.columns]
+
+    # Detect target column
+    target_col = next((col for col in target_keywords if col in df.columns), None)
+    if target_col is None:
+        raise ValueError("No valid target column found in this dataset.")
+
+    # Subset dataframe
+    df_core = df[feature_cols + [target_col]].copy()
+
+    return df_core, feature_cols, target_col
+
+
+def find_header(lines, target_keywords, max_skip=300):
+    """
+    Scan lines from an iterator/file once. Returns (skiprows, header_fields)
+    where the header contains a target column, or (None, None).
+    """
+    targets = {t.lower() for t in target_keywords}
+    blank_run_start = None
+
+    for line_no in range(max_skip):
+        line = lines.readline()
+        if not line:
+            break
+
+        # read_csv skips blank lines before the header, so a run of blanks
+        # right above it is already a valid starting offset
+        if not line.strip():
+            if blank_run_start is None:
+                blank_run_start = line_no
+            continue
+
+        fields = next(csv.reader([line]), [])
+        if any(field.lower() in targets for field in fields):
+            return (blank_run_start if blank_run_start is not None else line_no), fields
+        blank_run_start = None
+
+    return None, None
+
+
+def locate_header(raw_data, target_keywords, max_skip=300):
+    """
+    Scan the raw lines once and return the line index to pass as `skiprows`
+    so the header contains a target column, or None if there isn't one.
+    """
+    return find_header(io.StringIO(raw_data), target_keywords, max_skip)[0]
+
+
+def detect_header(raw_data, target_keywords, max_skip=300):
+    with stage("header_detection"):
+        header_line = locate_header(raw_data, target_keywords, max_skip)
+    if header_line is None:
+        return None, None, "Could not detect valid dataset header"
+
+    try:
+        with stage("parse"):
+            df = pd.read_csv(io.StringIO(raw_data), skiprows=header_line)
+    except Exception:
+        return None, None, "Could not detect valid dataset header"
+
+    return df, header_line, None
+
+
+def projected_columns(columns):
+    """The only raw columns /upload keeps: known features, the target and the id."""
+    feature_cols = [col for col in FEATURE_KEYWORDS if col in columns]
+    target_col = next((col for col in TARGET_KEYWORDS if col in columns), None)
+    id_col = next((col for col in ID_KEYWORDS if col in columns), None)
+    keep = feature_cols + [c for c in (target_col, id_col) if c is not None]
+    return keep, target_col, id_col
+
+
+def feature_frame(df, medians=None):
+    """
+    The features of raw export rows as /upload maps them: known feature
+    columns only, renamed, numeric, and missing values filled from `medians`
+    (renamed column -> value). For scoring rows that are never stored.
+    """
+    feature_cols = [col for col in FEATURE_KEYWORDS if col in df.columns]
+    X = df[feature_cols].rename(columns=RENAME_MAP).apply(pd.to_numeric, errors="coerce")
+    X = X.loc[:, ~X.columns.duplicated()]
+    if medians:
+        X = X.fillna({col: value for col, value in medians.items() if col in X.columns and value is not None})
+    return X
+
+
+def process_dataset(df, header_line, medians=None):
+    """
+    Turn a parsed archive export into the dataset /upload stores.
+
+    Returns (dataset, features, summary) where `dataset` is a CompactDataset
+    (its core() and unscaled() views replace the old pair of frames) and
+    `summary` is the /upload JSON response. `medians` optionally supplies precomputed fill
+    values per renamed column (e.g. from a streaming quantile sketch);
+    columns not in it use the exact median.
+    """
+    # Find the first available ID column
+    id_col = next((col for col in ID_KEYWORDS if col in df.columns), None)
+
+    # Extract features and target
+    df_core, feature_cols, target_col = extract_features_and_target(df, FEATURE_KEYWORDS, TARGET_KEYWORDS)
+
+    rename_map = {k: v for k, v in RENAME_MAP.items() if k in df_core.columns}
+    df_core.rename(columns=rename_map, inplace=True)
+
+    if id_col:
+        df_core[id_col] = df[id_col]
+
+    df_core['target'] = df_core[target_col].map(TARGET_MAP)
+    df_core = df_core[df_core['target'].notna()]
+    df_core = df_core.drop(columns=[target_col])
+    df_core['target'] = df_core['target'].astype(int)
+
+    numeric_cols = df_core.select_dtypes(include=np.number).columns.drop('target', errors='ignore')
+    fill_values = {}
+    with stage("median_fill"):
+        for col in numeric_cols:
+            fill_value = medians[col] if medians and col in medians else df_core[col].median()
+            df_core[col] = df_core[col].fillna(fill_value)
+            fill_values[col] = None if pd.isna(fill_value) else float(fill_value)
+
+    # The unscaled data is kept AFTER filling NaNs but BEFORE any scaling/log transforms.
+    # The core frame is the same data in canonical column order, so only one copy is stored.
+    feature_cols = list(df_core.columns.drop('target'))
+
+    final_cols = [col for col in CANONICAL_ORDER if col in df_core.columns]
+    final_cols.append('target')
+    if id_col: final_cols.append(id_col)
+
+    # The summary is built from the float64 values, before the stored copy is compacted
+    head = df_core.head(5)
+    extracted_raw = head[feature_cols].to_dict(orient="records") if len(feature_cols) > 0 else []
+    extracted_normalized = head[feature_cols].to_dict(orient="records") if len(feature_cols) > 0 else []
+    targets_raw = head['target'].tolist()
+    targets_numeric = head['target'].tolist()
+    missing_counts = df_core.isnull().sum().to_dict()
+    temp_cols = [c for c in feature_cols if 'teff' in c.lower()]
+    rad_cols = [c for c in feature_cols if 'rad' in c.lower()]
+
+    features = [col for col in final_cols if col not in ['target', id_col]]
+
+    dataset = CompactDataset.from_frame(df_core, features, final_cols, fill_values=fill_values)
+
+    summary = {
+        "header_line": header_line, "target_column": target_col, "missing_counts": missing_counts,
+        "temperature_columns": temp_cols, "radius_columns": rad_cols, "extracted_raw": extracted_raw,
+        "extracted_normalized": extracted_normalized, "targets_raw": targets_raw, "targets_numeric": targets_numeric
+    }
+
+    return dataset, features, summary
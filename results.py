@@ -0,0 +1,58 @@
+import base64, json
+import numpy as np
+
+from dataset import output_frame
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+RESULT_FORMATS = ["records", "columnar", "ndjson"]
+
+
+def encode_cursor(predictions_id, offset):
+    raw = json.dumps({"p": predictions_id, "o": int(offset)}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return (predictions_id, offset) for a cursor, or raise ValueError."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        return payload["p"], int(payload["o"])
+    except Exception:
+        raise ValueError("Invalid cursor.")
+
+
+def matching_positions(predictions, classes=None):
+    """Row positions whose prediction is in `classes` (all rows when None)."""
+    predictions = np.asarray(predictions)
+    if not classes:
+        return np.arange(len(predictions))
+    return np.flatnonzero(np.isin(predictions, classes))
+
+
+def project_columns(df, requested=None):
+    # Unknown names are skipped so one client can ask for e.g. kepoi_name and pl_name at once
+    if not requested:
+        return list(df.columns)
+    return [col for col in requested if col in df.columns]
+
+
+def page_frame(df, predictions, positions, columns):
+    """Only the selected rows/columns, plus their row number and prediction."""
+    page = output_frame(df.iloc[positions][columns].reset_index(drop=True))
+    page.insert(0, "row", positions)
+    page["prediction"] = np.asarray(predictions)[positions]
+    return page
+
+
+def columnar(page):
+    # One array per column: no per-row dicts and no repeated keys in the JSON
+    return {col: page[col].tolist() for col in page.columns}
+
+
+def ndjson_lines(df, predictions, positions, columns, chunk_size=DEFAULT_PAGE_SIZE):
+    for start in range(0, len(positions), chunk_size):
+        page = page_frame(df, predictions, positions[start:start + chunk_size], columns)
+        for record in page.to_dict(orient="records"):
+            yield json.dumps(record) + "\n"
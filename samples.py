@@ -0,0 +1,62 @@
+import os, gzip, shutil, uuid, threading
+
+from upload_cache import UploadCache
+
+# Sample exports bundled in assets/, keyed by the short name used in the UI
+SAMPLE_FILES = {
+    "kepler": "cumulative_2025.09.25_12.58.46.csv",
+    "k2": "k2pandc_2025.09.25_12.59.27.csv",
+    "tess": "TOI_2025.09.25_11.42.37.csv",
+}
+
+
+class SampleStore:
+    """
+    The bundled sample CSVs, plus a gzipped copy of each kept in `cache_dir`.
+
+    Gzipped copies and content digests are rebuilt whenever the source
+    file's (mtime, size) changes.
+    """
+
+    def __init__(self, asset_dir, cache_dir):
+        self.asset_dir = asset_dir
+        self.cache_dir = cache_dir
+        self._digests = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def names(self):
+        return list(SAMPLE_FILES)
+
+    def path(self, name):
+        """Absolute path of a sample, or None for unknown names."""
+        filename = SAMPLE_FILES.get(name)
+        return os.path.join(self.asset_dir, filename) if filename else None
+
+    def gzip_path(self, name):
+        source = self.path(name)
+        target = os.path.join(self.cache_dir, SAMPLE_FILES[name] + ".gz")
+        if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+            return target
+
+        tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+        with open(source, "rb") as src, gzip.open(tmp, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp, target)
+        return target
+
+    def digest(self, name):
+        """SHA-256 of the sample, the same key /upload would compute for these bytes."""
+        path = self.path(name)
+        st = os.stat(path)
+        fingerprint = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._digests.get(name)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
+
+        with open(path, "rb") as f:
+            digest = UploadCache.digest(f)
+        with self._lock:
+            self._digests[name] = (fingerprint, digest)
+        return digest
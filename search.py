@@ -0,0 +1,262 @@
+import os, math, time, random, itertools, multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from training import MODEL_CHOICES, TrainingCancelled
+
+SEARCH_STRATEGIES = ["grid", "random", "halving"]
+RANK_METRICS = ["accuracy", "logloss"]
+
+# A trial stops once the early-stopping loss hasn't improved for this many rounds
+EARLY_STOPPING_ROUNDS = 20
+# Share of the training rows held back to early-stop on, so trials are ranked on rows they never saw
+STOPPING_FRACTION = 0.15
+
+# Grid/random search refuse spaces bigger than this
+MAX_CANDIDATES = 500
+
+DEFAULT_SPACE = {
+    "xgb": {
+        "n_estimators": [100, 200, 400],
+        "max_depth": [3, 4, 6, 8],
+        "learning_rate": [0.03, 0.1, 0.3],
+        "subsample": [0.8, 1.0],
+    },
+    "lgbm": {
+        "n_estimators": [100, 200, 400],
+        "num_leaves": [15, 31, 63],
+        "max_depth": [-1, 6],
+        "learning_rate": [0.03, 0.1, 0.3],
+    },
+}
+
+
+def search_config(data):
+    """Validate a search request body and fill in defaults, or raise ValueError."""
+    strategy = data.get("strategy", "halving")
+    if strategy not in SEARCH_STRATEGIES:
+        raise ValueError(f"Unknown strategy '{strategy}'. Choose from: {', '.join(SEARCH_STRATEGIES)}")
+
+    models = data.get("models", MODEL_CHOICES)
+    if not models or any(m not in MODEL_CHOICES for m in models):
+        raise ValueError(f"Models must be a list drawn from: {', '.join(MODEL_CHOICES)}")
+
+    metric = data.get("metric", "accuracy")
+    if metric not in RANK_METRICS:
+        raise ValueError(f"Unknown metric '{metric}'. Choose from: {', '.join(RANK_METRICS)}")
+
+    space = {}
+    for model_choice in models:
+        model_space = (data.get("space") or {}).get(model_choice, DEFAULT_SPACE[model_choice])
+        if not isinstance(model_space, dict) or not all(isinstance(v, list) and v for v in model_space.values()):
+            raise ValueError(f"The {model_choice} search space must map parameter names to non-empty lists.")
+        space[model_choice] = model_space
+
+    config = {
+        "strategy": strategy, "models": list(models), "space": space, "metric": metric,
+        "n_candidates": int(data.get("n_candidates", 27 if strategy == "halving" else 20)),
+        "min_rounds": int(data.get("min_rounds", 25)),
+        "max_rounds": int(data.get("max_rounds", 400)),
+        "eta": int(data.get("eta", 3)),
+        "seed": int(data.get("seed", 42)),
+    }
+    if config["n_candidates"] < 1 or config["min_rounds"] < 1 or config["eta"] < 2:
+        raise ValueError("n_candidates and min_rounds must be positive and eta at least 2.")
+    if strategy == "grid" and len(candidate_grid(space)) > MAX_CANDIDATES:
+        raise ValueError(f"The grid has more than {MAX_CANDIDATES} candidates; use random or halving search.")
+    return config
+
+
+def candidate_grid(space, skip=()):
+    """Every (model_choice, params) combination in the space."""
+    candidates = []
+    for model_choice, model_space in space.items():
+        names = [name for name in model_space if name not in skip]
+        for values in itertools.product(*(model_space[name] for name in names)):
+            candidates.append((model_choice, dict(zip(names, values))))
+    return candidates
+
+
+# ---------------------------------------------------------------------------
+# Pool workers: the split is sent once per worker, not once per candidate
+
+_DATA = {}
+
+
+def _init_worker(X_train, y_train, X_stop, y_stop, X_val, y_val, n_jobs):
+    _DATA.update(X_train=X_train, y_train=y_train, X_stop=X_stop, y_stop=y_stop, X_val=X_val, y_val=y_val,
+                 n_jobs=n_jobs, num_classes=len(np.unique(y_train)))
+
+
+def make_estimator(model_choice, params, num_classes, n_jobs=None):
+    # The libraries are imported here so the web process only pays for them when searching
+    from xgboost import XGBClassifier
+    from lightgbm import LGBMClassifier
+
+    if model_choice == "xgb":
+        return XGBClassifier(
+            objective="multi:softprob" if num_classes > 2 else "binary:logistic",
+            early_stopping_rounds=EARLY_STOPPING_ROUNDS, random_state=42, n_jobs=n_jobs, **params
+        )
+    return LGBMClassifier(random_state=42, n_jobs=n_jobs, verbose=-1, **params)
+
+
+def fit_candidate(model_choice, params, rounds=None):
+    """Fit one candidate on the worker's split. Returns (model, scores); failed fits give (None, {"error"})."""
+    from sklearn.metrics import accuracy_score, log_loss
+    from lightgbm import early_stopping
+
+    data = _DATA
+    if rounds:
+        params = dict(params, n_estimators=rounds)
+    start = time.perf_counter()
+    try:
+        model = make_estimator(model_choice, params, data["num_classes"], data["n_jobs"])
+        # Early stopping watches its own slice of the training rows; X_val only scores
+        eval_set = [(data["X_stop"], data["y_stop"])]
+        if model_choice == "xgb":
+            model.fit(data["X_train"], data["y_train"], eval_set=eval_set, verbose=False)
+            rounds_used = model.best_iteration + 1
+        else:
+            model.fit(data["X_train"], data["y_train"], eval_set=eval_set,
+                      callbacks=[early_stopping(EARLY_STOPPING_ROUNDS, verbose=False)])
+            rounds_used = model.best_iteration_ or model.n_estimators
+
+        proba = model.predict_proba(data["X_val"])
+        scores = {
+            "accuracy": float(accuracy_score(data["y_val"], model.classes_[proba.argmax(axis=1)])),
+            "logloss": float(log_loss(data["y_val"], proba, labels=model.classes_)),
+            "rounds": int(rounds_used),
+        }
+    except Exception as e:
+        model, scores = None, {"error": str(e)}
+    scores["fit_seconds"] = round(time.perf_counter() - start, 3)
+    return model, scores
+
+
+# ---------------------------------------------------------------------------
+
+def _rank_key(entry, metric):
+    # Later halving rungs first (they got more rounds), then the metric; failed trials last
+    if "error" in entry:
+        return (1, -entry.get("rung", 0), math.inf, math.inf)
+    primary = -entry["accuracy"] if metric == "accuracy" else entry["logloss"]
+    secondary = entry["logloss"] if metric == "accuracy" else -entry["accuracy"]
+    return (0, -entry.get("rung", 0), primary, secondary)
+
+
+def run_search(X, y, strategy="halving", models=None, space=None, metric="accuracy", n_candidates=20,
+               min_rounds=25, max_rounds=400, eta=3, seed=42, max_workers=None, threads=None, progress=None):
+    """
+    Search hyperparameters for XGBoost/LightGBM on the same 80/20 split /train uses.
+
+    grid tries every combination, random samples `n_candidates` of them and
+    halving (successive halving) starts `n_candidates` with `min_rounds`
+    boosting rounds, keeps the best 1/eta and gives them eta times more
+    rounds until `max_rounds`. Every trial is also early-stopped on a
+    slice of the training rows (STOPPING_FRACTION), so the validation
+    split trials are scored and ranked on stays unseen. Candidates run in a process pool of `max_workers`
+    that splits `threads` cores (default: all of them) between its fits.
+
+    `progress(trials_done, metrics, trial=entry)` is called as trials
+    finish; returning True cancels the search (TrainingCancelled).
+    Returns (best_model, {"leaderboard": [...], "best": entry, ...}).
+    """
+    from sklearn.model_selection import train_test_split
+
+    models = models or MODEL_CHOICES
+    space = {m: (space or DEFAULT_SPACE)[m] for m in models}
+    max_workers = max_workers or os.cpu_count() or 1
+
+    X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=0.2, random_state=42)
+    X_train, X_stop, y_train, y_stop = train_test_split(X_train, y_train, test_size=STOPPING_FRACTION,
+                                                        random_state=42)
+    split = (X_train, y_train, X_stop, y_stop, X_val, y_val)
+    # Split the cores between trials instead of letting each fit grab all of them
+    n_jobs = max(1, (threads or os.cpu_count() or 1) // max_workers)
+
+    rng = random.Random(seed)
+    if strategy == "halving":
+        grid = candidate_grid(space, skip=("n_estimators",))
+        candidates = rng.sample(grid, min(n_candidates, len(grid)))
+    elif strategy == "random":
+        grid = candidate_grid(space)
+        candidates = rng.sample(grid, min(n_candidates, len(grid)))
+    else:
+        candidates = candidate_grid(space)
+
+    leaderboard = {}  # candidate index -> latest entry
+    best = {"model": None, "entry": None}
+    done = [0]
+
+    def record(candidate, rung, rounds, model, scores):
+        model_choice, params = candidates[candidate]
+        entry = {"candidate": candidate, "model": model_choice, "params": params, "rung": rung, **scores}
+        if rounds:
+            entry["max_rounds"] = rounds
+        leaderboard[candidate] = entry
+        if model is not None and (best["entry"] is None or _rank_key(entry, metric) < _rank_key(best["entry"], metric)):
+            best.update(model=model, entry=entry)
+        done[0] += 1
+        if progress:
+            validation = {k: scores[k] for k in ("accuracy", "logloss") if k in scores}
+            return progress(done[0], {"validation": validation}, trial=entry)
+        return False
+
+    executor = None
+    if max_workers > 1 and len(candidates) > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker, initargs=(*split, n_jobs)
+        )
+    else:
+        _init_worker(*split, n_jobs)
+
+    try:
+        def run_rung(alive, rung, rounds):
+            tasks = [(candidates[c][0], candidates[c][1], rounds) for c in alive]
+            if executor is None:
+                for c, task in zip(alive, tasks):
+                    if record(c, rung, rounds, *fit_candidate(*task)):
+                        raise TrainingCancelled()
+                return
+            futures = {executor.submit(fit_candidate, *task): c for c, task in zip(alive, tasks)}
+            for future in as_completed(futures):
+                if record(futures[future], rung, rounds, *future.result()):
+                    for pending in futures:
+                        pending.cancel()
+                    raise TrainingCancelled()
+
+        if strategy == "halving":
+            alive, rung, rounds = list(range(len(candidates))), 0, min(min_rounds, max_rounds)
+            while True:
+                run_rung(alive, rung, rounds)
+                if len(alive) <= 1 or rounds >= max_rounds:
+                    break
+                # Prune: only the best 1/eta get more rounds
+                ranked = sorted((c for c in alive if "error" not in leaderboard[c]),
+                                key=lambda c: _rank_key(leaderboard[c], metric))
+                alive = ranked[:max(1, len(ranked) // eta)]
+                if not alive:
+                    break
+                rung, rounds = rung + 1, min(rounds * eta, max_rounds)
+        else:
+            run_rung(list(range(len(candidates))), 0, None)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            _DATA.clear()  # don't keep the split alive in the web or job process
+
+    if best["model"] is None:
+        raise ValueError("Every search trial failed: " + next(iter(leaderboard.values()))["error"])
+
+    ranked = sorted(leaderboard.values(), key=lambda entry: _rank_key(entry, metric))
+    for rank, entry in enumerate(ranked, start=1):
+        entry["rank"] = rank
+
+    return best["model"], {
+        "strategy": strategy, "metric": metric, "trials": done[0],
+        "best": best["entry"], "leaderboard": ranked,
+    }
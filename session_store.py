@@ -0,0 +1,321 @@
+import os, re, json, time, uuid, shutil, fcntl, threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import joblib
+
+from dataset import CompactDataset
+
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+MANIFEST = "manifest.json"
+
+
+def _write_json(path, payload):
+    tmp = f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(payload, f)
+    os.replace(tmp, path)
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def write_frame(df, path):
+    """Write a DataFrame as one .npy file per column plus a small JSON header."""
+    os.makedirs(path, exist_ok=True)
+    meta = {"columns": [], "index": None}
+
+    for i, col in enumerate(df.columns):
+        series = df[col]
+        entry = {"name": col, "dtype": str(series.dtype), "file": f"c{i}.npy"}
+        if series.dtype.kind in "biufcmM":
+            np.save(os.path.join(path, entry["file"]), series.to_numpy())
+        else:
+            # Strings/objects: fixed-width unicode plus a null mask, no pickling
+            mask = series.isna().to_numpy()
+            values = series.where(~mask, "").astype(str).to_numpy().astype("U")
+            np.save(os.path.join(path, entry["file"]), values)
+            np.save(os.path.join(path, f"c{i}.mask.npy"), mask)
+            entry["mask"] = f"c{i}.mask.npy"
+        meta["columns"].append(entry)
+
+    if not isinstance(df.index, pd.RangeIndex) or df.index.start != 0 or df.index.step != 1:
+        np.save(os.path.join(path, "index.npy"), df.index.to_numpy())
+        meta["index"] = "index.npy"
+
+    _write_json(os.path.join(path, "frame.json"), meta)
+
+
+def read_frame(path):
+    with open(os.path.join(path, "frame.json")) as f:
+        meta = json.load(f)
+
+    columns = {}
+    for entry in meta["columns"]:
+        values = np.load(os.path.join(path, entry["file"]))
+        if "mask" in entry:
+            values = values.astype(object)
+            values[np.load(os.path.join(path, entry["mask"]))] = np.nan
+        columns[entry["name"]] = pd.Series(values, copy=False).astype(entry["dtype"])
+
+    df = pd.DataFrame(columns)
+    if meta["index"]:
+        df.index = np.load(os.path.join(path, meta["index"]))
+    return df
+
+
+def _value_kind(value):
+    if isinstance(value, CompactDataset):
+        return "dataset"
+    if isinstance(value, pd.DataFrame):
+        return "frame"
+    if isinstance(value, np.ndarray) and value.dtype.kind in "biufc":
+        return "array"
+    if isinstance(value, (list, dict, str, int, float, bool)):
+        return "json"
+    return "pickle"
+
+
+def _write_value(value, path):
+    os.makedirs(path, exist_ok=True)
+    kind = _value_kind(value)
+    if kind == "dataset":
+        value.save(path)
+    elif kind == "frame":
+        write_frame(value, path)
+    elif kind == "array":
+        np.save(os.path.join(path, "value.npy"), value)
+    elif kind == "json":
+        _write_json(os.path.join(path, "value.json"), value)
+    else:
+        joblib.dump(value, os.path.join(path, "value.pkl"))
+    return kind
+
+
+def _read_value(kind, path):
+    if kind == "dataset":
+        return CompactDataset.load(path)
+    if kind == "frame":
+        return read_frame(path)
+    if kind == "array":
+        return np.load(os.path.join(path, "value.npy"))
+    if kind == "json":
+        with open(os.path.join(path, "value.json")) as f:
+            return json.load(f)
+    return joblib.load(os.path.join(path, "value.pkl"))
+
+
+def _link_files(source, path):
+    """Hard-link an already written value into `path` (falls back to copying across filesystems)."""
+    os.makedirs(path, exist_ok=True)
+    for name in os.listdir(source):
+        try:
+            os.link(os.path.join(source, name), os.path.join(path, name))
+        except OSError:
+            shutil.copy2(os.path.join(source, name), os.path.join(path, name))
+
+
+def _nbytes(value, path):
+    if isinstance(value, (np.ndarray, CompactDataset)):
+        return value.nbytes
+    # The on-disk size is a cheap, close estimate (deep memory_usage walks every string)
+    return _dir_size(path)
+
+
+class SessionStore:
+    """
+    Per-session storage for uploaded datasets, predictions and trained models.
+
+    Every update is written through to `root/<session_id>/` (DataFrames as
+    per-column .npy files), which is what lets several gunicorn workers on
+    one host share sessions. Each process also keeps recently used values in
+    memory; once they exceed `memory_budget` bytes the least recently used
+    sessions are dropped from memory and reloaded from disk on next access.
+    Sessions untouched for `session_ttl` seconds are deleted from disk.
+    """
+
+    def __init__(self, root, memory_budget=512 * 1024 * 1024, session_ttl=24 * 3600):
+        self.root = root
+        self.memory_budget = memory_budget
+        self.session_ttl = session_ttl
+        self._cache = OrderedDict()  # session_id -> {key: (token, value, nbytes)}
+        self._cached_bytes = 0
+        self._lock = threading.RLock()
+        self._last_prune = 0
+        self.hits = 0
+        self.disk_loads = 0
+        self.evictions = 0
+        os.makedirs(root, exist_ok=True)
+
+    def _session_dir(self, session_id):
+        if not SESSION_ID_PATTERN.match(session_id or ""):
+            raise ValueError("Invalid session id.")
+        return os.path.join(self.root, session_id)
+
+    def _read_manifest(self, session_id):
+        try:
+            with open(os.path.join(self._session_dir(session_id), MANIFEST)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"version": 0, "parts": {}}
+
+    def version(self, session_id):
+        """Monotonic counter bumped by every update/clear of the session."""
+        return self._read_manifest(session_id)["version"]
+
+    def get(self, session_id, key, default=None):
+        return self.get_many(session_id, key, default=default)[key]
+
+    def get_many(self, session_id, *keys, default=None):
+        """Fetch several values with a single manifest read."""
+        for attempt in range(2):
+            manifest = self._read_manifest(session_id)
+            try:
+                return {key: self._load(session_id, key, manifest["parts"].get(key), default) for key in keys}
+            except FileNotFoundError:
+                # Another worker replaced the part between our manifest read and load; retry once
+                if attempt:
+                    raise
+
+    def _load(self, session_id, key, part, default):
+        if part is None:
+            return default
+
+        with self._lock:
+            cached = self._cache.get(session_id, {}).get(key)
+            if cached is not None and cached[0] == part["dir"]:
+                self._cache.move_to_end(session_id)
+                self.hits += 1
+                return cached[1]
+
+        path = os.path.join(self._session_dir(session_id), part["dir"])
+        value = _read_value(part["kind"], path)
+        self.disk_loads += 1
+        self._remember(session_id, key, part["dir"], value, part["nbytes"])
+        return value
+
+    def _remember(self, session_id, key, token, value, nbytes):
+        with self._lock:
+            entries = self._cache.setdefault(session_id, {})
+            old = entries.pop(key, None)
+            if old is not None:
+                self._cached_bytes -= old[2]
+            entries[key] = (token, value, nbytes)
+            self._cached_bytes += nbytes
+            self._cache.move_to_end(session_id)
+
+            # Spill least recently used sessions (they are already on disk)
+            while self._cached_bytes > self.memory_budget and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= sum(entry[2] for entry in evicted.values())
+                self.evictions += 1
+
+    def _forget(self, session_id, keys=None):
+        with self._lock:
+            entries = self._cache.get(session_id)
+            if not entries:
+                return
+            for key in list(entries if keys is None else keys):
+                old = entries.pop(key, None)
+                if old is not None:
+                    self._cached_bytes -= old[2]
+            if not entries:
+                del self._cache[session_id]
+
+    def update(self, session_id, prewritten=None, **values):
+        """
+        Store each keyword as a session value; passing None deletes the key.
+
+        `prewritten` maps keys to directories where the same value was
+        already saved (a DataFrame by write_frame, a CompactDataset by its
+        save(), e.g. in the upload cache); those files are hard-linked
+        instead of being written again.
+        """
+        session_dir = self._session_dir(session_id)
+        os.makedirs(session_dir, exist_ok=True)
+        prewritten = prewritten or {}
+
+        written = {}
+        for key, value in values.items():
+            if value is None:
+                continue
+            part_dir = f"{key}-{uuid.uuid4().hex[:12]}"
+            path = os.path.join(session_dir, part_dir)
+            try:
+                if key not in prewritten:
+                    raise FileNotFoundError
+                _link_files(prewritten[key], path)
+                kind = _value_kind(value)
+            except FileNotFoundError:
+                # No source, or it was evicted meanwhile: write it ourselves
+                shutil.rmtree(path, ignore_errors=True)
+                kind = _write_value(value, path)
+            written[key] = ({"kind": kind, "dir": part_dir, "nbytes": _nbytes(value, path)}, value)
+
+        stale = []
+        with open(os.path.join(session_dir, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            manifest = self._read_manifest(session_id)
+            for key in values:
+                old = manifest["parts"].pop(key, None)
+                if old is not None:
+                    stale.append(old["dir"])
+                if key in written:
+                    manifest["parts"][key] = written[key][0]
+            manifest["version"] += 1
+            _write_json(os.path.join(session_dir, MANIFEST), manifest)
+
+        for part_dir in stale:
+            shutil.rmtree(os.path.join(session_dir, part_dir), ignore_errors=True)
+
+        self._forget(session_id, [key for key in values if key not in written])
+        for key, (part, value) in written.items():
+            self._remember(session_id, key, part["dir"], value, part["nbytes"])
+
+        self._maybe_prune()
+        return manifest["version"]
+
+    def clear(self, session_id):
+        """Drop every value of one session, leaving other sessions alone."""
+        session_dir = self._session_dir(session_id)
+        self._forget(session_id)
+        if not os.path.isdir(session_dir):
+            return
+
+        with open(os.path.join(session_dir, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            manifest = self._read_manifest(session_id)
+            stale = [part["dir"] for part in manifest["parts"].values()]
+            _write_json(os.path.join(session_dir, MANIFEST), {"version": manifest["version"] + 1, "parts": {}})
+
+        for part_dir in stale:
+            shutil.rmtree(os.path.join(session_dir, part_dir), ignore_errors=True)
+
+    def _maybe_prune(self, interval=600):
+        now = time.time()
+        if now - self._last_prune < interval:
+            return
+        self._last_prune = now
+
+        for session_id in os.listdir(self.root):
+            manifest_path = os.path.join(self.root, session_id, MANIFEST)
+            try:
+                if now - os.path.getmtime(manifest_path) > self.session_ttl:
+                    self._forget(session_id)
+                    shutil.rmtree(os.path.join(self.root, session_id), ignore_errors=True)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions_in_memory": len(self._cache),
+                "bytes_in_memory": self._cached_bytes,
+                "memory_budget": self.memory_budget,
+                "hits": self.hits,
+                "disk_loads": self.disk_loads,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,61 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from preprocessing import RENAME_MAP
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE = os.path.join(ROOT, "assets", "cumulative_2025.09.25_12.58.46.csv")
+
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    # The app keeps sessions under ORBITAL_STATE_DIR, read once at import
+    os.environ["ORBITAL_STATE_DIR"] = str(tmp_path_factory.mktemp("state"))
+    import app as orbital_app
+    return orbital_app.app.test_client()
+
+
+def sample_csv(rows=200):
+    with open(SAMPLE) as f:
+        lines = [line for line in f.read().splitlines() if not line.startswith("#")]
+    return "\n".join(lines[:rows + 1])
+
+
+def test_save_reproduces_uploaded_values(client):
+    csv = sample_csv()
+    headers = {"X-Session-ID": "roundtrip"}
+    response = client.post("/upload", data={"file": (io.BytesIO(csv.encode()), "kepler.csv")},
+                           headers=headers, content_type="multipart/form-data")
+    assert response.status_code == 200, response.get_json()
+
+    saved = pd.read_csv(io.BytesIO(client.get("/save", headers=headers).data))
+    source = pd.read_csv(io.StringIO(csv)).rename(columns=RENAME_MAP)
+    assert len(saved) == len(source)
+
+    compared = [column for column in saved.columns if column in source and source[column].dtype.kind == "f"]
+    assert "pl_orbper" in compared
+    for column in compared:
+        given = source[column].notna().to_numpy()  # missing values come back as the column median
+        np.testing.assert_array_equal(saved[column].to_numpy()[given], source[column].to_numpy()[given],
+                                      err_msg=column)
+
+
+def test_clients_without_a_session_id_get_their_own(client):
+    import app as orbital_app
+    csv = sample_csv(20).encode()
+    first = orbital_app.app.test_client()
+    response = first.post("/upload", data={"file": (io.BytesIO(csv), "kepler.csv")},
+                          content_type="multipart/form-data")
+    session_id = response.headers["X-Session-ID"]
+    assert first.get_cookie("session_id").value == session_id
+
+    # The cookie brings the same client back to its dataset; a new client starts empty
+    assert first.get("/save").status_code == 200
+    assert "X-Session-ID" not in first.get("/save").headers
+    other = orbital_app.app.test_client().get("/save")
+    assert other.status_code == 400
+    assert other.headers["X-Session-ID"] != session_id
@@ -0,0 +1,25 @@
+from thread_budget import ThreadBudget
+
+
+def test_borrowing_is_opt_in(monkeypatch):
+    monkeypatch.delenv("THREAD_BUDGET_BORROW", raising=False)
+    monkeypatch.setenv("ORBITAL_THREAD_PROCESSES", "2")
+    budget = ThreadBudget.from_env()
+    assert budget.borrow_dir is None
+    with budget.lease("predict") as threads:
+        assert threads == budget.share
+
+
+def test_borrowing_budgets_stay_within_the_host_cores(tmp_path):
+    # Two processes' budgets (here in one process) sharing a ledger directory
+    a, b = (ThreadBudget(cores=8, processes=2, borrow_dir=str(tmp_path)) for _ in range(2))
+
+    with a.lease("train") as borrowed:
+        assert borrowed == 7  # all but the core kept free for b
+        with b.lease("train") as rest:
+            assert borrowed + rest == 8
+    assert b.stats()["threads_in_use"] == 0
+
+    # Once a's calls are over b may borrow the same cores
+    with b.lease("train") as threads:
+        assert threads == 7
@@ -0,0 +1,71 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+from sklearn.datasets import make_classification
+
+from train_matrix import TrainingMatrices
+from training import fit_prebuilt, continue_training, model_kind
+
+
+def dataset(num_classes, n=1200, seed=0):
+    X, y = make_classification(n, 8, n_informative=5, n_classes=num_classes, random_state=seed)
+    return pd.DataFrame(X, columns=[f"f{i}" for i in range(8)]).astype("float32"), pd.Series(y)
+
+
+def native_proba(model, X):
+    """Class probabilities straight from the booster, bypassing the sklearn wrapper."""
+    if model_kind(model) == "xgb":
+        raw = model.get_booster().predict(xgb.DMatrix(X))
+    else:
+        raw = model.booster_.predict(X, num_iteration=model.best_iteration_ or None)
+    return np.column_stack([1 - raw, raw]) if raw.ndim == 1 else raw
+
+
+def assert_usable(model, X, num_classes):
+    # What the app relies on: classes, features, predict_proba, booster access and pickling
+    np.testing.assert_array_equal(model.classes_, np.arange(num_classes))
+    proba = model.predict_proba(X)
+    assert proba.shape == (len(X), num_classes)
+    np.testing.assert_allclose(proba, native_proba(model, X), rtol=0, atol=1e-6)
+    np.testing.assert_array_equal(model.predict(X), proba.argmax(axis=1))
+    assert model.evals_result() if model_kind(model) == "xgb" else model.evals_result_
+    restored = pickle.loads(pickle.dumps(model))
+    np.testing.assert_allclose(restored.predict_proba(X), proba, rtol=0, atol=1e-7)
+    assert model_kind(restored) == model_kind(model)
+
+
+@pytest.mark.parametrize("num_classes", [2, 3])
+@pytest.mark.parametrize("kind", ["xgb", "lgbm"])
+def test_fit_prebuilt_round_trip(kind, num_classes):
+    X, y = dataset(num_classes)
+    matrices = TrainingMatrices(X, y)
+    model, evals_result = fit_prebuilt(matrices, kind, {"n_estimators": 30}, n_jobs=1)
+    assert model_kind(model) == kind
+    assert evals_result
+    assert_usable(model, matrices.X_test, num_classes)
+    if kind == "xgb":
+        assert model.get_booster().feature_names == list(X.columns)
+        assert model.get_booster().num_boosted_rounds() == 30
+    else:
+        assert model.feature_name_ == list(X.columns)
+
+
+@pytest.mark.parametrize("num_classes", [2, 3])
+@pytest.mark.parametrize("kind", ["xgb", "lgbm"])
+def test_continue_training_round_trip(kind, num_classes):
+    X, y = dataset(num_classes)
+    matrices = TrainingMatrices(X, y)
+    base, _ = fit_prebuilt(matrices, kind, {"n_estimators": 20}, n_jobs=1)
+    before = base.predict_proba(matrices.X_test)
+
+    new_X, new_y = dataset(num_classes, n=300, seed=1)
+    model, _ = continue_training(base, new_X[:240], new_y[:240], new_X[240:], new_y[240:], {"n_estimators": 10},
+                                 n_jobs=1)
+    assert_usable(model, matrices.X_test, num_classes)
+    # The base model keeps its own trees
+    np.testing.assert_array_equal(base.predict_proba(matrices.X_test), before)
+    rounds = (model.get_booster().num_boosted_rounds() if kind == "xgb" else model.booster_.current_iteration())
+    assert model.n_estimators == rounds > 10
@@ -0,0 +1,24 @@
+from training_jobs import TrainingJobManager, STATUS_FIELDS, RUNNING, _job_paths, _write_json
+
+
+def test_status_shows_only_public_fields_to_the_owner(tmp_path):
+    manager = TrainingJobManager(job_dir=str(tmp_path))
+    _write_json(_job_paths(manager.job_dir, "job1")["state"], {
+        "job_id": "job1", "state": RUNNING, "model": "xgb", "submitted_at": 1.0, "started_at": 2.0,
+        "owner": "alice", "pid": 1234, "slots": 1, "dataset_key": "v3-abc",
+        "session_store": {"root": "/srv/sessions", "ttl": 3600}, "hyperparams": {},
+    })
+    with open(_job_paths(manager.job_dir, "job1")["progress"], "w") as f:
+        f.write('{"iteration": 1, "metrics": {}}\n')
+
+    status = manager.status("job1", owner="alice")
+    assert set(status) == {"job_id", "state", "model", "submitted_at", "started_at",
+                           "progress", "progress_offset", "running_jobs"}
+    assert set(status) - {"progress", "progress_offset", "running_jobs"} <= set(STATUS_FIELDS)
+    assert status["progress"] == [{"iteration": 1, "metrics": {}}]
+    assert status["running_jobs"] == 1
+
+    assert manager.status("job1", owner="mallory") is None
+    assert list(manager.stream("job1", owner="mallory")) == []
+    assert manager.cancel("job1", owner="mallory") is False
+    assert manager.status("missing", owner="alice") is None
@@ -0,0 +1,81 @@
+import glob
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from lightgbm import LGBMClassifier, early_stopping
+from xgboost import XGBClassifier
+
+from tree_scorer import compile_model
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FEATURES = [f"c{i}" for i in range(6)]
+
+
+def sample(n, n_features=len(FEATURES), seed=0):
+    """Features on very different scales, with NaNs and exact zeros."""
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(n, n_features)) * rng.choice([1, 10, 1000], size=n_features)
+    X[rng.random(X.shape) < 0.05] = np.nan
+    X[rng.random(X.shape) < 0.02] = 0.0
+    return X
+
+
+def labels(X, num_classes):
+    y = (np.nan_to_num(X[:, 0]) > 0).astype(int)
+    if num_classes == 3:
+        y += (np.nan_to_num(X[:, 1]) > 0).astype(int)
+    return y
+
+
+def fitted(kind, num_classes, nan_free=False, early_stopped=False):
+    X = sample(3000)
+    y = labels(X, num_classes)
+    frame = pd.DataFrame(np.nan_to_num(X) if nan_free else X, columns=FEATURES)
+    if kind == "xgb":
+        model = XGBClassifier(n_estimators=300 if early_stopped else 40, max_depth=5, learning_rate=0.5,
+                              early_stopping_rounds=5 if early_stopped else None, random_state=0)
+        fit_kwargs = {"eval_set": [(frame[2000:], y[2000:])], "verbose": False} if early_stopped else {}
+    else:
+        model = LGBMClassifier(n_estimators=300 if early_stopped else 40, num_leaves=15, learning_rate=0.5,
+                               random_state=0, verbose=-1)
+        fit_kwargs = ({"eval_set": [(frame[2000:], y[2000:])], "callbacks": [early_stopping(5, verbose=False)]}
+                      if early_stopped else {})
+    return model.fit(frame[:2000], y[:2000], **fit_kwargs)
+
+
+def assert_parity(model, X):
+    compiled = compile_model(model)
+    frame = pd.DataFrame(X, columns=compiled.feature_names)
+    np.testing.assert_allclose(compiled.predict_proba(X), model.predict_proba(frame), rtol=0, atol=1e-5)
+    np.testing.assert_array_equal(compiled.predict(X), model.predict(frame))
+
+
+@pytest.mark.parametrize("num_classes", [2, 3])
+@pytest.mark.parametrize("kind", ["xgb", "lgbm"])
+def test_batch_matches_predict_proba(kind, num_classes):
+    assert_parity(fitted(kind, num_classes), sample(2000, seed=1))
+
+
+@pytest.mark.parametrize("num_classes", [2, 3])
+@pytest.mark.parametrize("kind", ["xgb", "lgbm"])
+def test_single_rows_match_predict_proba(kind, num_classes):
+    model = fitted(kind, num_classes)
+    X = sample(20, seed=2)
+    X[0] = np.nan  # every feature missing
+    for row in X:
+        assert_parity(model, row[None, :])
+
+
+@pytest.mark.parametrize("kind", ["xgb", "lgbm"])
+def test_early_stopped_and_nan_free_training(kind):
+    # predict_proba stops at the best iteration; NaNs at scoring time take the default branches
+    assert_parity(fitted(kind, 3, nan_free=True, early_stopped=True), sample(2000, seed=3))
+
+
+@pytest.mark.parametrize("path", sorted(glob.glob(os.path.join(ROOT, "*.pkl"))), ids=os.path.basename)
+def test_bundled_models(path):
+    model = joblib.load(path)
+    assert_parity(model, sample(2000, len(compile_model(model).feature_names), seed=4))
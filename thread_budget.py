@@ -0,0 +1,204 @@
+import os, math, uuid, fcntl, tempfile, threading
+from contextlib import contextmanager
+
+# Thread pools of the BLAS/OpenMP runtimes numpy, scikit-learn, XGBoost and LightGBM may start
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "BLIS_NUM_THREADS")
+
+
+def available_cores():
+    """Cores this process may run on: ORBITAL_CORES, else the CPU affinity mask and cgroup CPU quota."""
+    if os.environ.get("ORBITAL_CORES"):
+        return max(1, int(os.environ["ORBITAL_CORES"]))
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    try:
+        # cgroup v2 quota, e.g. "200000 100000" for two CPUs' worth of time in a container
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            cores = min(cores, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cores
+
+
+class ThreadBudget:
+    """
+    Decides how many threads each XGBoost/LightGBM call in this process may
+    use, so several gunicorn workers and training jobs on one host don't all
+    start a thread per core.
+
+    `processes` is how many processes share the host's `cores` (web workers
+    plus training job workers); each gets `cores // processes` threads and
+    splits them between its concurrent calls. Every call gets at least one
+    thread.
+
+    With `borrow_dir` (opt-in) a process may also borrow cores the others
+    aren't using. Every budget pointed at the same directory records its
+    threads in use there (under an flock), and a lease may take what the
+    others leave free, minus one core for each of the other processes with
+    nothing running, so the host stays within `cores`. Borrowed cores are
+    returned when the call ends; until then a process starting a call
+    gets what is left.
+
+    With `enabled=False` lease() yields None and the libraries pick their own
+    thread count (every core), as before.
+    """
+
+    def __init__(self, cores=None, processes=1, enabled=True, borrow_dir=None):
+        self.cores = cores or available_cores()
+        self.processes = max(1, processes)
+        self.share = max(1, self.cores // self.processes)
+        self.enabled = enabled
+        self.borrow_dir = borrow_dir
+        if borrow_dir is not None:
+            os.makedirs(borrow_dir, exist_ok=True)
+            # One ledger entry per budget; the pid tells whether its process is still around
+            self._ledger_path = os.path.join(borrow_dir, f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        self._lock = threading.Lock()
+        self._active = {}   # lease id -> threads
+        self._next_id = 0
+        self.leases = {}    # kind -> count
+        self.granted = {}   # kind -> threads granted in total
+        self.last = {}      # kind -> the latest decision (threads, budget, concurrent leases)
+
+    @classmethod
+    def from_env(cls):
+        processes = os.environ.get("ORBITAL_THREAD_PROCESSES")
+        if processes is None:
+            # Web workers (gunicorn.conf.py exports its WEB_CONCURRENCY before the app is loaded;
+            # unset means a single `python app.py` process) plus the training job pool in app.py
+            processes = int(os.environ.get("WEB_CONCURRENCY", 1)) + int(os.environ.get("TRAIN_MAX_WORKERS", 1))
+        borrow_dir = None
+        if os.environ.get("THREAD_BUDGET_BORROW", "0") == "1":
+            state_dir = os.environ.get("ORBITAL_STATE_DIR", os.path.join(tempfile.gettempdir(), "orbital_horizon"))
+            borrow_dir = os.environ.get("THREAD_BUDGET_DIR", os.path.join(state_dir, "threads"))
+        return cls(processes=int(processes),
+                   enabled=os.environ.get("THREAD_BUDGET", "1") == "1",
+                   borrow_dir=borrow_dir)
+
+    def _others_in_use(self):
+        """Threads in use by the other budgets sharing borrow_dir, per budget (called with the flock held)."""
+        in_use = []
+        for name in os.listdir(self.borrow_dir):
+            path = os.path.join(self.borrow_dir, name)
+            if name.startswith(".") or path == self._ledger_path:
+                continue
+            try:
+                pid = int(name.split("-")[0])
+                os.kill(pid, 0)
+            except ProcessLookupError:
+                os.unlink(path)  # left behind by a process that died mid-call
+                continue
+            except (ValueError, PermissionError):
+                pass
+            try:
+                with open(path) as f:
+                    in_use.append(int(f.read() or 0))
+            except (OSError, ValueError):
+                continue
+        return in_use
+
+    @contextmanager
+    def _shared(self):
+        """
+        When borrowing, holds the flock on borrow_dir and yields a function
+        recording this budget's threads in use there; otherwise yields None.
+        """
+        if self.borrow_dir is None:
+            yield None
+            return
+
+        def record(threads):
+            with open(self._ledger_path, "w") as f:
+                f.write(str(threads))
+
+        with open(os.path.join(self.borrow_dir, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield record
+
+    def _budget(self, others_in_use=None):
+        """Threads this process may use right now (called with the lock held)."""
+        if others_in_use is None:
+            return self.share
+        # Keep a core free for each other process with nothing running, so its next call fits too
+        idle_processes = max(0, self.processes - 1 - sum(1 for threads in others_in_use if threads))
+        return max(1, self.cores - sum(others_in_use) - idle_processes)
+
+    @contextmanager
+    def lease(self, kind):
+        """
+        Reserve threads for one native call: `with budget.lease("train") as n:`.
+        `n` is an int, or None when budgeting is off.
+        """
+        if not self.enabled:
+            yield None
+            return
+
+        with self._lock, self._shared() as record:
+            budget = self._budget(self._others_in_use() if record else None)
+            in_use = sum(self._active.values())
+            threads = max(1, min(budget // (len(self._active) + 1), budget - in_use))
+            lease_id = self._next_id
+            self._next_id += 1
+            self._active[lease_id] = threads
+            if record:
+                record(sum(self._active.values()))
+            self.leases[kind] = self.leases.get(kind, 0) + 1
+            self.granted[kind] = self.granted.get(kind, 0) + threads
+            self.last[kind] = {"threads": threads, "budget": budget, "concurrent": len(self._active)}
+        try:
+            yield threads
+        finally:
+            with self._lock, self._shared() as record:
+                del self._active[lease_id]
+                if record:
+                    record(sum(self._active.values()))
+
+    def limit_native_pools(self):
+        """
+        Cap the BLAS/OpenMP pools to this process' share: environment defaults
+        for processes started from here (training job workers) and, through
+        threadpoolctl, the runtimes already loaded.
+        """
+        if not self.enabled:
+            return
+        for name in THREAD_ENV_VARS:
+            os.environ.setdefault(name, str(self.share))
+        try:
+            from threadpoolctl import threadpool_limits
+        except ImportError:
+            return
+        threadpool_limits(limits=self.share)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "cores": self.cores,
+                "processes": self.processes,
+                "share": self.share,
+                "borrow": self.borrow_dir is not None,
+                "active": len(self._active),
+                "threads_in_use": sum(self._active.values()),
+                "leases": dict(self.leases),
+                "granted": dict(self.granted),
+                "last": {kind: dict(decision) for kind, decision in self.last.items()},
+            }
+
+
+def set_threads(model, threads):
+    """Point a fitted XGBoost or LightGBM sklearn model at `threads` threads for its next predictions."""
+    if threads is None or not hasattr(model, "n_jobs") or model.n_jobs == threads:
+        return
+    if hasattr(model, "get_booster"):
+        # Only the booster's thread count; set_params would push every parameter again
+        model.get_booster().set_param("nthread", threads)
+    model.n_jobs = threads
+
+
+# One budget per process, shared by the app, training and the job workers
+budget = ThreadBudget.from_env()
+lease = budget.lease
@@ -0,0 +1,79 @@
+import os, threading
+from collections import OrderedDict
+
+import numpy as np
+import xgboost as xgb
+
+# Datasets whose prebuilt matrices each process keeps around
+MAX_CACHED_DATASETS = int(os.environ.get("TRAIN_MATRIX_CACHE", 2))
+
+
+class TrainingMatrices:
+    """
+    The 80/20 split of one dataset plus the binned training matrices each
+    library builds from it. Only hyperparameters change between retrains,
+    so the split and the quantized histograms are built once and reused.
+    """
+
+    def __init__(self, X, y):
+        from sklearn.model_selection import train_test_split
+
+        self.X_train, self.X_test, self.y_train, self.y_test = train_test_split(
+            X, y, test_size=0.2, random_state=42
+        )
+        self.num_classes = len(np.unique(self.y_train))
+        # Boosting on a shared Dataset/DMatrix is not thread safe, so fits on one dataset take turns
+        self.lock = threading.Lock()
+        self._xgb = None
+        self._lgbm = None
+
+    def xgb(self, nthread=None):
+        """
+        (train, test) QuantileDMatrix pair; the test matrix reuses the training
+        bin edges. `nthread` caps the threads that build them (None: all cores).
+        """
+        if self._xgb is None:
+            dtrain = xgb.QuantileDMatrix(self.X_train, self.y_train, nthread=nthread)
+            self._xgb = (dtrain, xgb.QuantileDMatrix(self.X_test, self.y_test, ref=dtrain, nthread=nthread))
+        return self._xgb
+
+    def lgbm(self, params):
+        """(train, valid) lgb.Dataset pair, binned on first use with `params` (seed, num_threads)."""
+        if self._lgbm is None:
+            import lightgbm as lgb
+
+            # LightGBM keeps its own float copy of the raw data until it is binned; drop it after that.
+            # X_test stays around in this object for scoring.
+            train_set = lgb.Dataset(self.X_train, self.y_train, params=params, free_raw_data=True)
+            valid_set = lgb.Dataset(self.X_test, self.y_test, reference=train_set, params=params, free_raw_data=True)
+            train_set.construct()
+            valid_set.construct()
+            self._lgbm = (train_set, valid_set)
+        return self._lgbm
+
+    def class_sample(self):
+        """A couple of training rows per class (enough for LightGBM to set up its label encoding)."""
+        rows = np.concatenate([np.flatnonzero(np.asarray(self.y_train) == c)[:2] for c in np.unique(self.y_train)])
+        return self.X_train.iloc[rows], self.y_train.iloc[rows]
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def training_matrices(dataset_key, X, y):
+    """The TrainingMatrices for a dataset, shared by every retrain in this process."""
+    key = (dataset_key, tuple(X.columns))
+    with _cache_lock:
+        matrices = _cache.get(key)
+        if matrices is not None:
+            _cache.move_to_end(key)
+            return matrices
+
+    matrices = TrainingMatrices(X, y)
+    with _cache_lock:
+        matrices = _cache.setdefault(key, matrices)
+        _cache.move_to_end(key)
+        while len(_cache) > MAX_CACHED_DATASETS:
+            _cache.popitem(last=False)
+    return matrices
@@ -0,0 +1,452 @@
+import copy, time, importlib
+import numpy as np
+# XGBoost is already loaded for the pretrained models; LightGBM, scikit-learn's
+# metrics and matplotlib/seaborn are imported on first use (see preload())
+import xgboost as xgb
+from xgboost import XGBClassifier
+from xgboost.callback import TrainingCallback
+
+from train_matrix import training_matrices
+from instrumentation import stage
+from plots import pyplot, training_response
+from thread_budget import lease
+
+MODEL_CHOICES = ["xgb", "lgbm"]
+TRAINING_MODES = ["full", "incremental", "cv"]
+
+# Boosting rounds an incremental /train adds unless hyperparams say otherwise
+INCREMENTAL_ROUNDS = 25
+# Fewer changed rows than this can't be split for an incremental fit and its evaluation
+MIN_INCREMENTAL_ROWS = 10
+
+
+def trained_model_values(model, result=None):
+    """Session values for a freshly trained model: kept for download and later incremental training."""
+    # The model has now seen every row, so nothing is pending any more
+    values = {"trained_model": model, "pending_rows": np.empty(0, dtype=np.int64)}
+    training = (result or {}).get("training")
+    if training and training["mode"] == "full":
+        values["full_fit"] = {"fit_seconds": training["fit_seconds"], "rows": training["rows"]}
+    return values
+
+
+def preload():
+    """Import the training and plotting stacks now instead of on the first /train."""
+    # Only the import matters: it leaves the modules in sys.modules for the later local imports
+    for name in ("lightgbm", "sklearn.metrics", "sklearn.model_selection"):
+        importlib.import_module(name)
+    pyplot()
+
+
+class TrainingCancelled(Exception):
+    """Raised from inside a boosting loop when the caller asked us to stop."""
+
+
+class _XGBProgress(TrainingCallback):
+    def __init__(self, progress):
+        self.progress = progress
+
+    def after_iteration(self, model, epoch, evals_log):
+        snapshot = {
+            dataset_name: {metric_name: float(values[-1]) for metric_name, values in metrics_dict.items()}
+            for dataset_name, metrics_dict in evals_log.items()
+        }
+        if self.progress(epoch, snapshot):
+            raise TrainingCancelled()
+        return False
+
+
+def _lgbm_progress(progress):
+    def _callback(env):
+        snapshot = {}
+        for dataset_name, metric_name, value, _ in env.evaluation_result_list:
+            snapshot.setdefault(dataset_name, {})[metric_name] = float(value)
+        if progress(env.iteration, snapshot):
+            raise TrainingCancelled()
+    _callback.order = 5
+    return _callback
+
+
+def _wrap_xgb(model, booster, evals_result):
+    """An unfitted XGBClassifier holding an xgb.train booster, via its public load_model."""
+    model.load_model(bytearray(booster.save_raw("ubj")))
+    model.evals_result_ = evals_result
+    return model
+
+
+def _wrap_lgbm(model, booster, evals_result):
+    """
+    `model` (an LGBMClassifier already fitted with the right classes and
+    features) with an lgb.train booster swapped in. LightGBM has no public
+    way to do this, so it sets what LGBMClassifier.fit leaves behind; the
+    lightgbm version is pinned in requirements.txt and tests/test_training.py
+    checks the result (predict_proba, pickling, booster_).
+    """
+    model._Booster = booster
+    model._evals_result = evals_result
+    model._best_iteration = booster.best_iteration
+    model._best_score = booster.best_score
+    return model
+
+
+def fit_model(X_train, y_train, X_test, y_test, model_choice, hyperparams, progress=None, n_jobs=None,
+              verbose=True):
+    """
+    Fit an XGBoost or LightGBM classifier and return (model, evals_result).
+
+    `progress(iteration, metrics)` is called after every boosting round with
+    the latest value of each eval metric; returning True cancels training
+    by raising TrainingCancelled. `n_jobs` is the thread count (None: all cores).
+    LightGBM early-stops on (X_test, y_test); `verbose=False` keeps its
+    evaluation log off stdout.
+    """
+    num_classes = len(np.unique(y_train))
+
+    evals_result = {}  # to store training history
+
+    # ------------------------- XGBoost -------------------------
+    if model_choice == "xgb":
+        n_estimators = hyperparams.get("n_estimators", 100)
+        max_depth = hyperparams.get("max_depth", 3)
+        learning_rate = hyperparams.get("learning_rate", 0.1)
+
+        if num_classes > 2:
+            objective = "multi:softprob"
+        else:
+            objective = "binary:logistic"
+
+        model = XGBClassifier(
+            n_estimators=n_estimators,
+            max_depth=max_depth,
+            learning_rate=learning_rate,
+            objective=objective,
+            num_class=num_classes if num_classes > 2 else None,
+            random_state=42,
+            n_jobs=n_jobs,
+            callbacks=[_XGBProgress(progress)] if progress else None
+        )
+
+        model.fit(
+            X_train, y_train,
+            eval_set=[(X_train, y_train), (X_test, y_test)],
+            verbose=False
+        )
+        # Don't pickle the progress hook along with the model
+        model.set_params(callbacks=None)
+        evals_result = model.evals_result()
+
+    # ------------------------- LightGBM -------------------------
+    elif model_choice == "lgbm":
+        from lightgbm import LGBMClassifier, log_evaluation, early_stopping
+
+        model = LGBMClassifier(
+            n_estimators=hyperparams.get("n_estimators", 100),
+            learning_rate=hyperparams.get("learning_rate", 0.1),
+            max_depth=hyperparams.get("max_depth", -1),
+            num_leaves=hyperparams.get("num_leaves", 31),
+            random_state=42,
+            n_jobs=n_jobs,
+            **({} if verbose else {"verbose": -1})
+        )
+
+        # choose metric depending on problem type
+        if num_classes > 2:
+            metrics = ["multi_logloss", "multi_error"]
+        else:
+            metrics = ["binary_logloss", "binary_error"]
+
+        callbacks = [early_stopping(stopping_rounds=20, verbose=verbose)]
+        if verbose:
+            callbacks.insert(0, log_evaluation(period=10))
+        if progress:
+            callbacks.append(_lgbm_progress(progress))
+
+        model.fit(
+            X_train, y_train,
+            eval_set=[(X_train, y_train), (X_test, y_test)],
+            eval_metric=metrics,
+            callbacks=callbacks
+        )
+
+        # LightGBM stores in model.evals_result_
+        raw_result = model.evals_result_
+
+        # 🔄 Normalize to match XGBoost style
+        for dataset_name, metrics_dict in raw_result.items():
+            evals_result[dataset_name] = {}
+            for metric_name, values in metrics_dict.items():
+                evals_result[dataset_name][metric_name] = values
+
+    else:
+        raise ValueError("Invalid model choice.")
+
+    return model, evals_result
+
+
+def fit_prebuilt(matrices, model_choice, hyperparams, progress=None, n_jobs=None):
+    """
+    Same models as fit_model, but boosted with the native APIs on the cached
+    QuantileDMatrix / lgb.Dataset of `matrices` instead of rebuilding them
+    from the frames, then wrapped back into XGBClassifier / LGBMClassifier.
+    """
+    num_classes = matrices.num_classes
+    evals_result = {}
+
+    if model_choice == "xgb":
+        model = XGBClassifier(
+            n_estimators=hyperparams.get("n_estimators", 100),
+            max_depth=hyperparams.get("max_depth", 3),
+            learning_rate=hyperparams.get("learning_rate", 0.1),
+            objective="multi:softprob" if num_classes > 2 else "binary:logistic",
+            num_class=num_classes if num_classes > 2 else None,
+            random_state=42,
+            n_jobs=n_jobs
+        )
+        dtrain, dtest = matrices.xgb(nthread=n_jobs)
+        booster = xgb.train(
+            model.get_xgb_params(), dtrain, num_boost_round=model.n_estimators,
+            evals=[(dtrain, "validation_0"), (dtest, "validation_1")],
+            evals_result=evals_result, verbose_eval=False,
+            callbacks=[_XGBProgress(progress)] if progress else None
+        )
+        _wrap_xgb(model, booster, evals_result)
+
+    elif model_choice == "lgbm":
+        import lightgbm as lgb
+        from lightgbm import LGBMClassifier, log_evaluation, early_stopping
+
+        model = LGBMClassifier(
+            n_estimators=hyperparams.get("n_estimators", 100),
+            learning_rate=hyperparams.get("learning_rate", 0.1),
+            max_depth=hyperparams.get("max_depth", -1),
+            num_leaves=hyperparams.get("num_leaves", 31),
+            random_state=42,
+            n_jobs=n_jobs
+        )
+        metrics = ["multi_logloss", "multi_error"] if num_classes > 2 else ["binary_logloss", "binary_error"]
+        params = {
+            "objective": "multiclass" if num_classes > 2 else "binary",
+            "learning_rate": model.learning_rate, "max_depth": model.max_depth,
+            "num_leaves": model.num_leaves, "metric": metrics, "seed": 42,
+        }
+        if n_jobs is not None:
+            params["num_threads"] = n_jobs
+        if num_classes > 2:
+            params["num_class"] = num_classes
+
+        callbacks = [
+            log_evaluation(period=10),
+            early_stopping(stopping_rounds=20),
+            lgb.record_evaluation(evals_result),
+        ]
+        if progress:
+            callbacks.append(_lgbm_progress(progress))
+
+        # Binning runs on the same leased threads as boosting
+        train_set, valid_set = matrices.lgbm({key: params[key] for key in ("seed", "num_threads") if key in params})
+        booster = lgb.train(
+            params, train_set, num_boost_round=model.n_estimators,
+            valid_sets=[train_set, valid_set], valid_names=["training", "valid_1"],
+            callbacks=callbacks
+        )
+
+        # Let LightGBM's own fit set up the label encoding and feature metadata on a
+        # few rows, then swap in the booster trained on the cached Dataset
+        n_estimators = model.n_estimators
+        model.set_params(n_estimators=1).fit(*matrices.class_sample())
+        model.set_params(n_estimators=n_estimators)
+        _wrap_lgbm(model, booster, evals_result)
+
+    else:
+        raise ValueError("Invalid model choice.")
+
+    return model, evals_result
+
+
+def model_kind(model):
+    """"xgb" or "lgbm" for a fitted classifier, None for anything else."""
+    return {"XGBClassifier": "xgb", "LGBMClassifier": "lgbm"}.get(type(model).__name__)
+
+
+def continue_training(base_model, X_train, y_train, X_test, y_test, hyperparams, progress=None, n_jobs=None):
+    """
+    Warm start: boost more rounds of a fitted XGBClassifier / LGBMClassifier
+    on new rows, starting from its trees (XGBoost's xgb_model, LightGBM's
+    init_model). hyperparams["n_estimators"] is the number of rounds to add
+    (INCREMENTAL_ROUNDS by default). The base model is left untouched.
+    Returns (model, evals_result) like fit_model.
+    """
+    rounds = hyperparams.get("n_estimators", INCREMENTAL_ROUNDS)
+    evals_result = {}
+
+    if model_kind(base_model) == "xgb":
+        params = base_model.get_xgb_params()
+        if "learning_rate" in hyperparams:
+            params["learning_rate"] = hyperparams["learning_rate"]
+        if n_jobs is not None:
+            params["n_jobs"] = n_jobs
+        dtrain = xgb.DMatrix(X_train, label=y_train, nthread=n_jobs)
+        dtest = xgb.DMatrix(X_test, label=y_test, nthread=n_jobs)
+        booster = xgb.train(
+            params, dtrain, num_boost_round=rounds,
+            evals=[(dtrain, "validation_0"), (dtest, "validation_1")],
+            evals_result=evals_result, verbose_eval=False, xgb_model=base_model.get_booster(),
+            callbacks=[_XGBProgress(progress)] if progress else None
+        )
+        # A fresh wrapper: load_model into a copy would overwrite the base model's booster
+        model = _wrap_xgb(XGBClassifier(**base_model.get_params()), booster, evals_result)
+        model.set_params(n_estimators=booster.num_boosted_rounds(), callbacks=None)
+
+    elif model_kind(base_model) == "lgbm":
+        import lightgbm as lgb
+        from lightgbm import log_evaluation
+
+        params = dict(base_model.booster_.params)
+        for key in ("num_iterations", "n_estimators", "early_stopping_round"):
+            params.pop(key, None)
+        if "learning_rate" in hyperparams:
+            params["learning_rate"] = hyperparams["learning_rate"]
+        if n_jobs is not None:
+            params["num_threads"] = n_jobs
+
+        callbacks = [log_evaluation(period=10), lgb.record_evaluation(evals_result)]
+        if progress:
+            callbacks.append(_lgbm_progress(progress))
+
+        train_set = lgb.Dataset(X_train, y_train)
+        booster = lgb.train(
+            params, train_set, num_boost_round=rounds, init_model=base_model.booster_,
+            valid_sets=[train_set, lgb.Dataset(X_test, y_test, reference=train_set)],
+            valid_names=["training", "valid_1"], callbacks=callbacks
+        )
+        # Shares the label encoding and feature metadata; only the booster is replaced
+        model = _wrap_lgbm(copy.copy(base_model), booster, evals_result)
+        model.set_params(n_estimators=booster.current_iteration())
+
+    else:
+        raise ValueError("Only XGBoost and LightGBM models can be trained incrementally.")
+
+    return model, evals_result
+
+
+def continue_and_evaluate(base_model, X, y, hyperparams, progress=None, plots=True, plot_cache=None,
+                          reference=None, dataset_rows=None):
+    """
+    Incremental counterpart of train_and_evaluate: `X`/`y` are only the rows
+    added or changed since `base_model` was trained. They are split 80/20,
+    the model keeps boosting on the 80% and is scored on the other 20%.
+
+    `reference` ({"fit_seconds", "rows"} of the last full fit) and
+    `dataset_rows` (size of the whole dataset now) let the response estimate
+    what a full retrain would have cost, assuming its time grows with the
+    number of training rows.
+    """
+    from sklearn.model_selection import train_test_split
+
+    if len(X) < MIN_INCREMENTAL_ROWS:
+        raise ValueError(f"Incremental training needs at least {MIN_INCREMENTAL_ROWS} new or changed rows.")
+
+    with stage("split"):
+        X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    with lease("train") as n_jobs:
+        with stage("fit"):
+            start = time.perf_counter()
+            model, evals_result = continue_training(base_model, X_train, y_train, X_test, y_test,
+                                                    hyperparams, progress, n_jobs)
+            fit_seconds = time.perf_counter() - start
+        evaluation = evaluate_model(model, X_test, y_test, evals_result, int(base_model.n_classes_))
+
+    payload = training_response(evaluation, model_kind(base_model), plots, plot_cache)
+    training = {"mode": "incremental", "rows": len(X_train), "test_rows": len(X_test),
+                "added_rounds": hyperparams.get("n_estimators", INCREMENTAL_ROUNDS), "fit_seconds": fit_seconds}
+    if reference and dataset_rows:
+        full_rows = dataset_rows - int(np.ceil(0.2 * dataset_rows))
+        estimate = reference["fit_seconds"] * full_rows / reference["rows"]
+        training.update(estimated_full_fit_seconds=estimate, time_saved_seconds=estimate - fit_seconds)
+    payload["training"] = training
+    return model, payload
+
+
+def evaluate_model(model, X_test, y_test, evals_result, num_classes):
+    """
+    Score the held-out split. Returns plain lists and numbers (accuracy,
+    auc_score, confusion_matrix, class_labels, roc_curve, evals_result);
+    plots.training_response turns them into the /train payload.
+    """
+    from sklearn.metrics import accuracy_score, confusion_matrix, roc_auc_score, roc_curve
+
+    with stage("evaluate"):
+        y_pred = model.predict(X_test)
+        y_proba = model.predict_proba(X_test)[:, 1] if num_classes == 2 else None
+
+        acc = accuracy_score(y_test, y_pred)
+        cm = confusion_matrix(y_test, y_pred)
+
+        # ROC curve (binary only)
+        roc = None
+        auc_score = None
+        if y_proba is not None:
+            fpr, tpr, _ = roc_curve(y_test, y_proba)
+            auc_score = float(roc_auc_score(y_test, y_proba))
+            roc = {"fpr": fpr.tolist(), "tpr": tpr.tolist()}
+
+    class_labels = ["False Positive", "Candidate", "Confirmed"]
+    # Ensure we only use labels that are present in the data
+    unique_labels_in_data = np.unique(np.concatenate((y_test, y_pred)))
+
+    return {
+        "accuracy": float(acc),
+        "auc_score": auc_score,
+        "confusion_matrix": cm.tolist(),
+        "class_labels": [class_labels[i] for i in unique_labels_in_data],
+        "roc_curve": roc,
+        # Shared for both models; plain floats so it serializes as is
+        "evals_result": {dataset_name: {metric_name: [float(v) for v in values]
+                                        for metric_name, values in metrics_dict.items()}
+                         for dataset_name, metrics_dict in evals_result.items()}
+    }
+
+
+def train_and_evaluate(X, y, model_choice, hyperparams, progress=None, dataset_key=None,
+                       plots=True, plot_cache=None):
+    """
+    Train on an 80/20 split and return (model, /train response payload).
+
+    With a `dataset_key` (any id that changes whenever X/y do) the split and
+    the binned training matrices are cached per process and reused by later
+    calls for the same dataset. `plots` and `plot_cache` are passed on to
+    plots.training_response. Fitting and scoring use the threads the
+    process' thread budget grants this call.
+    """
+    if dataset_key is not None:
+        with stage("split"):
+            matrices = training_matrices(dataset_key, X, y)
+        with lease("train") as n_jobs:
+            with matrices.lock, stage("fit"):
+                start = time.perf_counter()
+                model, evals_result = fit_prebuilt(matrices, model_choice, hyperparams, progress, n_jobs)
+                fit_seconds = time.perf_counter() - start
+            evaluation = evaluate_model(model, matrices.X_test, matrices.y_test, evals_result, matrices.num_classes)
+        payload = training_response(evaluation, model_choice, plots, plot_cache)
+        payload["training"] = {"mode": "full", "rows": len(matrices.y_train), "fit_seconds": fit_seconds}
+        return model, payload
+
+    from sklearn.model_selection import train_test_split
+
+    with stage("split"):
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y, test_size=0.2, random_state=42
+        )
+
+    num_classes = len(np.unique(y_train))
+
+    with lease("train") as n_jobs:
+        with stage("fit"):
+            start = time.perf_counter()
+            model, evals_result = fit_model(X_train, y_train, X_test, y_test, model_choice, hyperparams, progress, n_jobs)
+            fit_seconds = time.perf_counter() - start
+        evaluation = evaluate_model(model, X_test, y_test, evals_result, num_classes)
+    payload = training_response(evaluation, model_choice, plots, plot_cache)
+    payload["training"] = {"mode": "full", "rows": len(X_train), "fit_seconds": fit_seconds}
+    return model, payload
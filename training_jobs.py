@@ -0,0 +1,400 @@
+import os, json, time, uuid, fcntl, threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import joblib
+
+from training import train_and_evaluate, continue_and_evaluate, trained_model_values, TrainingCancelled
+from search import run_search
+from cross_validation import cross_validate
+from plots import PlotCache
+from thread_budget import lease
+from session_store import SessionStore
+
+QUEUED, RUNNING, COMPLETED, FAILED, CANCELLED = "queued", "running", "completed", "failed", "cancelled"
+FINISHED_STATES = (COMPLETED, FAILED, CANCELLED)
+# What status() shows of a job; the rest of its state (pid, owner, session store...) stays internal
+STATUS_FIELDS = ("job_id", "state", "model", "submitted_at", "started_at", "finished_at",
+                 "result", "error", "model_stored")
+
+
+class JobQueueFull(Exception):
+    """Raised when a submit would exceed the job limits."""
+
+
+def _write_json(path, payload):
+    # Write-then-rename so readers never see a half written file; the temp name is
+    # unique per call, as threads of one process (the job callbacks) write states too
+    tmp = f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(payload, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def _job_paths(job_dir, job_id):
+    base = os.path.join(job_dir, job_id)
+    return {
+        "state": base + ".json",
+        "progress": base + ".progress.ndjson",
+        "cancel": base + ".cancel",
+        "model": base + ".model.pkl",
+    }
+
+
+def _update_state(job_dir, job_id, **changes):
+    path = _job_paths(job_dir, job_id)["state"]
+    state = _read_json(path) or {"job_id": job_id}
+    state.update(changes)
+    _write_json(path, state)
+    return state
+
+
+def _alive(pid):
+    if pid is None:
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _acquire_slot(job_dir, slots, cancel_path, poll_interval=0.5):
+    """
+    One of `slots` training slots shared by every process on the host: an
+    flock on `job_dir/.slot-<n>`, released when the returned file is closed
+    or the process dies. Waits for a free one; None if the job is cancelled
+    meanwhile.
+    """
+    while True:
+        for n in range(slots):
+            slot = open(os.path.join(job_dir, f".slot-{n}"), "w")
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot
+            except BlockingIOError:
+                slot.close()
+        if os.path.exists(cancel_path):
+            return None
+        time.sleep(poll_interval)
+
+
+def _store_in_session(state, model, result):
+    """
+    Hand a finished job's model to its owner's session, from the job worker
+    itself so it doesn't depend on the submitting web worker still being
+    around. Skipped if the session has moved on to another dataset.
+    """
+    store, owner = state.get("session_store"), state.get("owner")
+    if model is None or store is None or owner is None:
+        return False
+    try:
+        sessions = SessionStore(store["root"], memory_budget=0, session_ttl=store["ttl"])
+        if sessions.get(owner, "dataset_key") != state.get("dataset_key"):
+            print(f"⚠️ Training job {state['job_id']} finished after its session changed datasets; model not stored.")
+            return False
+        sessions.update(owner, **trained_model_values(model, result))
+    except Exception as e:
+        print(f"❌ Could not hand over model for job {state['job_id']}: {e}")
+        return False
+    print(f"✅ Training job {state['job_id']} finished, model ready for download.")
+    return True
+
+
+def _run_job(job_dir, job_id, work):
+    """
+    Runs inside a pool worker process. Everything the web process needs to
+    know is written to files under `job_dir`, so any worker can answer status
+    requests for any job. `work(progress)` returns (model, result).
+
+    The job first waits for one of the host-wide training slots, then runs,
+    then stores its model in the owner's session (see _store_in_session).
+    """
+    paths = _job_paths(job_dir, job_id)
+    state = _read_json(paths["state"]) or {"job_id": job_id}
+    slot = None if os.path.exists(paths["cancel"]) else _acquire_slot(job_dir, state.get("slots", 1), paths["cancel"])
+    if slot is None:
+        _update_state(job_dir, job_id, state=CANCELLED, finished_at=time.time())
+        return CANCELLED
+    with slot:
+        return _run_in_slot(job_dir, job_id, paths, state, work)
+
+
+def _run_in_slot(job_dir, job_id, paths, state, work):
+    _update_state(job_dir, job_id, state=RUNNING, started_at=time.time())
+
+    with open(paths["progress"], "a") as progress_file:
+        def progress(iteration, metrics, **extra):
+            progress_file.write(json.dumps({"iteration": iteration, "metrics": metrics, **extra}) + "\n")
+            progress_file.flush()
+            return os.path.exists(paths["cancel"])
+
+        try:
+            model, result = work(progress)
+        except TrainingCancelled:
+            _update_state(job_dir, job_id, state=CANCELLED, finished_at=time.time())
+            return CANCELLED
+        except Exception as e:
+            _update_state(job_dir, job_id, state=FAILED, error=str(e), finished_at=time.time())
+            return FAILED
+
+    joblib.dump(model, paths["model"])
+    # Stored before the job shows as completed, so /download_model works as soon as it does
+    stored = _store_in_session(state, model, result)
+    _update_state(job_dir, job_id, state=COMPLETED, result=result, model_stored=stored, finished_at=time.time())
+    return COMPLETED
+
+
+def run_training_job(job_dir, job_id, X, y, model_choice, hyperparams, dataset_key=None,
+                     plots=True, plot_dir=None, base_model=None, reference=None, dataset_rows=None):
+    # Pool workers are long lived, so their cached training matrices serve later jobs too.
+    # Plots go through the web app's plot cache directory so /plots/<key>.png can serve them.
+    plot_cache = PlotCache(plot_dir) if plot_dir else None
+    if base_model is not None:
+        # Incremental: X/y are only the new rows, base_model keeps boosting on them
+        return _run_job(job_dir, job_id, lambda progress: continue_and_evaluate(
+            base_model, X, y, hyperparams, progress=progress, plots=plots, plot_cache=plot_cache,
+            reference=reference, dataset_rows=dataset_rows
+        ))
+    return _run_job(job_dir, job_id, lambda progress: train_and_evaluate(
+        X, y, model_choice, hyperparams, progress=progress, dataset_key=dataset_key,
+        plots=plots, plot_cache=plot_cache
+    ))
+
+
+def run_search_job(job_dir, job_id, X, y, model_choice, config, dataset_key=None):
+    """A hyperparameter search (see search.run_search); `config` comes from search.search_config."""
+    # The whole search holds one lease; its trial processes share those threads
+    with lease("search") as threads:
+        max_workers = int(os.environ.get("SEARCH_MAX_WORKERS", threads or os.cpu_count() or 1))
+        return _run_job(job_dir, job_id, lambda progress: run_search(
+            X, y, max_workers=max_workers, threads=threads, progress=progress, **config
+        ))
+
+
+def run_cv_job(job_dir, job_id, X, y, model_choice, hyperparams, dataset_key=None, folds=5, repeats=1, seed=42):
+    """Cross-validation (see cross_validation.cross_validate); it only scores, so there is no model to keep."""
+    with lease("cv") as threads:
+        return _run_job(job_dir, job_id, lambda progress: (None, cross_validate(
+            X, y, model_choice, hyperparams, folds=folds, repeats=repeats, seed=seed,
+            threads=threads, progress=progress
+        )))
+
+
+class TrainingJobManager:
+    """
+    Runs /train work in a bounded process pool so long fits don't tie up
+    web workers.
+
+    Every web worker on the host has its own manager and pool, but the
+    limits are enforced across all of them through the state files in
+    `job_dir` (checked under an flock on `job_dir/.lock`): `max_workers`
+    caps how many trainings run at once on the host (the rest wait for a
+    slot), `max_pending` caps queued + running jobs and `max_per_owner`
+    stops a single client from filling the queue. Jobs whose submitting
+    process died are marked failed instead of counting forever.
+
+    With `sessions` (the app's SessionStore) a finished job stores its
+    model in the owner's session from the job worker itself.
+
+    Jobs run `runner(job_dir, job_id, X, y, model_choice, hyperparams, dataset_key, **options)`,
+    run_training_job by default (run_search_job for hyperparameter searches,
+    run_cv_job for cross-validation).
+    """
+
+    def __init__(self, job_dir, max_workers=1, max_pending=8, max_per_owner=2,
+                 sessions=None, job_ttl=24 * 3600):
+        self.job_dir = job_dir
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_per_owner = max_per_owner
+        self.session_store = {"root": sessions.root, "ttl": sessions.session_ttl} if sessions is not None else None
+        self.job_ttl = job_ttl
+        self._executor = None
+        self._futures = {}  # job_id -> (owner, future), jobs submitted by this process
+        self._lock = threading.Lock()
+        os.makedirs(job_dir, exist_ok=True)
+
+    def _get_executor(self):
+        # Created on first use so a preloading parent never forks a live pool.
+        # Spawned (not forked) workers avoid inheriting OpenMP state from the web process.
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive access to the job states, across every process sharing `job_dir`."""
+        with open(os.path.join(self.job_dir, ".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _jobs(self):
+        """The state of every job on record, from any process."""
+        for name in os.listdir(self.job_dir):
+            if name.endswith(".json") and not name.startswith("."):
+                try:
+                    state = _read_json(os.path.join(self.job_dir, name))
+                except ValueError:
+                    continue
+                if state is not None:
+                    yield state
+
+    def _active_jobs(self):
+        """Queued and running jobs of every process; call with _locked() held."""
+        active = []
+        for state in self._jobs():
+            if state["state"] in FINISHED_STATES:
+                continue
+            if not _alive(state.get("pid")):
+                # Its web worker (and with it the pool running the job) is gone
+                _update_state(self.job_dir, state["job_id"], state=FAILED, finished_at=time.time(),
+                              error="The process running this job exited before it finished.")
+                continue
+            active.append(state)
+        return active
+
+    def submit(self, X, y, model_choice, hyperparams, owner=None, runner=run_training_job, dataset_key=None, **options):
+        with self._lock, self._locked():
+            active = self._active_jobs()
+            if len(active) >= self.max_pending:
+                raise JobQueueFull(f"Too many training jobs queued (limit {self.max_pending}).")
+            if owner is not None and sum(1 for state in active if state.get("owner") == owner) >= self.max_per_owner:
+                raise JobQueueFull(f"You already have {self.max_per_owner} training jobs in progress.")
+
+            self._prune_finished()
+
+            job_id = uuid.uuid4().hex
+            _write_json(_job_paths(self.job_dir, job_id)["state"], {
+                "job_id": job_id, "state": QUEUED, "model": model_choice,
+                "hyperparams": hyperparams, "submitted_at": time.time(),
+                "owner": owner, "pid": os.getpid(), "slots": self.max_workers,
+                "dataset_key": dataset_key, "session_store": self.session_store
+            })
+
+            args = (runner, self.job_dir, job_id, X, y, model_choice, hyperparams, dataset_key)
+            try:
+                try:
+                    future = self._get_executor().submit(*args, **options)
+                except BrokenProcessPool:
+                    # A worker died (e.g. OOM-killed); start a fresh pool rather than failing forever
+                    self._executor = None
+                    future = self._get_executor().submit(*args, **options)
+            except Exception as e:
+                _update_state(self.job_dir, job_id, state=FAILED, error=str(e), finished_at=time.time())
+                raise
+            self._futures[job_id] = (owner, future)
+
+        future.add_done_callback(lambda f: self._finished(job_id, f))
+        return job_id
+
+    def _finished(self, job_id, future):
+        if future.cancelled():
+            _update_state(self.job_dir, job_id, state=CANCELLED, finished_at=time.time())
+            return
+        if future.exception() is not None:
+            # The worker process died (e.g. OOM-killed) before it could record anything
+            _update_state(self.job_dir, job_id, state=FAILED, error=str(future.exception()), finished_at=time.time())
+
+    def _prune_finished(self):
+        for job_id, (_, future) in list(self._futures.items()):
+            if future.done():
+                del self._futures[job_id]
+
+        cutoff = time.time() - self.job_ttl
+        for name in os.listdir(self.job_dir):
+            if name.startswith("."):
+                continue  # the lock and slot files
+            path = os.path.join(self.job_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _owned_state(self, job_id, owner):
+        """The job's state file, or None if it doesn't exist or (with `owner`) belongs to someone else."""
+        state = _read_json(_job_paths(self.job_dir, job_id)["state"])
+        if state is None or (owner is not None and state.get("owner") != owner):
+            return None
+        return state
+
+    def status(self, job_id, since=0, owner=None):
+        """
+        The job's STATUS_FIELDS plus progress entries from index `since`
+        onwards, or None for unknown jobs and, with `owner`, other owners' jobs.
+        """
+        paths = _job_paths(self.job_dir, job_id)
+        state = self._owned_state(job_id, owner)
+        if state is None:
+            return None
+        state = {field: state[field] for field in STATUS_FIELDS if field in state}
+
+        progress = []
+        try:
+            with open(paths["progress"]) as f:
+                for i, line in enumerate(f):
+                    # Skip a trailing line the worker is still writing
+                    if i >= since and line.endswith("\n"):
+                        progress.append(json.loads(line))
+        except FileNotFoundError:
+            pass
+
+        state["progress"] = progress
+        state["progress_offset"] = since
+        state["running_jobs"] = self.running_count()
+        return state
+
+    def stream(self, job_id, owner=None, poll_interval=0.5):
+        """Yield progress entries as they appear, then the final job status."""
+        since = 0
+        while True:
+            state = self.status(job_id, since, owner=owner)
+            if state is None:
+                return
+            for entry in state["progress"]:
+                yield entry
+            since += len(state["progress"])
+            if state["state"] in FINISHED_STATES:
+                state.pop("progress")
+                yield state
+                return
+            time.sleep(poll_interval)
+
+    def cancel(self, job_id, owner=None):
+        """Ask a job to stop. Returns False if the job is unknown, someone else's or already finished."""
+        paths = _job_paths(self.job_dir, job_id)
+        state = self._owned_state(job_id, owner)
+        if state is None or state["state"] in FINISHED_STATES:
+            return False
+
+        # The marker is checked by the worker between boosting rounds
+        open(paths["cancel"], "w").close()
+
+        with self._lock:
+            owned = self._futures.get(job_id)
+        if owned is not None:
+            owned[1].cancel()
+        return True
+
+    def load_model(self, job_id):
+        return joblib.load(_job_paths(self.job_dir, job_id)["model"])
+
+    def running_count(self):
+        """Jobs training right now, on the whole host."""
+        return sum(1 for state in self._jobs() if state["state"] == RUNNING)
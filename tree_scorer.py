@@ -0,0 +1,225 @@
+import json
+import numpy as np
+
+# Missing-value handling per node
+_NAN_DEFAULT, _ZERO_DEFAULT, _NAN_AS_ZERO = 0, 1, 2
+
+
+class CompiledEnsemble:
+    """
+    A boosted tree ensemble flattened into NumPy node tables.
+
+    Every tree's nodes live in the same arrays (feature, threshold, left,
+    default_left, value), laid out so a node's children are adjacent: a row
+    goes to left[node] when x < threshold and to left[node] + 1 otherwise.
+    Scoring walks all rows through all trees at once, one tree level per
+    step, so a handful of rows costs a few array operations instead of a
+    DataFrame + DMatrix round trip through the native library.
+    """
+
+    def __init__(self, feature_names, classes, objective, roots, tree_class, base_margin,
+                 feature, threshold, left, right, default_left, missing, value, depth, dtype):
+        self.feature_names = list(feature_names)
+        self.classes_ = np.asarray(classes)
+        self.objective = objective  # "softmax" or "sigmoid"
+        self.base_margin = np.asarray(base_margin, dtype=np.float64)
+        self.depth = depth
+        self.dtype = dtype
+
+        left, right = np.asarray(left, dtype=np.int64), np.asarray(right, dtype=np.int64)
+        order, self.roots = _adjacent_children(roots, left, right)
+        position = np.empty(len(left), dtype=np.int64)
+        position[order] = np.arange(len(order))
+        is_leaf = left[order] < 0
+
+        self.feature = np.where(is_leaf, 0, np.asarray(feature, dtype=np.int64)[order])
+        self.value = np.asarray(value, dtype=np.float64)[order]
+        # Leaves always take the "right" branch (nothing is < NaN, NaNs default right) and
+        # point one slot back, so finished trees stay put while deeper ones keep walking
+        self.threshold = np.where(is_leaf, np.nan, np.asarray(threshold, dtype=dtype)[order]).astype(dtype)
+        self.default_left = np.where(is_leaf, False, np.asarray(default_left, dtype=bool)[order])
+        self.missing = np.where(is_leaf, _NAN_DEFAULT, np.asarray(missing, dtype=np.int8)[order]).astype(np.int8)
+        self.left = np.where(is_leaf, np.arange(len(order)) - 1, position[np.maximum(left[order], 0)])
+
+        # Leaf value -> class margin, summed with one matrix product
+        self.tree_class = np.asarray(tree_class, dtype=np.int64)
+        self._class_onehot = np.zeros((len(self.roots), len(self.base_margin)))
+        self._class_onehot[np.arange(len(self.roots)), self.tree_class] = 1.0
+        self._needs_missing_modes = bool((self.missing != _NAN_DEFAULT).any())
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    def leaves(self, X):
+        """Leaf node index reached in every tree, shape (rows, trees)."""
+        X = np.ascontiguousarray(X, dtype=self.dtype)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        flat = X.ravel()
+        row_offset = (np.arange(len(X)) * X.shape[1])[:, None]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+
+        for _ in range(self.depth):
+            x = flat.take(row_offset + self.feature.take(node))
+            is_nan = np.isnan(x)
+            if self._needs_missing_modes:
+                mode = self.missing[node]
+                x = np.where(is_nan & (mode == _NAN_AS_ZERO), 0.0, x)
+                is_missing = np.where(mode == _ZERO_DEFAULT, is_nan | (x == 0), is_nan & (mode == _NAN_DEFAULT))
+            else:
+                is_missing = is_nan
+            with np.errstate(invalid="ignore"):
+                go_left = np.where(is_missing, self.default_left.take(node), x < self.threshold.take(node))
+            node = self.left.take(node) + ~go_left
+        return node
+
+    def predict_margin(self, X):
+        return self.value[self.leaves(X)] @ self._class_onehot + self.base_margin
+
+    def predict_proba(self, X):
+        margin = self.predict_margin(X)
+        if self.objective == "sigmoid":
+            positive = 1.0 / (1.0 + np.exp(-margin[:, 0]))
+            return np.column_stack([1.0 - positive, positive])
+        margin = margin - margin.max(axis=1, keepdims=True)
+        exp = np.exp(margin)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+def _adjacent_children(roots, left, right):
+    """Node order (breadth first per tree) that puts each node's two children next to each other."""
+    order, new_roots = [], []
+    for root in roots:
+        new_roots.append(len(order))
+        order.append(root)
+        i = len(order) - 1
+        while i < len(order):
+            node = order[i]
+            if left[node] >= 0:
+                order.extend((left[node], right[node]))
+            i += 1
+    return np.asarray(order, dtype=np.int64), np.asarray(new_roots, dtype=np.int64)
+
+
+def _compile_xgb(model):
+    booster = model.get_booster()
+    learner = json.loads(booster.save_raw("json"))["learner"]
+    objective = learner["objective"]["name"]
+    if objective not in ("multi:softprob", "multi:softmax", "binary:logistic"):
+        raise NotImplementedError(f"Unsupported XGBoost objective {objective}")
+    if learner["gradient_booster"]["name"] != "gbtree":
+        raise NotImplementedError("Only gbtree boosters can be compiled")
+
+    params = learner["learner_model_param"]
+    num_class = max(1, int(params["num_class"]))
+    base_score = np.atleast_1d(np.asarray(json.loads(params["base_score"].replace("E", "e")), dtype=np.float64))
+    if objective == "binary:logistic":
+        # Stored as a probability; the trees add to its logit
+        base_score = np.log(base_score / (1.0 - base_score))
+    base_margin = np.broadcast_to(base_score, (num_class,)).copy()
+
+    gbtree = learner["gradient_booster"]["model"]
+    trees, tree_info = gbtree["trees"], gbtree["tree_info"]
+    # sklearn's predict_proba stops at the best iteration after early stopping
+    best_iteration = booster.attr("best_iteration")
+    if best_iteration is not None:
+        per_iteration = num_class * int(gbtree["gbtree_model_param"]["num_parallel_tree"])
+        trees, tree_info = trees[:(int(best_iteration) + 1) * per_iteration], tree_info[:(int(best_iteration) + 1) * per_iteration]
+
+    tables = {name: [] for name in ("feature", "threshold", "left", "right", "default_left", "value")}
+    roots, depth = [], 0
+    for tree in trees:
+        if any(tree["split_type"]):
+            raise NotImplementedError("Categorical splits are not supported")
+        offset = sum(len(t) for t in tables["feature"])
+        roots.append(offset)
+        left = np.asarray(tree["left_children"])
+        is_leaf = left < 0
+        tables["feature"].append(np.where(is_leaf, 0, tree["split_indices"]))
+        tables["threshold"].append(np.asarray(tree["split_conditions"], dtype=np.float32))
+        tables["left"].append(np.where(is_leaf, -1, left + offset))
+        tables["right"].append(np.where(is_leaf, -1, np.asarray(tree["right_children"]) + offset))
+        tables["default_left"].append(tree["default_left"])
+        # Leaf values are stored in split_conditions
+        tables["value"].append(np.where(is_leaf, tree["split_conditions"], 0.0))
+        depth = max(depth, _tree_depth(left, tree["right_children"]))
+
+    flat = {name: np.concatenate(parts) for name, parts in tables.items()}
+    classes = getattr(model, "classes_", np.arange(max(num_class, 2)))
+    return CompiledEnsemble(
+        booster.feature_names or [f"f{i}" for i in range(int(params["num_feature"]))], classes,
+        "sigmoid" if objective == "binary:logistic" else "softmax",
+        roots, tree_info, base_margin,
+        flat["feature"], flat["threshold"], flat["left"], flat["right"], flat["default_left"],
+        np.full(len(flat["feature"]), _NAN_DEFAULT), flat["value"], depth,
+        np.float32  # XGBoost compares in single precision
+    )
+
+
+def _tree_depth(left, right):
+    depth, level = 0, [0]
+    while level:
+        level = [child for node in level for child in (left[node], right[node]) if child >= 0]
+        depth += 1 if level else 0
+    return depth
+
+
+def _compile_lgbm(model):
+    booster = model.booster_
+    dump = booster.dump_model()  # trees up to the best iteration, like predict_proba
+    objective = dump["objective"].split()[0]
+    if objective not in ("multiclass", "binary"):
+        raise NotImplementedError(f"Unsupported LightGBM objective {objective}")
+    num_class = dump["num_class"] if objective == "multiclass" else 1
+
+    tables = {name: [] for name in ("feature", "threshold", "left", "right", "default_left", "missing", "value")}
+    roots, tree_class, depth = [], [], 0
+
+    def add(node, level):
+        index = len(tables["feature"])
+        for name in tables:
+            tables[name].append(0)
+        if "leaf_value" in node:
+            tables["left"][index] = tables["right"][index] = -1
+            tables["value"][index] = node["leaf_value"]
+            return index, level
+        if node["decision_type"] != "<=":
+            raise NotImplementedError("Categorical splits are not supported")
+        tables["feature"][index] = node["split_feature"]
+        # x <= t is the same test as x < nextafter(t, +inf)
+        tables["threshold"][index] = np.nextafter(node["threshold"], np.inf)
+        tables["default_left"][index] = node["default_left"]
+        tables["missing"][index] = {"NaN": _NAN_DEFAULT, "Zero": _ZERO_DEFAULT}.get(node["missing_type"], _NAN_AS_ZERO)
+        tables["left"][index], left_depth = add(node["left_child"], level + 1)
+        tables["right"][index], right_depth = add(node["right_child"], level + 1)
+        return index, max(left_depth, right_depth)
+
+    for i, tree in enumerate(dump["tree_info"]):
+        root, tree_depth = add(tree["tree_structure"], 0)
+        roots.append(root)
+        tree_class.append(i % num_class)
+        depth = max(depth, tree_depth)
+
+    return CompiledEnsemble(
+        dump["feature_names"], model.classes_, "softmax" if objective == "multiclass" else "sigmoid",
+        roots, tree_class, np.zeros(num_class),
+        tables["feature"], tables["threshold"], tables["left"], tables["right"], tables["default_left"],
+        tables["missing"], tables["value"], depth, np.float64
+    )
+
+
+def compile_model(model):
+    """
+    Compile a fitted XGBClassifier or LGBMClassifier. Raises TypeError for
+    other models and NotImplementedError for unsupported trees (categorical
+    splits, other objectives), in which case use the model's own predict.
+    """
+    if hasattr(model, "get_booster"):
+        return _compile_xgb(model)
+    if hasattr(model, "booster_"):
+        return _compile_lgbm(model)
+    raise TypeError(f"Cannot compile a model of type {type(model).__name__}")
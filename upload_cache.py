@@ -0,0 +1,129 @@
+import os, json, time, uuid, shutil, hashlib, threading
+from collections import OrderedDict
+
+from dataset import CompactDataset, FEATURE_DTYPE
+from preprocessing import PIPELINE_VERSION
+
+
+def _dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(dirpath, name)) for name in filenames)
+    return total
+
+
+class UploadCache:
+    """
+    Processed /upload results keyed by the SHA-256 of the raw upload bytes.
+
+    Each entry lives in `root/<key>/` (the CompactDataset as .npy files plus
+    a JSON file with the feature list, raw columns and summary),
+    so it survives restarts and is shared by all workers on the host. When
+    the cache grows past `max_bytes` the least recently used entries are
+    deleted. The last `memory_entries` hits are also kept in memory.
+    """
+
+    def __init__(self, root, max_bytes=256 * 1024 * 1024, memory_entries=4):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(root, exist_ok=True)
+
+    @staticmethod
+    def digest(stream, block_size=1024 * 1024):
+        """Hash a seekable stream from the start, leaving it rewound."""
+        sha = hashlib.sha256()
+        stream.seek(0)
+        for block in iter(lambda: stream.read(block_size), b""):
+            sha.update(block)
+        stream.seek(0)
+        return sha.hexdigest()
+
+    @staticmethod
+    def key(digest, variant=""):
+        # Different processing options (e.g. sketched medians) and feature dtypes get their own entry
+        return f"v{PIPELINE_VERSION}-{FEATURE_DTYPE.name}-{digest}" + (f"-{variant}" if variant else "")
+
+    def frame_paths(self, key):
+        """Where the entry's dataset is stored, for SessionStore.update(prewritten=...)."""
+        return {"dataset": os.path.join(self.root, key, "dataset")}
+
+    def get(self, key):
+        """Return (dataset, features, source_columns, summary) or None."""
+        path = os.path.join(self.root, key)
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+
+        if entry is None:
+            try:
+                with open(os.path.join(path, "meta.json")) as f:
+                    meta = json.load(f)
+                dataset = CompactDataset.load(os.path.join(path, "dataset"))
+            except (FileNotFoundError, NotADirectoryError):
+                self.misses += 1
+                return None
+            entry = (dataset, meta["features"], meta["source_columns"], meta["summary"])
+            self._remember(key, entry)
+
+        try:
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            pass
+        self.hits += 1
+        return entry
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def put(self, key, dataset, features, source_columns, summary):
+        path = os.path.join(self.root, key)
+        if os.path.isdir(path):
+            return
+
+        tmp = os.path.join(self.root, f".tmp-{uuid.uuid4().hex}")
+        dataset.save(os.path.join(tmp, "dataset"))
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump({"features": features, "source_columns": source_columns, "summary": summary}, f)
+
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Another worker cached the same upload first
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self._remember(key, (dataset, features, source_columns, summary))
+
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if name.startswith(".tmp-"):
+                    # Leftovers from a crashed write
+                    if time.time() - os.path.getmtime(path) > 3600:
+                        shutil.rmtree(path, ignore_errors=True)
+                    continue
+                entries.append((os.path.getmtime(path), _dir_size(path), path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+                self._memory.pop(os.path.basename(path), None)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "max_bytes": self.max_bytes}